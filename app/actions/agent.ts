@@ -131,7 +131,7 @@ export async function generateReportAction(postId?: string) {
         const response = await fetch(`${baseUrl}/generate_report`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ comment_ids: targetIds })
+            body: JSON.stringify({ comment_ids: targetIds, post_id: postId || "" })
         });
 
         if (!response.ok) throw new Error("Local LLM service failed");
@@ -150,24 +150,26 @@ export async function getTopCommentAction(postId?: string) {
     const baseUrl = localUrl.replace("/embed", "");
 
     try {
-        let query = supabase
-            .from('comments')
-            .select('id')
-            .order('created_at', { ascending: false });
-
+        let body;
         if (postId) {
-            query = query.eq('post_id', postId);
-        }
-
-        const { data: comments } = await query.limit(100);
-        const targetIds = comments?.map(c => c.id) || [];
+            // Served from the precomputed per-post aggregate (single keyed read)
+            body = { post_id: postId };
+        } else {
+            const { data: comments } = await supabase
+                .from('comments')
+                .select('id')
+                .order('created_at', { ascending: false })
+                .limit(100);
+            const targetIds = comments?.map(c => c.id) || [];
 
-        if (targetIds.length === 0) return { top_comment: null };
+            if (targetIds.length === 0) return { top_comment: null };
+            body = { comment_ids: targetIds };
+        }
 
         const response = await fetch(`${baseUrl}/top_comment`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ comment_ids: targetIds })
+            body: JSON.stringify(body)
         });
 
         if (!response.ok) throw new Error("Local LLM service failed");
@@ -264,25 +266,45 @@ export async function generateViaCliAction(taskId: string) {
         // Helper for logging
         const addLog = async (msg: string, status: string = 'processing', step?: string) => {
             console.log(`🤖 [CLI Task ${taskId}] ${step ? `[${step}] ` : ''}${msg}`);
-            const { data: currentTask } = await supabase.from('agent_tasks').select('logs').eq('id', taskId).single();
-            const newLogEntry = { timestamp: new Date().toISOString(), message: msg, status };
-            const newLogs = [...(currentTask?.logs || []), newLogEntry];
-            await supabase.from('agent_tasks').update({
-                logs: newLogs,
-                status: status === 'failed' ? 'failed' : status === 'completed' ? 'completed' : 'processing',
-                current_step: step || msg,
-                last_heartbeat: new Date().toISOString()
-            }).eq('id', taskId);
+            // Appended in SQL so lines the backend writes for this task at the same time survive
+            await supabase.rpc('append_agent_task_log', {
+                p_task_id: taskId,
+                p_entry: { timestamp: new Date().toISOString(), message: msg, status },
+                p_status: status === 'failed' ? 'failed' : status === 'completed' ? 'completed' : 'processing',
+                p_step: step || msg
+            });
         };
 
-        // 3. Get feedback context (Unified: Find the "best" comment for this post)
+        // 3. Get feedback context: the coalesced comments if the task collected several,
+        // otherwise the "best" comment for this post
         const postId = task.monitored_posts.post_id;
-        const { top_comment, error: topError } = await getTopCommentAction(postId);
+        const coalescedIds: string[] = task.result?.comment_ids || [];
+        const { top_comment, error: topError } = coalescedIds.length > 1
+            ? { top_comment: null, error: null }
+            : await getTopCommentAction(postId);
 
         let feedback = "";
         let taskDescription = "";
 
-        if (top_comment) {
+        if (coalescedIds.length > 1) {
+            const { data: analyses } = await supabase
+                .from('feedback_analysis')
+                .select('comment_id, actionable_summary, priority_score')
+                .in('comment_id', coalescedIds)
+                .order('priority_score', { ascending: false });
+            const { data: comments } = await supabase
+                .from('comments')
+                .select('id, content')
+                .in('id', coalescedIds);
+
+            const contentById = new Map((comments || []).map((c: any) => [c.id, c.content]));
+            const points = (analyses || []).map((a: any) => a.actionable_summary || contentById.get(a.comment_id)).filter(Boolean);
+            feedback = contentById.get(task.result?.comment_id) || points[0] || "Community request for improvements.";
+            taskDescription = points.length > 1
+                ? `Address this related feedback from ${points.length} users:\n${points.map((p: string) => `- ${p}`).join("\n")}`
+                : points[0] || feedback;
+            await addLog(`Coalesced ${coalescedIds.length} related comments into one task.`, "processing", "Context Loaded");
+        } else if (top_comment) {
             feedback = top_comment.content;
             taskDescription = top_comment.summary || feedback;
             await addLog(`Found top actionable feedback: "${feedback.substring(0, 50)}..."`, "processing", "Context Loaded");
@@ -352,17 +374,19 @@ export async function generateViaCliAction(taskId: string) {
 
         await addLog(`Generated ${generateResult.patches.length} patches. Repository updated locally.`, "processing", "Patches Ready");
 
-        // 7. Save patches to generated_code table
+        // 7. Save patches to generated_code table (unless the backend already streamed them there)
         const fileChanges: { path: string, content: string, explanation: string }[] = [];
 
         for (const patch of generateResult.patches) {
-            await supabase.from('generated_code').insert({
-                task_id: taskId,
-                file_path: patch.path,
-                new_code: patch.new_code,
-                explanation: patch.explanation,
-                status: 'ready'
-            });
+            if (!generateResult.streamed) {
+                await supabase.from('generated_code').insert({
+                    task_id: taskId,
+                    file_path: patch.path,
+                    new_code: patch.new_code,
+                    explanation: patch.explanation,
+                    status: 'ready'
+                });
+            }
 
             fileChanges.push({
                 path: patch.path,
@@ -382,9 +406,9 @@ export async function generateViaCliAction(taskId: string) {
                 current_step: 'PR Link: ' + prUrl
             }).eq('id', taskId);
 
-            await supabase.from('generated_code').update({ status: 'applied' }).eq('task_id', taskId);
+            await supabase.from('generated_code').update({ status: 'applied' }).eq('task_id', taskId).neq('status', 'failed');
 
-            const { data: firstCode } = await supabase.from('generated_code').select('id').eq('task_id', taskId).limit(1).single();
+            const { data: firstCode } = await supabase.from('generated_code').select('id').eq('task_id', taskId).neq('status', 'failed').limit(1).single();
             if (firstCode) {
                 await supabase.from('github_prs').insert({
                     generated_code_id: firstCode.id,
@@ -404,13 +428,13 @@ export async function generateViaCliAction(taskId: string) {
         return { success: true, url: prUrl };
     } catch (e: any) {
         console.error("❌ CLI Agent Action Error:", e.message);
-        const { data: currentTask } = await supabase.from('agent_tasks').select('logs').eq('id', taskId).single();
-        const failLogs = [...(currentTask?.logs || []), { timestamp: new Date().toISOString(), message: `ERROR: ${e.message}`, status: 'failed' }];
-
+        await supabase.rpc('append_agent_task_log', {
+            p_task_id: taskId,
+            p_entry: { timestamp: new Date().toISOString(), message: `ERROR: ${e.message}`, status: 'failed' },
+            p_status: 'failed',
+            p_step: 'Failed: ' + e.message
+        });
         await supabase.from('agent_tasks').update({
-            status: 'failed',
-            logs: failLogs,
-            current_step: 'Failed: ' + e.message,
             result: { ...task.result, error: e.message }
         }).eq('id', taskId);
         return { error: e.message };
@@ -10,6 +10,31 @@ export interface ScrapeResult {
     error?: string;
 }
 
+// Hands the whole thread to the backend's pipelined /ingest (insert, embed, dedup, triage).
+// Returns false if the backend is unreachable so callers can fall back to a plain insert.
+// The backend stores the comments before it answers, so a job that fails later leaves
+// them for the backfill instead of losing them.
+async function ingestComments(postId: string, userId: string, contents: string[]): Promise<boolean> {
+    const localUrl = process.env.LOCAL_EMBEDDING_URL || "http://localhost:8000/embed";
+    const baseUrl = localUrl.replace("/embed", "");
+
+    try {
+        const response = await fetch(`${baseUrl}/ingest`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ post_id: postId, user_id: userId, comments: contents })
+        });
+        if (!response.ok) {
+            console.error("Ingest failed:", response.status, await response.text());
+            return false;
+        }
+        return true;
+    } catch (e) {
+        console.error("Ingest unavailable, falling back to direct insert", e);
+        return false;
+    }
+}
+
 export async function saveRedditCommentsAction(url: string, comments: RedditComment[], repoLink?: string) {
     const supabase = createClient();
     const { data: { user } } = await supabase.auth.getUser();
@@ -44,7 +69,11 @@ export async function saveRedditCommentsAction(url: string, comments: RedditComm
             return { success: false, error: "Failed to create post record: " + postError.message };
         }
 
-        // 2. Insert Comments
+        // 2. Insert Comments (through the backend pipeline when it's up)
+        if (await ingestComments(post.id, user.id, comments.map(c => `[${c.author}] ${c.content}`))) {
+            return { success: true, postId: post.id };
+        }
+
         const commentsToInsert = comments.map(c => ({
             post_id: post.id,
             user_id: user.id, // The user who scraped it owns the record in our DB? Or null? 
@@ -132,6 +161,10 @@ export async function saveProductHuntCommentsAction(url: string, comments: Produ
             return { success: false, error: "Failed to create post record: " + postError.message };
         }
 
+        if (await ingestComments(post.id, user.id, comments.map(c => `[${c.author}] ${c.content}`))) {
+            return { success: true, postId: post.id };
+        }
+
         const commentsToInsert = comments.map(c => ({
             post_id: post.id,
             user_id: user.id,
@@ -34,7 +34,8 @@ export async function POST(req: Request) {
                             .from("comment_embeddings")
                             .upsert({
                                 comment_id: comment.id,
-                                embedding: embedding
+                                embedding: embedding,
+                                model_id: data.model_id
                             });
                         results.push({ id: comment.id, success: !upsertError });
                     }
@@ -69,7 +70,8 @@ export async function POST(req: Request) {
                         .from("comment_embeddings")
                         .upsert({
                             comment_id: commentId,
-                            embedding: embedding
+                            embedding: embedding,
+                            model_id: data.model_id
                         });
                     if (upsertError) throw upsertError;
                 }
@@ -30,17 +30,31 @@ export function CodeDiffPreview({ taskId, prUrl }: CodeDiffPreviewProps) {
                 .from('generated_code')
                 .select('*')
                 .eq('task_id', taskId)
+                .neq('status', 'failed')
+                .order('created_at', { ascending: true })
 
             if (data && !error) {
                 setGeneratedCode(data)
                 if (data.length > 0) {
-                    setSelectedFile(data[0].file_path)
+                    setSelectedFile(current => current ?? data[0].file_path)
                 }
             }
             setLoading(false)
         }
 
         fetchGeneratedCode()
+
+        // Files are written as the agent finishes them
+        const channel = supabase
+            .channel(`generated_code_${taskId}`)
+            .on('postgres_changes', { event: '*', schema: 'public', table: 'generated_code', filter: `task_id=eq.${taskId}` }, () => {
+                fetchGeneratedCode()
+            })
+            .subscribe()
+
+        return () => {
+            supabase.removeChannel(channel)
+        }
     }, [taskId, supabase])
 
     if (loading) {
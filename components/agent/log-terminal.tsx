@@ -3,6 +3,8 @@
 import { useEffect, useState, useRef } from "react";
 import { Terminal, ChevronRight, Loader2 } from "lucide-react";
 
+const MAX_LINES = 500;
+
 export function LogTerminal() {
     const [logs, setLogs] = useState<string>("");
     const [loading, setLoading] = useState(true);
@@ -24,8 +26,24 @@ export function LogTerminal() {
 
     useEffect(() => {
         fetchLogs();
-        const interval = setInterval(fetchLogs, 5000); // Poll every 5s (optimized)
-        return () => clearInterval(interval);
+
+        // Follow new lines over SSE; fall back to polling if the stream is unavailable
+        let interval: ReturnType<typeof setInterval> | null = null;
+        const source = new EventSource("http://localhost:8000/logs/stream");
+        source.onmessage = (event) => {
+            setLogs(prev => {
+                const lines = prev ? prev.replace(/\n$/, "").split("\n") : [];
+                return [...lines, event.data].slice(-MAX_LINES).join("\n");
+            });
+        };
+        source.onerror = () => {
+            source.close();
+            if (!interval) interval = setInterval(fetchLogs, 5000);
+        };
+        return () => {
+            source.close();
+            if (interval) clearInterval(interval);
+        };
     }, []);
 
     useEffect(() => {
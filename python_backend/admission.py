@@ -0,0 +1,142 @@
+import heapq
+import math
+import os
+import time
+import logging
+
+import metrics
+from rate_limit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Admission control for the LLM endpoints. Every admitted request adds its class's
+# recent service time to a backlog shared by the loaded model's decoding slots
+# (LLM_SLOTS until a model is loaded); a new request whose
+# estimated wait + service time would miss its class SLO is rejected with 429
+# and a Retry-After of when it would fit, instead of queueing until the client
+# gives up and the work is wasted.
+LLM_SLOTS = max(1, int(os.getenv("LLM_SLOTS", "1")))
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_EWMA_ALPHA = 0.2
+# Per-class latency SLO (seconds, 0 = unlimited) and the service time assumed before any is measured
+REQUEST_CLASSES = {
+    "analyze": {"slo": float(os.getenv("ADMISSION_SLO_ANALYZE_SECONDS", "60")), "initial": 10.0},
+    "report": {"slo": float(os.getenv("ADMISSION_SLO_REPORT_SECONDS", "300")), "initial": 60.0},
+    "codegen": {"slo": float(os.getenv("ADMISSION_SLO_CODEGEN_SECONDS", "900")), "initial": 180.0},
+    "chat": {"slo": float(os.getenv("ADMISSION_SLO_CHAT_SECONDS", "120")), "initial": 20.0},
+}
+# Per-caller quotas (X-Caller-Id header, else client address); 0 disables
+ADMISSION_CALLER_CONCURRENCY = int(os.getenv("ADMISSION_CALLER_CONCURRENCY", "4"))
+ADMISSION_CALLER_RATE_PER_MINUTE = float(os.getenv("ADMISSION_CALLER_RATE_PER_MINUTE", "0"))
+CALLER_IDLE_SECONDS = 3600
+
+class AdmissionRejected(Exception):
+    """Raised when a request should be turned away; carries the Retry-After in seconds."""
+
+    def __init__(self, message: str, retry_after: float, reason: str):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason # "slo" or "caller_quota"
+
+class _Ticket:
+    __slots__ = ("request_class", "caller", "admitted_at", "expected_wait")
+
+    def __init__(self, request_class: str, caller: str, expected_wait: float):
+        self.request_class = request_class
+        self.caller = caller
+        self.admitted_at = time.monotonic()
+        self.expected_wait = expected_wait
+
+class AdmissionController:
+    """Queue-aware admission for LLM-bound requests. Call from the event loop only."""
+
+    def __init__(self, slots: int = LLM_SLOTS, classes: dict = REQUEST_CLASSES):
+        self.slots = slots
+        self.classes = classes
+        self.service_seconds = {name: c["initial"] for name, c in classes.items()}
+        self.in_flight: set[_Ticket] = set()
+        self._caller_rates: dict[str, tuple[AsyncRateLimiter, float]] = {}
+
+    def _remaining(self, ticket: _Ticket, now: float) -> float:
+        # Unknown progress: assume a typical request and never less than a second
+        return max(self.service_seconds[ticket.request_class] - (now - ticket.admitted_at), 1.0)
+
+    def estimated_wait(self) -> float:
+        """Seconds a request admitted now would wait for a slot."""
+        if len(self.in_flight) < self.slots:
+            return 0.0
+        now = time.monotonic()
+        tickets = sorted(self.in_flight, key=lambda t: t.admitted_at)
+        # The oldest requests are assumed to hold the slots, the rest queue FIFO behind them
+        free_at = [self._remaining(t, now) for t in tickets[:self.slots]]
+        heapq.heapify(free_at)
+        for ticket in tickets[self.slots:]:
+            heapq.heappush(free_at, heapq.heappop(free_at) + self.service_seconds[ticket.request_class])
+        return free_at[0]
+
+    def _check_caller(self, caller: str):
+        now = time.monotonic()
+        mine = [t for t in self.in_flight if t.caller == caller]
+        if ADMISSION_CALLER_CONCURRENCY > 0 and len(mine) >= ADMISSION_CALLER_CONCURRENCY:
+            soonest = min(self._remaining(t, now) for t in mine)
+            raise AdmissionRejected(f"Too many concurrent requests for caller {caller}.", soonest, "caller_quota")
+        if ADMISSION_CALLER_RATE_PER_MINUTE > 0:
+            for idle in [c for c, (_, seen) in self._caller_rates.items() if now - seen > CALLER_IDLE_SECONDS]:
+                del self._caller_rates[idle]
+            limiter = self._caller_rates.get(caller, (None, now))[0] or AsyncRateLimiter(
+                ADMISSION_CALLER_RATE_PER_MINUTE / 60, burst=max(1.0, ADMISSION_CALLER_RATE_PER_MINUTE / 6)
+            )
+            self._caller_rates[caller] = (limiter, now)
+            wait = limiter.try_acquire()
+            if wait:
+                raise AdmissionRejected(f"Request rate quota exceeded for caller {caller}.", wait, "caller_quota")
+
+    def admit(self, request_class: str, caller: str) -> _Ticket:
+        """Admit a request or raise AdmissionRejected."""
+        try:
+            self._check_caller(caller)
+            wait = self.estimated_wait()
+            metrics.ADMISSION_ESTIMATED_WAIT_SECONDS.observe(wait, request_class=request_class)
+            slo = self.classes[request_class]["slo"]
+            predicted = wait + self.service_seconds[request_class]
+            # An idle node always admits, even if one request alone would miss the SLO
+            if slo > 0 and wait > 0 and predicted > slo:
+                raise AdmissionRejected(
+                    f"Overloaded: estimated {predicted:.0f}s for {request_class} exceeds the {slo:.0f}s SLO.",
+                    predicted - slo, "slo"
+                )
+        except AdmissionRejected as e:
+            metrics.ADMISSION_REJECTIONS.inc(request_class=request_class, reason=e.reason)
+            logger.warning(f"🚦 Rejected {request_class} request from {caller}: {e} (Retry-After {e.retry_after}s)")
+            raise
+        ticket = _Ticket(request_class, caller, wait)
+        self.in_flight.add(ticket)
+        metrics.ADMISSION_IN_FLIGHT.inc(request_class=request_class)
+        return ticket
+
+    def release(self, ticket: _Ticket, succeeded: bool = True):
+        """Finish a request; successful ones update the class's service-time estimate."""
+        self.in_flight.discard(ticket)
+        metrics.ADMISSION_IN_FLIGHT.dec(request_class=ticket.request_class)
+        if succeeded:
+            # Time spent queued behind others is not service time
+            elapsed = time.monotonic() - ticket.admitted_at
+            service = max(elapsed - ticket.expected_wait, 0.1)
+            previous = self.service_seconds[ticket.request_class]
+            self.service_seconds[ticket.request_class] = previous + ADMISSION_EWMA_ALPHA * (service - previous)
+
+    def resize(self, slots: int):
+        """Match the loaded LLMService's slot count, which can differ from LLM_SLOTS (e.g. one on GPU)."""
+        slots = max(1, slots)
+        if slots != self.slots:
+            logger.info(f"🚦 Admission control now assumes {slots} LLM slot(s) (was {self.slots}).")
+            self.slots = slots
+
+    def status(self) -> dict:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "slots": self.slots,
+            "in_flight": len(self.in_flight),
+            "estimated_wait_seconds": round(self.estimated_wait(), 1),
+            "service_seconds": {name: round(s, 1) for name, s in self.service_seconds.items()},
+        }
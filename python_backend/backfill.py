@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+import logging
+
+from rate_limit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "64"))
+BACKFILL_RATE_PER_SECOND = float(os.getenv("BACKFILL_RATE_PER_SECOND", "2"))
+BACKFILL_INTERVAL_SECONDS = float(os.getenv("BACKFILL_INTERVAL_SECONDS", "900"))
+BACKFILL_MIN_AGE_SECONDS = int(os.getenv("BACKFILL_MIN_AGE_SECONDS", "120"))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", os.getenv("LLM_SLOTS", "1")))
+BACKFILL_MAX_ATTEMPTS = int(os.getenv("BACKFILL_MAX_ATTEMPTS", "3")) # Failed triages per comment before it is skipped
+
+# Triage outcomes. Only TRIAGE_FAILED counts towards BACKFILL_MAX_ATTEMPTS: a
+# missing or still-loading model says nothing about the comment.
+TRIAGE_OK = "ok"
+TRIAGE_FAILED = "failed"
+TRIAGE_UNAVAILABLE = "unavailable"
+
+class BackfillPipeline:
+    """Catch up on comments that never got an embedding or an analysis.
+
+    Scans comments in (created_at, id) keyset pages via find_unprocessed_comments,
+    embeds the missing ones in batches, triages the unanalyzed ones under a rate
+    limit, and checkpoints the cursor after every page. A finished pass resets
+    the cursor, so failures left behind are retried on the next pass, until a
+    comment has failed BACKFILL_MAX_ATTEMPTS times (backfill_attempts). While
+    `triage_ready()` is false pages are only embedded and no failures are recorded.
+    """
+
+    def __init__(self, supabase, embed_batch, triage, sharded: bool = False, name: str = "comment_backfill",
+                 embedding_model=None, triage_ready=None):
+        self.supabase = supabase
+        self.embed_batch = embed_batch # async (texts) -> list[list[float]]
+        self.embedding_model = embedding_model # () -> model id stored with each vector
+        self.triage = triage # async (comment_id, content) -> TRIAGE_OK | TRIAGE_FAILED | TRIAGE_UNAVAILABLE
+        self.triage_ready = triage_ready # optional () -> bool; false skips the triage step
+        self.sharded = sharded
+        self.name = name
+        self.limiter = AsyncRateLimiter(BACKFILL_RATE_PER_SECOND, burst=BACKFILL_BATCH_SIZE)
+        self._lock = asyncio.Lock()
+        self.last_run = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def _load_checkpoint(self) -> dict:
+        res = await self.supabase.table("pipeline_checkpoints").select("*").eq("name", self.name).execute()
+        return res.data[0] if res.data else {"name": self.name, "cursor_created_at": None, "cursor_id": None, "passes_completed": 0}
+
+    async def _save_checkpoint(self, checkpoint: dict):
+        checkpoint["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        await self.supabase.table("pipeline_checkpoints").upsert(checkpoint).execute()
+
+    async def _embed_page(self, rows: list[dict]) -> int:
+        missing = [r for r in rows if not r["has_embedding"]]
+        if not missing:
+            return 0
+        await self.limiter.acquire(len(missing))
+        embeddings = await self.embed_batch([r["content"] for r in missing])
+        await self.supabase.table("comment_embeddings").upsert([
+            {"comment_id": r["id"], "embedding": e, "model_id": self.embedding_model() if self.embedding_model else None}
+            for r, e in zip(missing, embeddings)
+        ]).execute()
+        return len(missing)
+
+    async def _triage_page(self, rows: list[dict]) -> tuple[int, int]:
+        missing = [r for r in rows if not r["has_analysis"]]
+        semaphore = asyncio.Semaphore(max(1, BACKFILL_CONCURRENCY))
+
+        async def run(row):
+            async with semaphore:
+                await self.limiter.acquire()
+                return await self.triage(row["id"], row["content"])
+
+        results = await asyncio.gather(*(run(r) for r in missing), return_exceptions=True)
+        for row, result in zip(missing, results):
+            if isinstance(result, Exception):
+                # Storage or transport errors are retried next pass without counting against the comment
+                logger.error(f"❌ Backfill triage of {row['id']} raised: {result}")
+        analyzed = sum(result == TRIAGE_OK for result in results)
+        failed_ids = [row["id"] for row, result in zip(missing, results) if result == TRIAGE_FAILED]
+        if failed_ids:
+            await self.supabase.rpc("record_backfill_failures", {"p_comment_ids": failed_ids}).execute()
+        return analyzed, len(failed_ids)
+
+    async def run_pass(self, stop_event: asyncio.Event | None = None) -> dict:
+        """Run (or resume) one pass over the comments table."""
+        if self._lock.locked():
+            return {"skipped": "A backfill pass is already running."}
+        async with self._lock:
+            start = time.perf_counter()
+            stats = {"scanned": 0, "embedded": 0, "analyzed": 0, "failed": 0, "enqueued": 0}
+            checkpoint = await self._load_checkpoint()
+            if checkpoint.get("cursor_id"):
+                logger.info(f"⏪ Resuming backfill from {checkpoint['cursor_created_at']} / {checkpoint['cursor_id']}")
+
+            while not (stop_event and stop_event.is_set()):
+                res = await self.supabase.rpc("find_unprocessed_comments", {
+                    "p_after_created_at": checkpoint.get("cursor_created_at"),
+                    "p_after_id": checkpoint.get("cursor_id"),
+                    "p_limit": BACKFILL_BATCH_SIZE,
+                    "p_min_age_seconds": BACKFILL_MIN_AGE_SECONDS,
+                    "p_max_attempts": BACKFILL_MAX_ATTEMPTS
+                }).execute()
+                rows = res.data or []
+                if not rows:
+                    checkpoint.update(
+                        cursor_created_at=None, cursor_id=None,
+                        passes_completed=(checkpoint.get("passes_completed") or 0) + 1,
+                        last_pass_completed_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                    )
+                    await self._save_checkpoint(checkpoint)
+                    break
+
+                stats["scanned"] += len(rows)
+                if self.sharded:
+                    # Lease workers do the processing; only hand the ids over
+                    await self.supabase.rpc("enqueue_comment_jobs", {"p_comment_ids": [r["id"] for r in rows]}).execute()
+                    stats["enqueued"] += len(rows)
+                else:
+                    stats["embedded"] += await self._embed_page(rows)
+                    if self.triage_ready is None or self.triage_ready():
+                        analyzed, failed = await self._triage_page(rows)
+                        stats["analyzed"] += analyzed
+                        stats["failed"] += failed
+                    else:
+                        stats["skipped_triage"] = stats.get("skipped_triage", 0) + sum(not r["has_analysis"] for r in rows)
+
+                checkpoint.update(cursor_created_at=rows[-1]["created_at"], cursor_id=rows[-1]["id"])
+                await self._save_checkpoint(checkpoint)
+
+            stats["seconds"] = round(time.perf_counter() - start, 2)
+            self.last_run = {**stats, "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            if stats["scanned"]:
+                logger.info(f"✅ Backfill pass: {stats}")
+            return stats
+
+    async def run_scheduled(self, stop_event: asyncio.Event, ready):
+        """Run a pass once `ready()` resolves (startup), then every BACKFILL_INTERVAL_SECONDS."""
+        if not await ready():
+            logger.warning("⚠️ Backfill disabled: models unavailable.")
+            return
+        while not stop_event.is_set():
+            try:
+                await self.run_pass(stop_event)
+            except Exception as e:
+                logger.error(f"❌ Backfill pass failed: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=BACKFILL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def status(self) -> dict:
+        return {"running": self.running, "last_run": self.last_run}
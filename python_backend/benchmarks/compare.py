@@ -0,0 +1,72 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json [--tolerance 0.1]
+
+Exits non-zero if any throughput metric dropped, or any latency metric grew,
+by more than the tolerance.
+"""
+import argparse
+import json
+import sys
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def direction(metric: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if informational."""
+    leaf = metric.rsplit(".", 1)[-1]
+    if leaf.endswith("per_second"):
+        return 1
+    if leaf.endswith("_ms") or leaf.endswith("seconds"):
+        return -1
+    return 0
+
+def compare(baseline: dict, candidate: dict, tolerance: float) -> list[dict]:
+    old, new = flatten(baseline["results"]), flatten(candidate["results"])
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        better = direction(metric)
+        if not better or not old[metric]:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        rows.append({
+            "metric": metric,
+            "baseline": old[metric],
+            "candidate": new[metric],
+            "change": round(change, 4),
+            "regression": change * better < -tolerance,
+        })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative change before flagging")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable output")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    rows = compare(baseline, candidate, args.tolerance)
+
+    if args.json:
+        print(json.dumps({"baseline": baseline.get("version"), "candidate": candidate.get("version"), "metrics": rows}, indent=2))
+    else:
+        print(f"{baseline.get('version')} -> {candidate.get('version')}")
+        for row in rows:
+            flag = "❌" if row["regression"] else "  "
+            print(f"{flag} {row['metric']:<45} {row['baseline']:>12} {row['candidate']:>12} {row['change']:+.1%}")
+    sys.exit(1 if any(r["regression"] for r in rows) else 0)
+
+if __name__ == "__main__":
+    main()
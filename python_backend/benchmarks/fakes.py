@@ -0,0 +1,329 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+# Offline stand-ins for the services main.py talks to. They implement only the
+# surface main.py, backfill.py and ingest.py use, with configurable latencies,
+# and record when rows land so the harness can measure end-to-end latency.
+
+def _stable_seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+
+# --- Supabase ---
+
+class _Query:
+    """A PostgREST-style request builder over FakeSupabase's in-memory tables."""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters: list = []
+        self.order_by = None
+        self.limit_n = None
+        self.single_row = False
+
+    def select(self, columns: str = "*", **kwargs):
+        self.columns = columns
+        return self
+
+    def insert(self, rows, **kwargs):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, **kwargs):
+        self.op, self.payload = "upsert", rows
+        return self
+
+    def update(self, data: dict):
+        self.op, self.payload = "update", data
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self.filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, n: int):
+        self.limit_n = n
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def _matches(self) -> list[dict]:
+        rows = [r for r in self.db.tables.setdefault(self.table, []) if all(f(r) for f in self.filters)]
+        if self.order_by:
+            column, desc = self.order_by
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        if self.limit_n is not None:
+            rows = rows[:self.limit_n]
+        return rows
+
+    def _project(self, row: dict) -> dict:
+        if self.columns.strip() == "*":
+            return dict(row)
+        out = {}
+        for part in _split_columns(self.columns):
+            if "(" in part:
+                relation, inner = part[:-1].split("(", 1)
+                out[relation] = self.db.embed_relation(self.table, row, relation, inner)
+            else:
+                out[part] = row.get(part)
+        return out
+
+    async def execute(self):
+        await self.db.latency()
+        if self.op in ("insert", "upsert"):
+            rows = self.payload if isinstance(self.payload, list) else [self.payload]
+            data = [self.db.write(self.table, row, upsert=self.op == "upsert") for row in rows]
+        elif self.op == "update":
+            data = self._matches()
+            for row in data:
+                row.update(self.payload)
+        elif self.op == "delete":
+            data = self._matches()
+            self.db.tables[self.table] = [r for r in self.db.tables[self.table] if r not in data]
+        else:
+            data = [self._project(r) for r in self._matches()]
+        if self.single_row:
+            data = data[0] if data else None
+        return SimpleNamespace(data=data, count=None)
+
+def _split_columns(columns: str) -> list[str]:
+    parts, depth, current = [], 0, ""
+    for ch in columns:
+        if ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+class _Rpc:
+    def __init__(self, db: "FakeSupabase", fn: str, params: dict):
+        self.db = db
+        self.fn = fn
+        self.params = params
+
+    async def execute(self):
+        await self.db.latency()
+        handler = self.db.rpc_handlers.get(self.fn)
+        return SimpleNamespace(data=handler(self.db, self.params) if handler else None)
+
+class _Channel:
+    def __init__(self, db: "FakeSupabase"):
+        self.db = db
+
+    def on_postgres_changes(self, event: str, schema: str, table: str, callback):
+        self.db.listeners.setdefault((event, table), []).append(callback)
+        return self
+
+    async def subscribe(self):
+        return self
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase AsyncClient.
+
+    Writes stamp `inserted_at[(table, key)]` with perf_counter() time, and
+    inserts fire realtime INSERT callbacks like the real channel would.
+    """
+
+    def __init__(self, latency_ms: float = 2.0, jitter_ms: float = 1.0, seed: int = 0):
+        self.tables: dict[str, list[dict]] = {}
+        self.inserted_at: dict[tuple, float] = {}
+        self.listeners: dict[tuple, list] = {}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self.rpc_handlers = {
+            "find_unprocessed_comments": _find_unprocessed_comments,
+            "record_backfill_failures": _record_backfill_failures,
+        }
+        self.backfill_attempts: dict[str, int] = {}
+
+    async def latency(self):
+        delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: dict | None = None):
+        return _Rpc(self, fn, params or {})
+
+    def channel(self, name: str) -> _Channel:
+        return _Channel(self)
+
+    def write(self, table: str, row: dict, upsert: bool = False) -> dict:
+        rows = self.tables.setdefault(table, [])
+        row = {"id": row.get("id") or str(uuid.uuid4()), "created_at": time.time(), **row}
+        key_column = "comment_id" if upsert and "comment_id" in row else "id"
+        if upsert:
+            for existing in rows:
+                if existing.get(key_column) == row[key_column]:
+                    existing.update(row)
+                    self.inserted_at[(table, row[key_column])] = time.perf_counter()
+                    return existing
+        rows.append(row)
+        self.inserted_at[(table, row.get("comment_id", row["id"]))] = time.perf_counter()
+        for callback in self.listeners.get(("INSERT", table), []):
+            callback({"data": {"record": row}, "new": row})
+        return row
+
+    def embed_relation(self, table: str, row: dict, relation: str, columns: str):
+        """Resolve `relation(columns)` as many-to-one (row has <relation>_id) or one-to-many."""
+        wanted = [c.strip() for c in columns.split(",")]
+        project = lambda r: dict(r) if wanted == ["*"] else {c: r.get(c) for c in wanted}
+        foreign_key = relation.rstrip("s") + "_id"
+        if foreign_key in row:
+            match = next((r for r in self.tables.get(relation, []) if r["id"] == row[foreign_key]), None)
+            return project(match) if match else None
+        back_key = table.rstrip("s") + "_id"
+        return [project(r) for r in self.tables.get(relation, []) if r.get(back_key) == row["id"]]
+
+def _find_unprocessed_comments(db: FakeSupabase, params: dict) -> list[dict]:
+    embedded = {r["comment_id"] for r in db.tables.get("comment_embeddings", [])}
+    analyzed = {r["comment_id"] for r in db.tables.get("feedback_analysis", [])}
+    max_attempts = params.get("p_max_attempts")
+    rows = [
+        {**c, "has_embedding": c["id"] in embedded, "has_analysis": c["id"] in analyzed}
+        for c in db.tables.get("comments", [])
+        if not (c["id"] in embedded and c["id"] in analyzed)
+        and not (max_attempts and db.backfill_attempts.get(c["id"], 0) >= max_attempts)
+    ]
+    return rows[:params.get("p_limit", 100)]
+
+def _record_backfill_failures(db: FakeSupabase, params: dict) -> None:
+    for comment_id in params["p_comment_ids"]:
+        db.backfill_attempts[comment_id] = db.backfill_attempts.get(comment_id, 0) + 1
+
+# --- Models ---
+
+class FakeEmbedder:
+    """Deterministic SentenceTransformer stand-in: per-call plus per-text latency."""
+
+    device = "cpu"
+
+    def __init__(self, dims: int = 384, call_ms: float = 5.0, per_text_ms: float = 1.0):
+        self.dims = dims
+        self.call_ms = call_ms
+        self.per_text_ms = per_text_ms
+
+    def _vector(self, text: str):
+        import numpy as np
+        vector = np.random.default_rng(_stable_seed(text)).standard_normal(self.dims).astype("float32")
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        import numpy as np
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        time.sleep((self.call_ms + self.per_text_ms * len(batch)) / 1000)
+        vectors = np.stack([self._vector(t) for t in batch])
+        return vectors[0] if single else vectors
+
+class FakeLLMService:
+    """LLMService stand-in with llama.cpp-like cost: prefill per prompt token plus decode per
+    generated token, on a fixed number of slots. Outputs are a deterministic function of the input."""
+
+    def __init__(self, slots: int = 1, prefill_ms_per_token: float = 0.5, decode_ms_per_token: float = 20.0,
+                 completion_tokens: int = 60, failure_rate: float = 0.0, seed: int = 0):
+        self.model_path = "fake-model.gguf"
+        self.llm = True
+        self.slot_count = slots
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.completion_tokens = completion_tokens
+        self.failure_rate = failure_rate
+        self._slots = threading.Semaphore(slots)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "busy_seconds": 0.0}
+
+    def count_tokens(self, text: str) -> int:
+        return max(1, len(text) // 4)
+
+    def _generate(self, prompt: str, completion_tokens: int | None = None):
+        completion_tokens = completion_tokens or self.completion_tokens
+        prompt_tokens = self.count_tokens(prompt)
+        start = time.perf_counter()
+        with self._slots:
+            time.sleep((prompt_tokens * self.prefill_ms_per_token + completion_tokens * self.decode_ms_per_token) / 1000)
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["completion_tokens"] += completion_tokens
+            self._stats["busy_seconds"] += time.perf_counter() - start
+            failed = self._random.random() < self.failure_rate
+        return not failed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "slots": self.slot_count, "free_slots": self._slots._value}
+
+    def warmup(self):
+        pass
+
+    def close(self):
+        self.llm = None
+
+    def analyze_comment(self, text: str):
+        if not self._generate(text):
+            return None
+        seed = _stable_seed(text)
+        categories = ["bug", "feature_request", "question", "general"]
+        return {
+            "sentiment_score": round((seed % 200) / 100 - 1, 2),
+            "category": categories[seed % len(categories)],
+            "priority_score": round((seed >> 8) % 100 / 100, 2),
+            "actionable_summary": f"Follow up on: {text[:40]}",
+            "keywords": text.lower().split()[:3],
+        }
+
+    def generate_report(self, comments: list[str], stats: dict | None = None) -> str:
+        self._generate("\n".join(comments), completion_tokens=self.completion_tokens * 4)
+        return f"## 📊 EXECUTIVE SUMMARY\n{len(comments)} comments analyzed."
+
+    def generate_report_hierarchical(self, comments: list[dict], stats: dict | None = None) -> str:
+        return self.generate_report([c["content"] for c in comments], stats)
+
+    def summarize_group(self, label: str, texts: list[str]) -> str:
+        self._generate("\n".join(texts))
+        return f"{label}: {len(texts)} comments"
+
+    def generate_code(self, task: str, file_tree: list[str]) -> dict | None:
+        if not self._generate(task + "\n".join(file_tree), completion_tokens=self.completion_tokens * 8):
+            return None
+        return {"files": [{"path": "BENCHMARK.md", "content": f"# {task}\n"}]}
+
+    def chat_completion(self, messages: list, temperature: float = 0.7, max_tokens: int = 1024) -> str:
+        self._generate(json.dumps(messages), completion_tokens=min(max_tokens, self.completion_tokens))
+        return "ok"
@@ -0,0 +1,199 @@
+"""Compare GGUF models/quantizations and thread/context settings for CPU sizing.
+
+Each configuration (model × threads × n_ctx) runs in a fresh subprocess that
+loads the model through LLMService, exactly as the server does, and replays
+the fixed prompt corpus in llm_corpus.json. Per request class it records
+prompt-eval and generation tokens/sec, time to first token, JSON/output
+validity and latency; per configuration, load time and peak RSS.
+
+    cd python_backend
+    python -m benchmarks.llm_models --threads 4,8 --n-ctx 4096
+    python -m benchmarks.llm_models --models qwen2.5-coder-7b-instruct-q4_k_m.gguf,qwen2.5-coder-7b-instruct-q5_k_m.gguf
+
+Timings come from llama.cpp's perf counters (see LLMService._timed_call);
+time to first token is prefill time plus one decode step.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(os.path.dirname(HERE), "models")
+RESULTS_DIR = os.path.join(HERE, "results")
+DEFAULT_CORPUS = os.path.join(HERE, "llm_corpus.json")
+
+# --- Worker (runs inside the per-configuration subprocess) ---
+
+def _method_timings(metrics, method: str) -> dict:
+    """Snapshot the LLMService histograms/counters for one method."""
+    key = (method,)
+    prompt = metrics.LLM_PROMPT_EVAL_SECONDS.totals().get(key, (0, 0.0))
+    decode = metrics.LLM_GENERATION_SECONDS.totals().get(key, (0, 0.0))
+    return {
+        "calls": metrics.LLM_REQUEST_SECONDS.totals().get(key, (0, 0.0))[0],
+        "prompt_eval_seconds": prompt[1],
+        "decode_seconds": decode[1],
+        "prompt_tokens": metrics.LLM_TOKENS.value(method=method, kind="prompt"),
+        "completion_tokens": metrics.LLM_TOKENS.value(method=method, kind="completion"),
+    }
+
+def _replay(service, metrics, method: str, calls: list[tuple], is_valid) -> dict:
+    latencies, ttfts, valid = [], [], 0
+    prompt_tokens = completion_tokens = prompt_seconds = decode_seconds = 0.0
+    for args in calls:
+        before = _method_timings(metrics, method)
+        start = time.perf_counter()
+        output = getattr(service, method)(*args)
+        latencies.append(time.perf_counter() - start)
+        after = _method_timings(metrics, method)
+        valid += bool(is_valid(output))
+
+        call_prompt_s = after["prompt_eval_seconds"] - before["prompt_eval_seconds"]
+        call_decode_s = after["decode_seconds"] - before["decode_seconds"]
+        call_completion = after["completion_tokens"] - before["completion_tokens"]
+        prompt_tokens += after["prompt_tokens"] - before["prompt_tokens"]
+        completion_tokens += call_completion
+        prompt_seconds += call_prompt_s
+        decode_seconds += call_decode_s
+        if call_prompt_s and call_completion:
+            ttfts.append(call_prompt_s + call_decode_s / call_completion)
+
+    return {
+        "requests": len(calls),
+        "valid_rate": round(valid / len(calls), 3) if calls else None,
+        "latency_p50_s": round(statistics.median(latencies), 3) if latencies else None,
+        "ttft_p50_s": round(statistics.median(ttfts), 3) if ttfts else None,
+        "prompt_tokens_per_second": round(prompt_tokens / prompt_seconds, 1) if prompt_seconds else None,
+        "generation_tokens_per_second": round(completion_tokens / decode_seconds, 1) if decode_seconds else None,
+        "prompt_tokens": int(prompt_tokens),
+        "completion_tokens": int(completion_tokens),
+    }
+
+def run_worker(model_path: str, corpus_path: str, repeat: int) -> dict:
+    from llm_service import LLMService
+    import metrics
+
+    with open(corpus_path, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    start = time.perf_counter()
+    service = LLMService(model_path)
+    if not service.llm:
+        return {"error": f"Failed to load {model_path}"}
+    service.warmup()
+    load_seconds = time.perf_counter() - start
+
+    is_json = lambda output: isinstance(output, dict)
+    is_report = lambda output: isinstance(output, str) and "##" in output and not output.startswith("Error")
+    results = {
+        "analyze": _replay(service, metrics, "analyze_comment",
+                           [(c,) for c in corpus["analyze"]] * repeat, is_json),
+        "report": _replay(service, metrics, "generate_report",
+                          [(corpus["report"],)] * repeat, is_report),
+        "codegen": _replay(service, metrics, "generate_code",
+                           [(c["task"], c["file_tree"]) for c in corpus["codegen"]] * repeat,
+                           lambda output: is_json(output) and isinstance(output.get("files"), list)),
+    }
+    service.close()
+    return {
+        "load_seconds": round(load_seconds, 2),
+        # ru_maxrss is KiB on Linux; mmapped weights count once they are paged in
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "classes": results,
+    }
+
+# --- Orchestrator ---
+
+def candidate_models(names: str | None) -> list[str]:
+    if names:
+        return [n.strip() for n in names.split(",") if n.strip()]
+    if not os.path.isdir(MODELS_DIR):
+        return []
+    return sorted(
+        f for f in os.listdir(MODELS_DIR)
+        if f.endswith(".gguf") and ("-of-" not in f or "-00001-of-" in f)
+    )
+
+def run_configuration(model_file: str, threads: int, n_ctx: int, args) -> dict:
+    env = {
+        **os.environ,
+        "LLM_SLOTS": "1",
+        "LLM_THREADS": str(threads),
+        "LLM_N_CTX": str(n_ctx),
+        "LLM_EXTENDED_N_CTX": str(max(n_ctx, args.extended_n_ctx)),
+        "TRACE_EXPORTER": "none",
+    }
+    cmd = [
+        sys.executable, "-m", "benchmarks.llm_models", "--worker",
+        "--model", os.path.join(MODELS_DIR, model_file),
+        "--corpus", args.corpus, "--repeat", str(args.repeat),
+    ]
+    proc = subprocess.run(cmd, cwd=os.path.dirname(HERE), env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def comparison_table(runs: list[dict]) -> str:
+    header = ("| Model | Threads | n_ctx | Load (s) | Peak RSS (MB) | Class | Prompt tok/s | Gen tok/s "
+              "| TTFT p50 (s) | Latency p50 (s) | Valid |")
+    lines = [header, "|" + "---|" * (header.count("|") - 1)]
+    for run in runs:
+        prefix = f"| {run['model']} | {run['threads'] or 'default'} | {run['n_ctx']}"
+        if "error" in run["result"]:
+            lines.append(f"{prefix} | | | | error: {run['result']['error']} | | | | |")
+            continue
+        for name, c in run["result"]["classes"].items():
+            lines.append(
+                f"{prefix} | {run['result']['load_seconds']} | {run['result']['peak_rss_mb']} | {name} "
+                f"| {c['prompt_tokens_per_second']} | {c['generation_tokens_per_second']} "
+                f"| {c['ttft_p50_s']} | {c['latency_p50_s']} | {c['valid_rate']} |"
+            )
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GGUF models and thread/context settings")
+    parser.add_argument("--models", help="Comma-separated .gguf names in models/ (default: all)")
+    parser.add_argument("--threads", default="0", help="Comma-separated thread counts (0 = llama.cpp default)")
+    parser.add_argument("--n-ctx", default=os.getenv("LLM_N_CTX", "4096"), help="Comma-separated default context sizes")
+    parser.add_argument("--extended-n-ctx", type=int, default=int(os.getenv("LLM_EXTENDED_N_CTX", "8192")))
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=1, help="Replays of the corpus per configuration")
+    parser.add_argument("--output", help="Result prefix (default: benchmarks/results/models-<timestamp>)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--model", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_worker(args.model, args.corpus, args.repeat)))
+        return
+
+    models = candidate_models(args.models)
+    if not models:
+        raise SystemExit(f"No .gguf files found in {MODELS_DIR}")
+    runs = []
+    for model_file in models:
+        for threads in [int(t) for t in args.threads.split(",")]:
+            for n_ctx in [int(n) for n in args.n_ctx.split(",")]:
+                print(f"⏱️ {model_file} threads={threads or 'default'} n_ctx={n_ctx}...", file=sys.stderr)
+                runs.append({
+                    "model": model_file, "threads": threads, "n_ctx": n_ctx,
+                    "result": run_configuration(model_file, threads, n_ctx, args),
+                })
+
+    table = comparison_table(runs)
+    prefix = args.output or os.path.join(RESULTS_DIR, f"models-{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}")
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    with open(prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump({"cpu_count": os.cpu_count(), "runs": runs}, f, indent=2)
+    with open(prefix + ".md", "w", encoding="utf-8") as f:
+        f.write(table + "\n")
+    print(table)
+    print(f"📄 Results written to {prefix}.json / .md", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Offline benchmark suite for the backend pipelines.
+
+Runs main.py's real code paths against FakeSupabase, FakeEmbedder and
+FakeLLMService (see fakes.py), so it needs no Supabase project or model files.
+
+    cd python_backend
+    python -m benchmarks.run --scenarios realtime,ingest,embed,generate --rate 20
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+
+# Must be set before main.py (and tracing.py) are imported
+os.environ.setdefault("TRACE_EXPORTER", "none")
+os.environ.setdefault("LLM_CACHE_MAX_ENTRIES", "0")
+
+from benchmarks.fakes import FakeSupabase, FakeEmbedder, FakeLLMService
+from embedding_pool import EmbeddingPool
+from model_manager import ModelManager
+from response_cache import response_cache_from_env
+from transport import ReadCache
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+WORDS = ("checkout crashes login slow dark mode export csv api rate limit mobile layout broken "
+         "love feature request search filter billing invoice sync offline notification email "
+         "onboarding confusing pricing too high integration slack github webhook timeout").split()
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 2)
+
+def latency_summary(latencies_ms: list[float]) -> dict:
+    return {
+        "latency_p50_ms": percentile(latencies_ms, 50),
+        "latency_p99_ms": percentile(latencies_ms, 99),
+        "latency_mean_ms": round(statistics.fmean(latencies_ms), 2) if latencies_ms else None,
+    }
+
+def make_comment(rng: random.Random, index: int, prefix: str) -> str:
+    return f"{prefix} #{index}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+
+async def poisson_arrivals(rate: float, count: int, rng: random.Random):
+    """Yield `count` times, spaced like a Poisson process at `rate` per second (0 = all at once)."""
+    for i in range(count):
+        if rate > 0 and i:
+            await asyncio.sleep(rng.expovariate(rate))
+        yield i
+
+def git_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+class Harness:
+    """Points main.py's globals at fresh fakes for each scenario."""
+
+    def __init__(self, args):
+        import main
+        import metrics
+        self.main = main
+        self.metrics = metrics
+        self.args = args
+
+    def reset(self) -> FakeSupabase:
+        main = self.main
+        db = FakeSupabase(latency_ms=self.args.db_latency_ms, jitter_ms=self.args.db_jitter_ms, seed=self.args.seed)
+        main.supabase = self.metrics.InstrumentedSupabase(db)
+        main.read_cache = ReadCache() # Cached rows belong to the previous scenario's database
+        main.main_loop = asyncio.get_running_loop()
+        main.model = FakeEmbedder(call_ms=self.args.embed_call_ms, per_text_ms=self.args.embed_per_text_ms)
+        if main.embedding_pool:
+            main.embedding_pool.close()
+        # In-process: the fake has no tensors to share with worker processes
+        main.embedding_pool = EmbeddingPool(main.model, workers=0)
+        main.embedding_pool.start()
+        main.device = "fake"
+        # Normally created in main's lifespan, which the harness doesn't run
+        main.response_cache = response_cache_from_env()
+        main.model_manager = ModelManager(os.path.join("models"))
+        main.model_manager.service = FakeLLMService(
+            slots=self.args.llm_slots,
+            prefill_ms_per_token=self.args.prefill_ms_per_token,
+            decode_ms_per_token=self.args.decode_ms_per_token,
+            completion_tokens=self.args.completion_tokens,
+            failure_rate=self.args.llm_failure_rate,
+            seed=self.args.seed,
+        )
+        main.admission_controller.resize(main.model_manager.slot_count)
+        for name in main.model_status:
+            main.model_status[name]["state"] = "ready"
+            main.model_loaded_events[name] = asyncio.Event()
+            main.model_loaded_events[name].set()
+        return db
+
+    def client(self):
+        import httpx
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.main.app), base_url="http://bench", timeout=None)
+
+    async def seed_post(self, db: FakeSupabase) -> tuple[str, str]:
+        user = db.write("profiles", {"username": "bench"})
+        post = db.write("posts", {"user_id": user["id"], "title": "Benchmark post"})
+        return post["id"], user["id"]
+
+    async def wait_for(self, predicate, timeout: float) -> bool:
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if predicate():
+                return True
+            await asyncio.sleep(0.01)
+        return predicate()
+
+async def bench_realtime(h: Harness) -> dict:
+    """Comments inserted at a Poisson rate, processed through the realtime listener path."""
+    db = h.reset()
+    post_id, user_id = await h.seed_post(db)
+    stop_event = asyncio.Event()
+    listener = asyncio.create_task(h.main.run_realtime_listener(stop_event))
+    await asyncio.sleep(0) # Let the listener subscribe
+
+    rng = random.Random(h.args.seed)
+    ids = []
+    async for i in poisson_arrivals(h.args.rate, h.args.comments, rng):
+        res = await h.main.supabase.table("comments").insert({
+            "post_id": post_id, "user_id": user_id, "content": make_comment(rng, i, "realtime")
+        }).execute()
+        ids.append(res.data[0]["id"])
+
+    done = lambda: all(("feedback_analysis", cid) in db.inserted_at for cid in ids)
+    await h.wait_for(done, h.args.timeout)
+    stop_event.set()
+    listener.cancel()
+
+    finished = [cid for cid in ids if ("feedback_analysis", cid) in db.inserted_at]
+    latencies = [(db.inserted_at[("feedback_analysis", cid)] - db.inserted_at[("comments", cid)]) * 1000 for cid in finished]
+    first = min(db.inserted_at[("comments", cid)] for cid in ids)
+    last = max((db.inserted_at[("feedback_analysis", cid)] for cid in finished), default=first)
+    return {
+        "comments": len(ids),
+        "completed": len(finished),
+        "comments_per_second": round(len(finished) / (last - first), 2) if last > first else None,
+        **latency_summary(latencies),
+    }
+
+async def bench_ingest(h: Harness) -> dict:
+    """One bulk /ingest of a scraped thread (with some duplicates), awaited to completion."""
+    db = h.reset()
+    post_id, user_id = await h.seed_post(db)
+    rng = random.Random(h.args.seed)
+    contents = [make_comment(rng, i, "ingest") for i in range(h.args.comments)]
+    contents += rng.sample(contents, len(contents) // 10) # Scraped threads repeat themselves
+    async with h.client() as client:
+        start = time.perf_counter()
+        res = await client.post("/ingest", json={"post_id": post_id, "user_id": user_id, "comments": contents, "wait": True})
+        elapsed = time.perf_counter() - start
+    summary = res.json()
+    return {
+        "comments": len(contents),
+        "status": summary.get("status"),
+        "duplicates": summary.get("duplicates"),
+        "elapsed_seconds": round(elapsed, 3),
+        "comments_per_second": round(len(contents) / elapsed, 2),
+        "stages": summary.get("stages"),
+    }
+
+async def bench_embed(h: Harness) -> dict:
+    """/embed requests arriving at a Poisson rate."""
+    h.reset()
+    rng = random.Random(h.args.seed)
+    latencies = []
+
+    async def one(client, text):
+        start = time.perf_counter()
+        res = await client.post("/embed", json={"text": text})
+        res.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    async with h.client() as client:
+        start = time.perf_counter()
+        tasks = []
+        async for i in poisson_arrivals(h.args.embed_rate, h.args.embed_requests, rng):
+            tasks.append(asyncio.create_task(one(client, make_comment(rng, i, "embed"))))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        **latency_summary(latencies),
+    }
+
+def make_fixture_repo(files: int) -> str:
+    """A small local git repo that /generate can clone without the network."""
+    repo = tempfile.mkdtemp(prefix="echo_bench_repo_")
+    for i in range(files):
+        path = os.path.join(repo, "src", f"module_{i % 20}", f"file_{i}.py")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"def handler_{i}():\n    return {i}\n")
+    for cmd in (["git", "init", "-q"], ["git", "add", "."],
+                ["git", "-c", "user.name=bench", "-c", "user.email=bench@local", "commit", "-q", "-m", "fixture"]):
+        subprocess.run(cmd, cwd=repo, check=True)
+    return repo
+
+async def bench_generate(h: Harness) -> dict:
+    """Sequential /generate runs against a local fixture repo; per-step costs from the step histogram."""
+    h.reset()
+    repo = make_fixture_repo(h.args.repo_files)
+    before = h.metrics.CODEGEN_STEP_SECONDS.totals()
+    latencies = []
+    try:
+        async with h.client() as client:
+            for i in range(h.args.generate_runs):
+                start = time.perf_counter()
+                res = await client.post("/generate", json={"repo_url": repo, "task": f"Benchmark task {i}"})
+                res.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        shutil.rmtree(repo, ignore_errors=True)
+
+    steps = {}
+    for (step,), (count, total) in h.metrics.CODEGEN_STEP_SECONDS.totals().items():
+        prev_count, prev_total = before.get((step,), (0, 0.0))
+        if count > prev_count:
+            steps[step] = {"runs": count - prev_count, "mean_ms": round((total - prev_total) / (count - prev_count) * 1000, 2)}
+    return {"runs": len(latencies), **latency_summary(latencies), "steps": steps}
+
+SCENARIOS = {
+    "realtime": bench_realtime,
+    "ingest": bench_ingest,
+    "embed": bench_embed,
+    "generate": bench_generate,
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline backend benchmarks")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--comments", type=int, default=200, help="Comments per realtime/ingest run")
+    parser.add_argument("--rate", type=float, default=20, help="Realtime comment arrival rate per second (0 = burst)")
+    parser.add_argument("--embed-requests", type=int, default=500)
+    parser.add_argument("--embed-rate", type=float, default=100)
+    parser.add_argument("--generate-runs", type=int, default=5)
+    parser.add_argument("--repo-files", type=int, default=200)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--db-jitter-ms", type=float, default=1.0)
+    parser.add_argument("--embed-call-ms", type=float, default=5.0)
+    parser.add_argument("--embed-per-text-ms", type=float, default=1.0)
+    parser.add_argument("--llm-slots", type=int, default=int(os.getenv("LLM_SLOTS", "1")))
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.5)
+    parser.add_argument("--decode-ms-per-token", type=float, default=2.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=300, help="Max seconds to wait for a scenario to drain")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<version>-<timestamp>.json)")
+    return parser.parse_args(argv)
+
+async def run(args) -> dict:
+    harness = Harness(args)
+    results = {}
+    for name in args.scenarios.split(","):
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario: {name}")
+        print(f"⏱️ Running {name}...", file=sys.stderr)
+        results[name] = await SCENARIOS[name](harness)
+    return results
+
+def cli(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.INFO) # Per-comment log lines would dominate the timings
+    started = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    version = git_version()
+    report = {
+        "version": version,
+        "timestamp": started,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": asyncio.run(run(args)),
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{version}-{started}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"📄 Results written to {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    cli()
@@ -1,9 +1,12 @@
 import os
+import sys
 from huggingface_hub import snapshot_download
 
 MODEL_REPO = "Qwen/Qwen2.5-Coder-7B-Instruct-GGUF"
+# Quantization to fetch, e.g. `python download_model.py q4_k_m` (compare them with benchmarks.llm_models)
+MODEL_QUANT = sys.argv[1] if len(sys.argv) > 1 else os.getenv("MODEL_QUANT", "q5_k_m")
 # Pattern to match the specific quantization requested
-ALLOW_PATTERNS = ["*qwen2.5-coder-7b-instruct-q5_k_m*.gguf"]
+ALLOW_PATTERNS = [f"*qwen2.5-coder-7b-instruct-{MODEL_QUANT.lower()}*.gguf"]
 DEST_DIR = os.path.join(os.path.dirname(__file__), "models")
 
 def download_model():
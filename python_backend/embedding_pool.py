@@ -0,0 +1,203 @@
+import asyncio
+import functools
+import math
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Embeddings are computed by worker processes, each with its own torch thread
+# budget, so backfills and bulk ingests use every core and the event loop never
+# runs an encode. 0 workers (or a GPU model) encodes on one thread in-process.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+EMBED_THREADS_PER_WORKER = int(os.getenv("EMBED_THREADS_PER_WORKER", "0")) # 0 = split the cores evenly
+EMBED_BUCKET_SIZE = int(os.getenv("EMBED_BUCKET_SIZE", "32")) # Max texts per forward pass
+EMBED_MIN_BUCKET_SIZE = 4
+EMBED_COLLECT_MS = float(os.getenv("EMBED_COLLECT_MS", "5")) # Lets concurrent callers share buckets
+
+_worker_model = None
+
+def _init_worker(model, threads: int):
+    """Runs once per worker process; the model's tensors arrive as shared memory, not copies."""
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)
+    _worker_model = model
+    _worker_model.encode("warmup")
+
+def _ping() -> int:
+    return os.getpid()
+
+def _encode_with(model, texts: list[str]):
+    # The bucket is already one length-sorted batch
+    return model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+def _encode(texts: list[str]):
+    return _encode_with(_worker_model, texts)
+
+class _Request:
+    __slots__ = ("texts", "vectors", "remaining", "future")
+
+    def __init__(self, texts: list[str], future: asyncio.Future):
+        self.texts = texts
+        self.vectors = [None] * len(texts)
+        self.remaining = len(texts)
+        self.future = future
+
+    def fill(self, index: int, vector: list[float]):
+        self.vectors[index] = vector
+        self.remaining -= 1
+        if not self.remaining and not self.future.done():
+            self.future.set_result(self.vectors)
+
+    def fail(self, error: Exception):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+class EmbeddingPool:
+    """Length-bucketed batching over a pool of encoder processes.
+
+    `embed` queues texts and awaits their vectors. A dispatcher drains the
+    queue, sorts every pending text by length and cuts the sorted list into
+    buckets (smaller when there are fewer texts than workers × bucket size,
+    so every worker gets one), hands each bucket to a worker as one batch and
+    scatters the vectors back to their callers. At most two buckets per
+    worker are outstanding; texts arriving meanwhile wait and are bucketed
+    together in the next round, so short comments are not padded to the
+    length of a bug report.
+    """
+
+    def __init__(self, model, workers: int = EMBED_WORKERS, threads: int = EMBED_THREADS_PER_WORKER, kind: str = "live"):
+        self.model = model
+        # A GPU already parallelises each batch; extra processes would only contend for it
+        self.workers = 0 if str(model.device).startswith("cuda") else max(0, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(1, self.workers))
+        self.kind = kind
+        self._executor = None
+        self._pending: list[tuple[_Request, int]] = []
+        self._wakeup = asyncio.Event()
+        self._slots: asyncio.Semaphore | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._buckets: set[asyncio.Task] = set() # The event loop only keeps weak references to tasks
+        self._in_flight = 0
+        self.stats = {"texts": 0, "buckets": 0, "chars": 0, "padded_chars": 0}
+
+    def _new_executor(self):
+        if not self.workers:
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"embed-{self.kind}")
+        # torch.multiprocessing pickles tensors as handles to shared memory
+        import torch.multiprocessing as torch_mp
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=torch_mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model, self.threads),
+        )
+
+    def start(self):
+        """Start and warm the workers. Blocking; run in an executor."""
+        if self.workers:
+            self.model.share_memory()
+        self._executor = self._new_executor()
+        if self.workers:
+            # One task per worker so each process is spawned and has run its warmup
+            futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+            pids = {f.result() for f in futures}
+            logger.info(f"🧮 Embedding pool ({self.kind}) started: {len(pids)} processes × {self.threads} threads.")
+        else:
+            # No _init_worker runs in-process, so warm up here (CUDA kernels, tokenizer)
+            self._executor.submit(_encode_with, self.model, ["warmup"]).result()
+            logger.info(f"🧮 Embedding pool ({self.kind}) started in-process.")
+
+    def close(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+        for request, _ in self._pending:
+            request.fail(RuntimeError("Embedding pool closed."))
+        metrics.EMBEDDING_QUEUED_TEXTS.dec(len(self._pending), kind=self.kind)
+        self._pending = []
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def aclose(self):
+        """Close once queued and in-flight texts are embedded, e.g. after a model switch."""
+        while self._pending or self._in_flight:
+            await asyncio.sleep(0.05)
+        self.close()
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        if self._dispatcher is None:
+            self._slots = asyncio.Semaphore(2 * max(1, self.workers))
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        request = _Request(texts, asyncio.get_running_loop().create_future())
+        self._pending += [(request, i) for i in range(len(texts))]
+        metrics.EMBEDDING_QUEUED_TEXTS.inc(len(texts), kind=self.kind)
+        self._wakeup.set()
+        return await request.future
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(EMBED_COLLECT_MS / 1000)
+            self._wakeup.clear()
+            items, self._pending = self._pending, []
+            if not items:
+                continue
+            items.sort(key=lambda item: len(item[0].texts[item[1]]))
+            size = max(EMBED_MIN_BUCKET_SIZE, min(EMBED_BUCKET_SIZE, math.ceil(len(items) / max(1, self.workers))))
+            starts = range(0, len(items), size)
+            self._in_flight += len(starts)
+            for start in starts:
+                await self._slots.acquire()
+                task = asyncio.create_task(self._run_bucket(items[start:start + size]))
+                self._buckets.add(task)
+                task.add_done_callback(self._buckets.discard)
+
+    async def _run_bucket(self, bucket: list[tuple[_Request, int]]):
+        texts = [request.texts[i] for request, i in bucket]
+        metrics.EMBEDDING_QUEUED_TEXTS.dec(len(texts), kind=self.kind)
+        encode = _encode if self.workers else functools.partial(_encode_with, self.model)
+        executor = self._executor
+        try:
+            with metrics.EMBEDDING_SECONDS.time(kind=self.kind):
+                vectors = await asyncio.get_running_loop().run_in_executor(executor, encode, texts)
+            lengths = [len(t) for t in texts]
+            self.stats["texts"] += len(texts)
+            self.stats["buckets"] += 1
+            self.stats["chars"] += sum(lengths)
+            self.stats["padded_chars"] += max(lengths) * len(lengths) - sum(lengths)
+            metrics.EMBEDDING_BATCH_SIZE.observe(len(texts))
+            for (request, i), vector in zip(bucket, vectors):
+                request.fill(i, vector.tolist())
+        except Exception as e:
+            # Sibling buckets fail with the same error; only the first replaces the broken pool
+            if isinstance(e, BrokenProcessPool) and self._executor is executor:
+                # A worker died (e.g. OOM); later buckets get fresh processes
+                logger.error(f"❌ Embedding worker crashed, restarting pool ({self.kind}).")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            for request, _ in bucket:
+                request.fail(e)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def status(self) -> dict:
+        total = self.stats["chars"] + self.stats["padded_chars"]
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "queued": len(self._pending),
+            "texts": self.stats["texts"],
+            "buckets": self.stats["buckets"],
+            # Share of each bucket spent on padding, approximated in characters
+            "padding_ratio": round(self.stats["padded_chars"] / total, 3) if total else 0.0,
+        }
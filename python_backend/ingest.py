@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+import logging
+
+import numpy as np
+
+from vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+INGEST_INSERT_BATCH = int(os.getenv("INGEST_INSERT_BATCH", "500"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+INGEST_PERSIST_BATCH = int(os.getenv("INGEST_PERSIST_BATCH", "200"))
+INGEST_ANALYZE_WORKERS = int(os.getenv("INGEST_ANALYZE_WORKERS", os.getenv("LLM_SLOTS", "1")))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8")) # Batches buffered between stages
+INGEST_DEDUP_SIMILARITY = float(os.getenv("INGEST_DEDUP_SIMILARITY", "0.97"))
+
+_DONE = object()
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 2),
+            "items_per_second": round(self.items / self.busy_seconds, 2) if self.busy_seconds else None,
+        }
+
+class IngestJob:
+    """Bulk ingest of one batch of comments through insert → embed → dedup → analyze → persist.
+
+    Stages run concurrently and are connected by bounded queues, so a slow
+    stage (usually the LLM) applies back-pressure instead of buffering the
+    whole thread in memory. Near-duplicate comments reuse their canonical
+    comment's analysis instead of paying for another LLM call.
+    """
+
+    def __init__(self, supabase, post_id: str, user_id: str, contents: list[str], embed_batch, analyze,
+                 claim_ids=None, on_analyzed=None, embedding_model=None):
+        self.id = uuid.uuid4().hex
+        self.supabase = supabase
+        self.post_id = post_id
+        self.user_id = user_id
+        self.contents = [c for c in contents if c and c.strip()]
+        self.embed_batch = embed_batch # async (texts) -> list[list[float]]
+        self.embedding_model = embedding_model # () -> model id stored with each vector
+        self.analyze = analyze # async (comment_id, content) -> dict | None
+        self.claim_ids = claim_ids # optional async (ids) -> ids this worker may process
+        self.on_analyzed = on_analyzed # optional async (comment_id, analysis, embedding) for agent triggers
+        self.comment_ids = [str(uuid.uuid4()) for _ in self.contents]
+        self.status = "pending"
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.stages = {name: StageStats(name) for name in ("insert", "embed", "dedup", "analyze", "persist")}
+        self.duplicates = 0
+        self.failed = 0
+        self.persisted_ids: list[str] = [] # Comments whose analysis has been written
+        self._inserted: list[list[dict]] | None = None # Batches written up front by insert()
+        self._to_notify: dict[str, tuple[dict, list[float] | None]] = {} # comment_id -> on_analyzed args
+
+    async def _timed(self, stage: str, count: int, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.stages[stage].busy_seconds += time.perf_counter() - start
+            self.stages[stage].items += count
+
+    async def _insert_batches(self):
+        """Insert the comments in batches, yielding the rows this worker goes on to process."""
+        rows = [
+            {"id": cid, "post_id": self.post_id, "user_id": self.user_id, "content": content}
+            for cid, content in zip(self.comment_ids, self.contents)
+        ]
+        for i in range(0, len(rows), INGEST_INSERT_BATCH):
+            batch = rows[i:i + INGEST_INSERT_BATCH]
+            await self._timed("insert", len(batch), self.supabase.table("comments").insert(batch).execute())
+            if self.claim_ids:
+                claimed = set(await self.claim_ids([r["id"] for r in batch]))
+                batch = [r for r in batch if r["id"] in claimed]
+            yield batch
+
+    async def insert(self):
+        """Write every comment before the rest of the pipeline runs in the background.
+
+        Once this returns the comments are durable: if a later stage fails, the
+        backfill embeds and analyzes them instead.
+        """
+        self._inserted = [batch async for batch in self._insert_batches()]
+
+    async def _insert_stage(self, out: asyncio.Queue):
+        async def emit(batch):
+            for j in range(0, len(batch), INGEST_EMBED_BATCH):
+                await out.put(batch[j:j + INGEST_EMBED_BATCH])
+
+        if self._inserted is not None:
+            for batch in self._inserted:
+                await emit(batch)
+        else:
+            async for batch in self._insert_batches():
+                await emit(batch)
+        await out.put(_DONE)
+
+    async def _embed_stage(self, inbox: asyncio.Queue, out: asyncio.Queue, persist: asyncio.Queue):
+        while (batch := await inbox.get()) is not _DONE:
+            embeddings = await self._timed("embed", len(batch), self.embed_batch([r["content"] for r in batch]))
+            for row, embedding in zip(batch, embeddings):
+                row["embedding"] = embedding
+            model_id = self.embedding_model() if self.embedding_model else None
+            await persist.put(("comment_embeddings", [
+                {"comment_id": r["id"], "embedding": r["embedding"], "model_id": model_id} for r in batch
+            ]))
+            await out.put(batch)
+        await out.put(_DONE)
+
+    async def _dedup_stage(self, inbox: asyncio.Queue, out: asyncio.Queue):
+        """Mark exact and near-duplicate comments so only canonical ones reach the LLM."""
+        seen_hashes: dict[str, str] = {}
+        canonical: VectorStore | None = None
+        while (batch := await inbox.get()) is not _DONE:
+            start = time.perf_counter()
+            for row in batch:
+                key = hashlib.sha1(" ".join(row["content"].lower().split()).encode("utf-8")).hexdigest()
+                vector = np.asarray(row["embedding"], dtype=np.float32)
+                duplicate_of = seen_hashes.get(key)
+                if duplicate_of is None and canonical and canonical.count:
+                    (best_id, similarity), = canonical.search(vector, k=1)
+                    if similarity >= INGEST_DEDUP_SIMILARITY:
+                        duplicate_of = best_id
+                if duplicate_of:
+                    row["duplicate_of"] = duplicate_of
+                    self.duplicates += 1
+                else:
+                    canonical = canonical or VectorStore(vector.shape[0])
+                    canonical.add([row["id"]], vector[None, :])
+                    seen_hashes[key] = row["id"]
+            self.stages["dedup"].busy_seconds += time.perf_counter() - start
+            self.stages["dedup"].items += len(batch)
+            await out.put(batch)
+        await out.put(_DONE)
+
+    async def _analyze_stage(self, inbox: asyncio.Queue, persist: asyncio.Queue):
+        analyses: dict[str, dict] = {}
+        pending_duplicates: list[dict] = []
+        semaphore = asyncio.Semaphore(max(1, INGEST_ANALYZE_WORKERS))
+
+        async def analyze_one(row):
+            async with semaphore:
+                analysis = await self._timed("analyze", 1, self.analyze(row["id"], row["content"]))
+            if analysis:
+                analyses[row["id"]] = analysis
+                if self.on_analyzed:
+                    # Fired by the persist stage once the analysis row is written
+                    self._to_notify[row["id"]] = (analysis, row.get("embedding"))
+            else:
+                self.failed += 1
+            return row, analysis
+
+        while (batch := await inbox.get()) is not _DONE:
+            canonical = [r for r in batch if "duplicate_of" not in r]
+            pending_duplicates += [r for r in batch if "duplicate_of" in r]
+            results = await asyncio.gather(*(analyze_one(r) for r in canonical))
+            rows = [analysis_row(row["id"], a) for row, a in results if a]
+            # Duplicates whose canonical comment is analyzed by now reuse its result
+            resolved = [r for r in pending_duplicates if r["duplicate_of"] in analyses]
+            pending_duplicates = [r for r in pending_duplicates if r["duplicate_of"] not in analyses]
+            rows += [analysis_row(r["id"], analyses[r["duplicate_of"]]) for r in resolved]
+            if rows:
+                await persist.put(("feedback_analysis", rows))
+
+        # Canonical analysis failed: analyze the leftover duplicates on their own
+        if pending_duplicates:
+            results = await asyncio.gather(*(analyze_one(r) for r in pending_duplicates))
+            rows = [analysis_row(row["id"], a) for row, a in results if a]
+            if rows:
+                await persist.put(("feedback_analysis", rows))
+        await persist.put(_DONE)
+
+    async def _notify_analyzed(self, comment_ids: list[str]):
+        """Run on_analyzed for persisted comments: a coalesced agent task reads their analyses."""
+        async def notify(comment_id, analysis, embedding):
+            try:
+                await self.on_analyzed(comment_id, analysis, embedding)
+            except Exception as e:
+                # The analysis is still valid; only the agent trigger is lost
+                logger.error(f"❌ Ingest agent trigger for {comment_id} failed: {e}")
+
+        pending = [(cid, *self._to_notify.pop(cid)) for cid in comment_ids if cid in self._to_notify]
+        await asyncio.gather(*(notify(*args) for args in pending))
+
+    async def _persist_stage(self, inbox: asyncio.Queue, producers: int):
+        """Multi-row writes, flushed per table every INGEST_PERSIST_BATCH rows."""
+        buffers: dict[str, list[dict]] = {"comment_embeddings": [], "feedback_analysis": []}
+
+        async def flush(table: str):
+            rows, buffers[table] = buffers[table], []
+            if not rows:
+                return
+            # Both tables hold one row per comment, so a retried or overlapping write replaces it
+            query = self.supabase.table(table).upsert(rows, on_conflict="comment_id")
+            await self._timed("persist", len(rows), query.execute())
+            if table == "feedback_analysis":
+                self.persisted_ids += [r["comment_id"] for r in rows]
+                await self._notify_analyzed([r["comment_id"] for r in rows])
+
+        done = 0
+        while done < producers:
+            item = await inbox.get()
+            if item is _DONE:
+                done += 1
+                continue
+            table, rows = item
+            buffers[table] += rows
+            if len(buffers[table]) >= INGEST_PERSIST_BATCH:
+                await flush(table)
+        for table in buffers:
+            await flush(table)
+
+    async def run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            inserted = asyncio.Queue(INGEST_QUEUE_SIZE)
+            embedded = asyncio.Queue(INGEST_QUEUE_SIZE)
+            deduped = asyncio.Queue(INGEST_QUEUE_SIZE)
+            persist = asyncio.Queue(INGEST_QUEUE_SIZE * 2)
+
+            # Both the embed and analyze stages feed persist, which waits for both to finish
+            async def embed_then_signal():
+                await self._embed_stage(inserted, embedded, persist)
+                await persist.put(_DONE)
+
+            stages = [asyncio.create_task(coro) for coro in (
+                self._insert_stage(inserted),
+                embed_then_signal(),
+                self._dedup_stage(embedded, deduped),
+                self._analyze_stage(deduped, persist),
+                self._persist_stage(persist, producers=2),
+            )]
+            try:
+                await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+            finally:
+                # A failed stage stops feeding its queues; the others would block on them forever
+                for task in stages:
+                    task.cancel()
+                await asyncio.gather(*stages, return_exceptions=True)
+            errors = [task.exception() for task in stages if not task.cancelled() and task.exception()]
+            if errors:
+                raise errors[0]
+            self.status = "completed"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"❌ Ingest job {self.id} failed: {e}")
+        finally:
+            self.finished_at = time.time()
+        logger.info(f"📥 Ingest job {self.id} {self.status}: {self.summary()['stages']}")
+
+    def summary(self) -> dict:
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "post_id": self.post_id,
+            "comments": len(self.contents),
+            "duplicates": self.duplicates,
+            "analysis_failed": self.failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "comments_per_second": round(len(self.contents) / elapsed, 2) if elapsed else None,
+            "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+        }
+
+def analysis_row(comment_id: str, analysis: dict) -> dict:
+    return {
+        "comment_id": comment_id,
+        "sentiment_score": analysis.get("sentiment_score", 0),
+        "category": analysis.get("category", "general"),
+        "priority_score": analysis.get("priority_score", 0),
+        "actionable_summary": analysis.get("actionable_summary", ""),
+        "keywords": analysis.get("keywords", []),
+    }
@@ -1,13 +1,85 @@
 import json
 import os
+import hashlib
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_budget import PromptSection, count_tokens, fit_prompt, SAFETY_MARGIN_TOKENS
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
+# Context sizes. The default context is created at load time; the extended one is
+# created on demand for request classes whose prompt needs it. On CPU the weights
+# are mmapped, so the second context only costs its KV cache.
+DEFAULT_N_CTX = int(os.getenv("LLM_N_CTX", "4096"))
+EXTENDED_N_CTX = int(os.getenv("LLM_EXTENDED_N_CTX", "8192"))
+REQUEST_CLASS_MAX_CTX = {
+    "analyze": DEFAULT_N_CTX,
+    "report": EXTENDED_N_CTX,
+    "codegen": EXTENDED_N_CTX,
+    "chat": EXTENDED_N_CTX,
+}
+MIN_PROMPT_TOKENS = 1024 # max_tokens is clamped so a prompt always gets at least this much
+
+# Decoding slots: independent llama.cpp contexts over the same mmapped weights. Each
+# request borrows a free slot, so concurrent requests decode side by side instead of
+# queueing behind one context. CPU threads are split evenly across slots.
+LLM_SLOTS = max(1, int(os.getenv("LLM_SLOTS", "1")))
+# Total CPU threads for decoding (0 = llama.cpp's default, or all cores split across slots)
+LLM_THREADS = int(os.getenv("LLM_THREADS", "0"))
+# Layers offloaded to the GPU (0 = CPU only). Every Llama instance uploads its own
+# copy of these layers, so when offloading the node runs one context sized for
+# every request class instead of slots plus an extended context.
+LLM_GPU_LAYERS = int(os.getenv("LLM_GPU_LAYERS", "32"))
+
+REPORT_SYSTEM_PROMPT = """You are an Elite Product Strategist and Data Analyst. Your goal is to transform raw community feedback into a high-impact, professional Community Intelligence Report.
+
+STRICT FORMATTING RULES:
+1. Use professional, data-centric language.
+2. Use Markdown headers (##, ###) for clear separation.
+3. Keep it punchy but comprehensive.
+4. Avoid generic filler; cite specific patterns found in the feedback.
+
+REQUIRED SECTIONS:
+- ## 📊 EXECUTIVE SUMMARY
+- ## 📈 SENTIMENT PULSE
+- ## 🔥 HIGH-RESONANCE ISSUES
+- ## 🚀 GROWTH OPPORTUNITIES
+- ## 🛠️ STRATEGIC ROADMAP"""
+
+# Hierarchical (map-reduce) report settings
+MAP_CHUNK_TOKENS = 1500 # Comment tokens per map call, well inside the default context
+MAP_SUMMARY_TOKENS = 300
+REDUCE_INPUT_TOKENS = 2000 # Summaries beyond this are reduced again before the final report
+SUMMARY_CACHE_SIZE = 1024
+
+# Plan-then-per-file code generation: a short plan, then one call per file. The
+# per-file budget leaves room for the file's context inside the default n_ctx,
+# so files can decode on parallel slots instead of queueing for the extended one.
+CODEGEN_PLAN_MAX_TOKENS = int(os.getenv("CODEGEN_PLAN_MAX_TOKENS", "512"))
+CODEGEN_FILE_MAX_TOKENS = int(os.getenv("CODEGEN_FILE_MAX_TOKENS", "2048"))
+CODEGEN_MAX_FILES = int(os.getenv("CODEGEN_MAX_FILES", "8"))
+
 class LLMService:
     def __init__(self, model_path: str):
         self.model_path = model_path
         self.llm = None
+        self.slot_count = LLM_SLOTS
+        self.base_n_ctx = DEFAULT_N_CTX # Context size of the slots
+        self._slots: queue.Queue = queue.Queue()
+        self._extended_llm = None
+        self._extended_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "busy_seconds": 0.0}
+        # Map-step summaries keyed by group content hash (see summarize_group)
+        self._summary_cache: OrderedDict[str, str] = OrderedDict()
+        self._summary_cache_lock = threading.Lock()
         self._load_model()
 
     def _load_model(self):
@@ -40,24 +112,192 @@ class LLMService:
 
         logger.info(f"Loading LLM from {self.model_path}...")
         try:
-            from llama_cpp import Llama
-            # n_ctx=4096 for stability on demo hardware
-            self.llm = Llama(
-                model_path=self.model_path,
-                n_ctx=4096,
-                n_gpu_layers=32, # Offload some to GPU, keep context safe
-                verbose=False
-            )
-            logger.info("✅ LLM loaded successfully.")
+            if self._offloads_to_gpu():
+                # A second instance would upload the offloaded layers again
+                if self.slot_count > 1:
+                    logger.warning(f"⚠️ LLM_SLOTS={self.slot_count} ignored: GPU offload keeps one context (set LLM_GPU_LAYERS=0 for CPU slots).")
+                self.slot_count = 1
+                self.base_n_ctx = EXTENDED_N_CTX
+            self.llm = self._create_llama(self.base_n_ctx)
+            self._slots.put(self.llm)
+            for _ in range(self.slot_count - 1):
+                self._slots.put(self._create_llama(self.base_n_ctx))
+            logger.info(f"✅ LLM loaded successfully ({self.slot_count} decoding slot(s)).")
         except Exception as e:
             logger.error(f"❌ Failed to load LLM: {e}")
 
+    @staticmethod
+    def _offloads_to_gpu() -> bool:
+        if LLM_GPU_LAYERS == 0:
+            return False
+        try:
+            import llama_cpp
+            return bool(llama_cpp.llama_supports_gpu_offload())
+        except (ImportError, AttributeError):
+            return False
+
+    def _create_llama(self, n_ctx: int):
+        from llama_cpp import Llama
+        threads = {}
+        if self.slot_count > 1 or LLM_THREADS:
+            per_slot = max(1, (LLM_THREADS or os.cpu_count() or 1) // self.slot_count)
+            threads = {"n_threads": per_slot, "n_threads_batch": per_slot}
+        return Llama(
+            model_path=self.model_path,
+            n_ctx=n_ctx,
+            n_gpu_layers=LLM_GPU_LAYERS, # Offload some to GPU, keep context safe
+            use_mmap=True, # Map weights instead of copying them into anonymous memory
+            verbose=False,
+            **threads
+        )
+
+    def close(self):
+        """Release the llama.cpp model, its slots and their KV caches."""
+        contexts = [self._extended_llm]
+        while not self._slots.empty():
+            contexts.append(self._slots.get_nowait())
+        if self.llm not in contexts:
+            contexts.append(self.llm)
+        for llm in contexts:
+            if llm is not None and hasattr(llm, "close"):
+                llm.close()
+        self._extended_llm = None
+        self.llm = None
+
+    @property
+    def n_ctx_train(self) -> int:
+        """Context length the model was trained with (upper bound for any context)."""
+        model = getattr(self.llm, "_model", None)
+        if model is not None and hasattr(model, "n_ctx_train"):
+            return model.n_ctx_train()
+        return EXTENDED_N_CTX
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(self.llm, text)
+
+    def _get_extended_llm(self):
+        with self._extended_lock:
+            if self._extended_llm is None:
+                # Single extended context; requests needing it take turns via _extended_lock
+                n_ctx = min(EXTENDED_N_CTX, self.n_ctx_train)
+                logger.info(f"📐 Creating extended LLM context (n_ctx={n_ctx})...")
+                self._extended_llm = self._create_llama(n_ctx)
+            return self._extended_llm
+
+    def _budgeted_prompt(self, request_class: str, render, sections: list[PromptSection], max_tokens: int):
+        """Choose a context size for the request class and pack the prompt to fit it.
+
+        Sections are trimmed by priority so that prompt + max_tokens never
+        exceeds the context. Returns (n_ctx, prompt, max_tokens).
+        """
+        n_ctx = self.base_n_ctx
+        max_ctx = min(REQUEST_CLASS_MAX_CTX.get(request_class, DEFAULT_N_CTX), self.n_ctx_train)
+        if max_ctx > n_ctx:
+            full_prompt = render({s.name: s.text for s in sections})
+            needed = self.count_tokens(full_prompt) + max_tokens + SAFETY_MARGIN_TOKENS
+            if needed > n_ctx:
+                n_ctx = max_ctx # Never beyond what the model was trained for
+
+        max_tokens = min(max_tokens, n_ctx - MIN_PROMPT_TOKENS)
+        prompt, prompt_tokens, trimmed = fit_prompt(self.llm, n_ctx, render, sections, max_tokens)
+        if trimmed:
+            logger.info(f"✂️ Trimmed {request_class} prompt to {prompt_tokens} tokens (n_ctx={n_ctx}, max_tokens={max_tokens}).")
+        return n_ctx, prompt, max_tokens
+
+    def _run(self, n_ctx: int, prompt: str, method: str = "", **kwargs):
+        """Run one completion on a free decoding slot (or the extended context)."""
+        start = time.perf_counter()
+        if n_ctx > self.base_n_ctx:
+            llm = self._get_extended_llm()
+            with self._extended_lock:
+                response, timings = self._timed_call(llm, prompt, **kwargs)
+        else:
+            llm = self._slots.get()
+            try:
+                response, timings = self._timed_call(llm, prompt, **kwargs)
+            finally:
+                self._slots.put(llm)
+        elapsed = time.perf_counter() - start
+        usage = response.get("usage") or {}
+        completion_tokens = usage.get("completion_tokens", 0)
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            self._stats["completion_tokens"] += completion_tokens
+            self._stats["busy_seconds"] += elapsed
+
+        tracing.annotate(
+            n_ctx=n_ctx,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=completion_tokens,
+            prompt_eval_ms=round(timings[0] * 1000, 1) if timings else None,
+            decode_ms=round(timings[1] * 1000, 1) if timings else None,
+        )
+        metrics.LLM_REQUEST_SECONDS.observe(elapsed, method=method)
+        metrics.LLM_TOKENS.inc(usage.get("prompt_tokens", 0), method=method, kind="prompt")
+        metrics.LLM_TOKENS.inc(completion_tokens, method=method, kind="completion")
+        if timings:
+            prompt_seconds, eval_seconds = timings
+            metrics.LLM_PROMPT_EVAL_SECONDS.observe(prompt_seconds, method=method)
+            metrics.LLM_GENERATION_SECONDS.observe(eval_seconds, method=method)
+            if eval_seconds > 0:
+                metrics.LLM_TOKENS_PER_SECOND.observe(completion_tokens / eval_seconds, method=method)
+        return response
+
+    @staticmethod
+    def _timed_call(llm, prompt: str, **kwargs):
+        """Call the model and read llama.cpp's prefill/decode split for this call.
+
+        Returns (response, (prompt_eval_seconds, eval_seconds)), or (response, None)
+        when the installed llama-cpp-python doesn't expose perf counters.
+        """
+        import llama_cpp
+        ctx = getattr(getattr(llm, "_ctx", None), "ctx", None)
+        perf = getattr(llama_cpp, "llama_perf_context", None)
+        reset = getattr(llama_cpp, "llama_perf_context_reset", None)
+        if ctx is not None and perf and reset:
+            reset(ctx)
+        response = llm(prompt, **kwargs)
+        if ctx is None or not perf:
+            return response, None
+        try:
+            data = perf(ctx)
+            if not (data.t_p_eval_ms or data.t_eval_ms):
+                return response, None # Perf counters disabled for this context
+            return response, (data.t_p_eval_ms / 1000, data.t_eval_ms / 1000)
+        except Exception:
+            return response, None
+
+    def stats(self) -> dict:
+        """Cumulative decoding stats; busy_seconds sums per-slot time, so
+        completion_tokens / wall time is the aggregate throughput."""
+        with self._stats_lock:
+            return {
+                **self._stats,
+                "slots": self.slot_count,
+                "free_slots": self._slots.qsize(),
+            }
+
+    def warmup(self):
+        """Run a tiny inference so the first real request doesn't pay for page-ins."""
+        if not self.llm:
+            return
+        logger.info("🔥 Warming up LLM...")
+        contexts = [self._slots.get() for _ in range(self.slot_count)]
+        try:
+            for llm in contexts:
+                llm("<|im_start|>user\nping<|im_end|>\n<|im_start|>assistant\n", max_tokens=1)
+        finally:
+            for llm in contexts:
+                self._slots.put(llm)
+        logger.info("✅ LLM warmup complete.")
+
     def analyze_comment(self, text: str):
         if not self.llm:
             return None
 
         # ChatML format for Qwen
-        prompt = f"""<|im_start|>system
+        render = lambda parts: f"""<|im_start|>system
 You are an AI assistant that analyzes user feedback for product managers.
 Analyze the following comment and return a JSON object with:
 - "sentiment_score": a number between -1.0 (negative) and 1.0 (positive).
@@ -69,14 +309,19 @@ Analyze the following comment and return a JSON object with:
 Return ONLY valid JSON.
 <|im_end|>
 <|im_start|>user
-Comment: "{text}"
+Comment: "{parts['comment']}"
 <|im_end|>
 <|im_start|>assistant
 """
         try:
-            response = self.llm(
+            n_ctx, prompt, max_tokens = self._budgeted_prompt(
+                "analyze", render, [PromptSection("comment", text, trim="middle")], 300
+            )
+            response = self._run(
+                n_ctx,
                 prompt,
-                max_tokens=300,
+                method="analyze_comment",
+                max_tokens=max_tokens,
                 stop=["<|im_end|>"],
                 temperature=0.1
             )
@@ -93,45 +338,194 @@ Comment: "{text}"
                     return json.loads(json_str)
                 except json.JSONDecodeError:
                     logger.error(f"❌ Failed to decode JSON from: {json_str}")
+                    metrics.LLM_JSON_PARSE_FAILURES.inc(method="analyze_comment")
                     return None
             else:
                 logger.warning(f"⚠️ Could not find JSON markers in LLM output: {output_text}")
+                metrics.LLM_JSON_PARSE_FAILURES.inc(method="analyze_comment")
                 return None
         except Exception as e:
             logger.error(f"❌ Error during LLM analysis: {e}")
             return None
 
-    def generate_report(self, comments: list[str]):
+    @staticmethod
+    def _format_stats(stats: dict | None) -> str:
+        """Render precomputed post aggregates as a prompt preamble."""
+        if not stats:
+            return ""
+        return (
+            "Precomputed statistics for ALL feedback on this post:\n"
+            f"- Total analyzed comments: {stats.get('comment_count', 0)}\n"
+            f"- Average sentiment: {stats.get('average_sentiment', 0)}\n"
+            f"- Sentiment histogram: {json.dumps(stats.get('sentiment_histogram', {}))}\n"
+            f"- Category counts: {json.dumps(stats.get('category_counts', {}))}\n"
+            f"- Top keywords: {json.dumps(stats.get('top_keywords', {}))}\n\n"
+        )
+
+    def generate_report(self, comments: list[str], stats: dict | None = None):
         if not self.llm:
             return "LLM not loaded."
 
-        comments_text = "\n".join([f"- {c}" for c in comments[:50]]) # Limit to 50
+        # As many whole comments as the context allows (stats are packed first)
+        comments_text = "\n".join([f"- {c}" for c in comments])
         
-        prompt = f"""<|im_start|>system
-You are an Elite Product Strategist and Data Analyst. Your goal is to transform raw community feedback into a high-impact, professional Community Intelligence Report.
+        render = lambda parts: f"""<|im_start|>system
+{REPORT_SYSTEM_PROMPT}
+<|im_end|>
+<|im_start|>user
+{parts['stats']}Process the following feedback signals into a structured report:
+{parts['comments']}
+<|im_end|>
+<|im_start|>assistant
+"""
+        n_ctx, prompt, max_tokens = self._budgeted_prompt("report", render, [
+            PromptSection("stats", self._format_stats(stats), priority=0),
+            PromptSection("comments", comments_text, priority=1, trim="lines"),
+        ], 1000)
+        response = self._run(
+            n_ctx,
+            prompt,
+            method="generate_report",
+            max_tokens=max_tokens,
+            stop=["<|im_end|>"],
+            temperature=0.7
+        )
+        return response['choices'][0]['text'].strip()
 
-STRICT FORMATTING RULES:
-1. Use professional, data-centric language.
-2. Use Markdown headers (##, ###) for clear separation.
-3. Keep it punchy but comprehensive.
-4. Avoid generic filler; cite specific patterns found in the feedback.
+    @staticmethod
+    def _content_hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
-REQUIRED SECTIONS:
-- ## 📊 EXECUTIVE SUMMARY
-- ## 📈 SENTIMENT PULSE
-- ## 🔥 HIGH-RESONANCE ISSUES
-- ## 🚀 GROWTH OPPORTUNITIES
-- ## 🛠️ STRATEGIC ROADMAP
+    def chunk_group(self, texts: list[str]) -> list[list[str]]:
+        """Split one group's comments into map chunks with content-defined boundaries.
+
+        Comments are ordered by hash and a chunk may also end at a comment whose
+        hash hits a boundary pattern, so adding a comment usually changes only
+        the chunk it lands in and the other chunks stay cache hits.
+        """
+        chunks, current, size = [], [], 0
+        for text in sorted(texts, key=self._content_hash):
+            tokens = self.count_tokens(text) + 2 # "- " prefix and newline
+            if tokens > MAP_CHUNK_TOKENS:
+                text = text[:MAP_CHUNK_TOKENS * 3] # Roughly the token budget; packing trims the rest
+                tokens = MAP_CHUNK_TOKENS
+            at_boundary = size >= MAP_CHUNK_TOKENS // 2 and int(self._content_hash(text)[:4], 16) % 4 == 0
+            if current and (size + tokens > MAP_CHUNK_TOKENS or at_boundary):
+                chunks.append(current)
+                current, size = [], 0
+            current.append(text)
+            size += tokens
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _summary_key(self, label: str, texts: list[str]) -> str:
+        return hashlib.sha256("\n".join([self.model_path, label] + texts).encode("utf-8")).hexdigest()
+
+    def summarize_group(self, label: str, texts: list[str]) -> str:
+        """Map step: summarize one chunk of comments, cached by its content hash."""
+        key = self._summary_key(label, texts)
+        with self._summary_cache_lock:
+            if key in self._summary_cache:
+                self._summary_cache.move_to_end(key)
+                return self._summary_cache[key]
+
+        comments_text = "\n".join([f"- {t}" for t in texts])
+        render = lambda parts: f"""<|im_start|>system
+You are a Data Analyst condensing community feedback. Summarize the comments below in at most 6 bullet points.
+Capture recurring issues, requests, overall sentiment and notable quotes. Mention how many comments share each point.
+<|im_end|>
+<|im_start|>user
+Category: {label}
+Comments ({len(texts)}):
+{parts['comments']}
+<|im_end|>
+<|im_start|>assistant
+"""
+        n_ctx, prompt, max_tokens = self._budgeted_prompt(
+            "report", render, [PromptSection("comments", comments_text, trim="lines")], MAP_SUMMARY_TOKENS
+        )
+        response = self._run(
+            n_ctx,
+            prompt,
+            method="summarize_group",
+            max_tokens=max_tokens,
+            stop=["<|im_end|>"],
+            temperature=0.2
+        )
+        summary = response['choices'][0]['text'].strip()
+        with self._summary_cache_lock:
+            self._summary_cache[key] = summary
+            while len(self._summary_cache) > SUMMARY_CACHE_SIZE:
+                self._summary_cache.popitem(last=False)
+        return summary
+
+    def generate_report_hierarchical(self, comments: list[dict], stats: dict | None = None) -> str:
+        """Map-reduce report over every comment.
+
+        `comments` are dicts with "content" and an optional "category". Comments
+        are grouped by category, each group is summarized in budgeted chunks
+        (map), and the summaries are merged into the sectioned report (reduce).
+        """
+        if not self.llm:
+            return "LLM not loaded."
+
+        groups: dict[str, list[str]] = {}
+        for c in comments:
+            if c.get("content"):
+                groups.setdefault(c.get("category") or "uncategorized", []).append(c["content"])
+
+        # Map (chunks are independent, so they run in parallel across decoding slots)
+        jobs = [
+            (label, chunk)
+            for label, texts in sorted(groups.items(), key=lambda g: -len(g[1]))
+            for chunk in self.chunk_group(texts)
+        ]
+        cache_hits = sum(self._summary_key(label, chunk) in self._summary_cache for label, chunk in jobs)
+        with ThreadPoolExecutor(max_workers=self.slot_count) as pool:
+            results = list(pool.map(lambda job: self.summarize_group(*job), jobs))
+        summaries = [
+            f"### {label} ({len(chunk)} comments)\n{summary}"
+            for (label, chunk), summary in zip(jobs, results)
+        ]
+        logger.info(f"🗺️ Report map step: {len(summaries)} chunk summaries ({cache_hits} cached) over {len(comments)} comments.")
+
+        # Reduce intermediate summaries until they fit the final prompt
+        while self.count_tokens("\n\n".join(summaries)) > REDUCE_INPUT_TOKENS and len(summaries) > 1:
+            merged, batch, size = [], [], 0
+            for summary in summaries:
+                tokens = self.count_tokens(summary)
+                if batch and size + tokens > REDUCE_INPUT_TOKENS // 2:
+                    merged.append(self.summarize_group("combined summaries", batch))
+                    batch, size = [], 0
+                batch.append(summary)
+                size += tokens
+            if batch:
+                merged.append(self.summarize_group("combined summaries", batch))
+            if len(merged) >= len(summaries):
+                break
+            summaries = merged
+
+        group_counts = ", ".join(f"{label}: {len(texts)}" for label, texts in groups.items())
+        render = lambda parts: f"""<|im_start|>system
+{REPORT_SYSTEM_PROMPT}
 <|im_end|>
 <|im_start|>user
-Process the following feedback signals into a structured report:
-{comments_text}
+{parts['stats']}The feedback below was pre-summarized per category. Total comments: {len(comments)} ({group_counts}).
+Process these summaries into a structured report:
+{parts['summaries']}
 <|im_end|>
 <|im_start|>assistant
 """
-        response = self.llm(
+        n_ctx, prompt, max_tokens = self._budgeted_prompt("report", render, [
+            PromptSection("stats", self._format_stats(stats), priority=0),
+            PromptSection("summaries", "\n\n".join(summaries), priority=1, trim="lines"),
+        ], 1000)
+        response = self._run(
+            n_ctx,
             prompt,
-            max_tokens=1000,
+            method="generate_report_hierarchical",
+            max_tokens=max_tokens,
             stop=["<|im_end|>"],
             temperature=0.7
         )
@@ -142,30 +536,33 @@ Process the following feedback signals into a structured report:
         if not self.llm:
             return None
 
-        # Prepare context (truncate if too large)
-        tree_context = "\n".join(file_tree[:300])
-        
-        # Qwen ChatML Prompt
-        prompt = f"""<|im_start|>system
+        # Qwen ChatML Prompt (the file tree is packed into whatever the task leaves)
+        render = lambda parts: f"""<|im_start|>system
 You are an autonomous coding agent.
 Your goal is to generate file contents to complete the task.
 You must output ONLY valid JSON.
 Format: {{ "files": [ {{ "path": "...", "content": "..." }} ] }}
 <|im_end|>
 <|im_start|>user
-Task: {task}
+Task: {parts['task']}
 
 Repository Structure:
-{tree_context}
+{parts['tree']}
 
 Generate the JSON/code now.
 <|im_end|>
 <|im_start|>assistant
 """
         try:
-            response = self.llm(
+            n_ctx, prompt, max_tokens = self._budgeted_prompt("codegen", render, [
+                PromptSection("task", task, priority=0),
+                PromptSection("tree", "\n".join(file_tree), priority=1, trim="lines"),
+            ], 4096)
+            response = self._run(
+                n_ctx,
                 prompt,
-                max_tokens=4096,
+                method="generate_code",
+                max_tokens=max_tokens,
                 stop=["<|im_end|>"],
                 temperature=0.1,
                 echo=False
@@ -182,31 +579,206 @@ Generate the JSON/code now.
                     return json.loads(json_str)
                 except json.JSONDecodeError:
                     logger.error(f"❌ Failed to decode JSON from Qwen output: {json_str[:200]}...")
+                    metrics.LLM_JSON_PARSE_FAILURES.inc(method="generate_code")
                     return None
             else:
                 logger.warning(f"⚠️ No JSON object found in Qwen output: {output_text[:200]}")
+                metrics.LLM_JSON_PARSE_FAILURES.inc(method="generate_code")
                 return None
                 
         except Exception as e:
             logger.error(f"❌ Error during Qwen code generation: {e}")
             return None
+
+    def plan_code(self, task: str, file_tree: list[str]) -> list[dict] | None:
+        """Pick the files to write for a task: [{"path", "purpose", "depends_on"}], or None."""
+        if not self.llm:
+            return None
+
+        render = lambda parts: f"""<|im_start|>system
+You are an autonomous coding agent planning a change before writing it.
+List the files to create or modify, at most {CODEGEN_MAX_FILES}, in the order they should be written.
+depends_on lists the other planned files whose content this file needs (for example, modules it imports).
+You must output ONLY valid JSON.
+Format: {{ "files": [ {{ "path": "...", "purpose": "...", "depends_on": ["..."] }} ] }}
+<|im_end|>
+<|im_start|>user
+Task: {parts['task']}
+
+Repository Structure:
+{parts['tree']}
+
+Output the plan JSON now.
+<|im_end|>
+<|im_start|>assistant
+"""
+        try:
+            n_ctx, prompt, max_tokens = self._budgeted_prompt("codegen", render, [
+                PromptSection("task", task, priority=0),
+                PromptSection("tree", "\n".join(file_tree), priority=1, trim="lines"),
+            ], CODEGEN_PLAN_MAX_TOKENS)
+            response = self._run(
+                n_ctx,
+                prompt,
+                method="plan_code",
+                max_tokens=max_tokens,
+                stop=["<|im_end|>"],
+                temperature=0.1,
+                echo=False
+            )
+
+            output_text = response['choices'][0]['text'].strip()
+            start = output_text.find('{')
+            end = output_text.rfind('}') + 1
+            try:
+                plan = json.loads(output_text[start:end]) if start != -1 and end > start else None
+            except json.JSONDecodeError:
+                plan = None
+            if not isinstance(plan, dict) or not isinstance(plan.get("files"), list):
+                logger.warning(f"⚠️ No usable plan in Qwen output: {output_text[:200]}")
+                metrics.LLM_JSON_PARSE_FAILURES.inc(method="plan_code")
+                return None
+
+            files = []
+            for entry in plan["files"]:
+                if isinstance(entry, dict) and isinstance(entry.get("path"), str) and entry["path"].strip():
+                    depends_on = entry.get("depends_on")
+                    files.append({
+                        "path": entry["path"].strip(),
+                        "purpose": str(entry.get("purpose") or ""),
+                        "depends_on": [d for d in depends_on if isinstance(d, str)] if isinstance(depends_on, list) else [],
+                    })
+            return files[:CODEGEN_MAX_FILES] or None
+        except Exception as e:
+            logger.error(f"❌ Error during Qwen code planning: {e}")
+            return None
+
+    def generate_file(self, task: str, path: str, purpose: str, plan: list[dict],
+                      existing: str | None, dependencies: dict[str, str]) -> str | None:
+        """Write one planned file in full. None on failure or if the output was cut off at max_tokens."""
+        if not self.llm:
+            return None
+
+        render = lambda parts: f"""<|im_start|>system
+You are an autonomous coding agent writing one file of a planned change.
+Output ONLY the complete content of {path}, with no explanation and no markdown fences.
+<|im_end|>
+<|im_start|>user
+Task: {parts['task']}
+
+File: {path}
+Purpose: {parts['purpose']}
+
+Planned files:
+{parts['plan']}
+
+Current content of {path}:
+{parts['existing']}
+
+Files it depends on:
+{parts['dependencies']}
+<|im_end|>
+<|im_start|>assistant
+"""
+        plan_text = "\n".join(f"- {f['path']}: {f['purpose']}" for f in plan)
+        dependency_text = "\n\n".join(f"--- {p} ---\n{content}" for p, content in dependencies.items())
+        try:
+            n_ctx, prompt, max_tokens = self._budgeted_prompt("codegen", render, [
+                PromptSection("task", task, priority=0),
+                PromptSection("purpose", purpose, priority=0),
+                PromptSection("existing", existing if existing is not None else "(new file)", priority=1, trim="middle"),
+                PromptSection("dependencies", dependency_text or "(none)", priority=2, trim="middle"),
+                PromptSection("plan", plan_text, priority=3, trim="lines"),
+            ], CODEGEN_FILE_MAX_TOKENS)
+            response = self._run(
+                n_ctx,
+                prompt,
+                method="generate_file",
+                max_tokens=max_tokens,
+                stop=["<|im_end|>"],
+                temperature=0.1,
+                echo=False
+            )
+            choice = response['choices'][0]
+            if choice.get('finish_reason') == "length":
+                logger.warning(f"⚠️ {path} was cut off at {max_tokens} tokens.")
+                return None
+            return choice['text'].strip() + "\n"
+        except Exception as e:
+            logger.error(f"❌ Error generating {path}: {e}")
+            return None
+
+    def repair_file(self, task: str, path: str, content: str, error: str) -> str | None:
+        """Regenerate one generated file that failed validation, given the error."""
+        if not self.llm:
+            return None
+
+        render = lambda parts: f"""<|im_start|>system
+You are an autonomous coding agent fixing one file you generated.
+It failed validation. Output ONLY the complete corrected file content, with no explanation and no markdown fences.
+<|im_end|>
+<|im_start|>user
+Task: {parts['task']}
+
+File: {path}
+Validation error:
+{parts['error']}
+
+Current content:
+{parts['content']}
+<|im_end|>
+<|im_start|>assistant
+"""
+        try:
+            n_ctx, prompt, max_tokens = self._budgeted_prompt("codegen", render, [
+                PromptSection("error", error, priority=0, trim="head"),
+                PromptSection("content", content, priority=1, trim="middle"),
+                PromptSection("task", task, priority=2, trim="lines"),
+            ], 4096)
+            response = self._run(
+                n_ctx,
+                prompt,
+                method="repair_file",
+                max_tokens=max_tokens,
+                stop=["<|im_end|>"],
+                temperature=0.1,
+                echo=False
+            )
+            return response['choices'][0]['text'].strip() + "\n"
+        except Exception as e:
+            logger.error(f"❌ Error repairing {path}: {e}")
+            return None
+
     def chat_completion(self, messages: list, temperature: float = 0.7, max_tokens: int = 1024) -> str:
         """OpenAI-compatible chat completion using local Qwen."""
         if not self.llm:
             return "Error: Local LLM not loaded."
 
-        # Map OpenAI messages to ChatML
-        prompt = ""
-        for m in messages:
-            role = m.get("role", "user")
-            content = m.get("content", "")
-            prompt += f"<|im_start|>{role}\n{content}<|im_end|>\n"
-        
-        prompt += "<|im_start|>assistant\n"
+        # Map OpenAI messages to ChatML. System messages and the latest message are
+        # packed first, then the rest from newest to oldest.
+        roles = [m.get("role", "user") for m in messages]
+        sections = []
+        for i, m in enumerate(messages):
+            if roles[i] == "system":
+                priority = 0
+            elif i == len(messages) - 1:
+                priority = 1
+            else:
+                priority = 2 + (len(messages) - i)
+            sections.append(PromptSection(f"m{i}", m.get("content", "") or "", priority=priority, trim="middle"))
+
+        def render(parts):
+            prompt = ""
+            for i, role in enumerate(roles):
+                prompt += f"<|im_start|>{role}\n{parts[f'm{i}']}<|im_end|>\n"
+            return prompt + "<|im_start|>assistant\n"
 
         try:
-            response = self.llm(
+            n_ctx, prompt, max_tokens = self._budgeted_prompt("chat", render, sections, max_tokens)
+            response = self._run(
+                n_ctx,
                 prompt,
+                method="chat_completion",
                 max_tokens=max_tokens,
                 stop=["<|im_end|>"],
                 temperature=temperature,
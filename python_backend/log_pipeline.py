@@ -0,0 +1,143 @@
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import tracing
+
+# Records are enqueued by a QueueHandler and written by a QueueListener thread, so a
+# logger.info() inside an async handler never does file I/O on the event loop.
+LOG_FILE = os.getenv("LOG_FILE", "backend.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24")) # 0 = size-based rotation only
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+TAIL_BLOCK_SIZE = 8192
+STREAM_QUEUE_SIZE = 1000 # Lines buffered per SSE subscriber before it starts dropping
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that also rolls over every `rotate_seconds`.
+
+    The interval counts from when the current file was started, not from
+    process start, so a node that restarts more often than the interval
+    still rotates by time.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, rotate_seconds: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotate_seconds = rotate_seconds
+        self._rollover_at = self._next_rollover(self._file_started_at())
+
+    def _file_started_at(self) -> float:
+        # The newest backup was last written when the current file took over; without
+        # one, fall back to the file's own mtime like TimedRotatingFileHandler
+        for path in (f"{self.baseFilename}.1", self.baseFilename):
+            if os.path.exists(path):
+                return os.stat(path).st_mtime
+        return time.time()
+
+    def _next_rollover(self, started_at: float | None = None) -> float:
+        if self.rotate_seconds <= 0:
+            return float("inf")
+        return (started_at or time.time()) + self.rotate_seconds
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self._rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self._rollover_at = self._next_rollover()
+
+class _TraceIdFilter(logging.Filter):
+    """Stamp records with the active trace id in the logging thread, before they are queued."""
+
+    def filter(self, record):
+        record.trace_id = tracing.current_trace_id()
+        return True
+
+class LogBroadcaster(logging.Handler):
+    """Fans formatted lines out to SSE subscribers on the event loop."""
+
+    def __init__(self):
+        super().__init__()
+        self._subscribers: set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(STREAM_QUEUE_SIZE))
+        self._subscribers.add(subscriber)
+        return subscriber[1]
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self._subscribers = {s for s in self._subscribers if s[1] is not q}
+
+    @staticmethod
+    def _offer(q: asyncio.Queue, item):
+        if not q.full(): # Slow consumers lose lines rather than growing memory
+            q.put_nowait(item)
+
+    def emit(self, record):
+        if not self._subscribers:
+            return
+        item = (self.format(record), getattr(record, "trace_id", None))
+        for loop, q in list(self._subscribers):
+            try:
+                loop.call_soon_threadsafe(self._offer, q, item)
+            except RuntimeError:
+                self.unsubscribe(q) # Loop closed
+
+broadcaster = LogBroadcaster()
+_listener: QueueListener | None = None
+
+def configure_logging():
+    """Route the root logger through a queue to rotating file, console and SSE handlers."""
+    global _listener
+    if _listener:
+        return
+    # Worker processes (e.g. the embedding pool) import main too; only the parent owns the files
+    if multiprocessing.parent_process() is not None:
+        logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = SizeAndTimeRotatingFileHandler(LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_HOURS * 3600)
+    handlers = [file_handler, logging.StreamHandler(), broadcaster]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(_TraceIdFilter())
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [queue_handler]
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+def tail_lines(path: str, n: int) -> str:
+    """Last `n` lines of a file, reading backwards in blocks instead of the whole file."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= n:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return "".join(lines[-n:])
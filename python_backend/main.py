@@ -1,16 +1,14 @@
 import os
-import sys
 import asyncio
 import json
 import traceback
 import tempfile
 import shutil
 import subprocess
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from fastapi import FastAPI, HTTPException, Response, Header, Depends, Request
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
-import torch
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import logging
 import uvicorn
 import uuid
@@ -20,7 +18,11 @@ from fastapi.middleware.cors import CORSMiddleware
 # --- Types ---
 
 class CommentRequest(BaseModel):
-    comment_ids: list[str]
+    comment_ids: list[str] = []
+    post_id: str = "" # When set, served from post_feedback_aggregates
+
+class ReportRequest(CommentRequest):
+    mode: str = "auto" # "single", "hierarchical" (map-reduce over all comments) or "auto"
 
 class GenerateRequest(BaseModel):
     repo_url: str
@@ -28,16 +30,11 @@ class GenerateRequest(BaseModel):
     task_id: str = "" # Optional Supabase task ID for progression updates
     github_token: str = ""
     create_pr: bool = False
+    mode: str = "" # "plan" or "single"; defaults to CODEGEN_MODE
 
-# Configure logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("backend.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: queued, written off the event loop to a rotating file
+import log_pipeline
+log_pipeline.configure_logging()
 logger = logging.getLogger(__name__)
 from supabase.client import AsyncClient
 from dotenv import load_dotenv
@@ -45,43 +42,268 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Use all-MiniLM-L6-v2 (384 dimensions)
-model_name = "sentence-transformers/all-MiniLM-L6-v2"
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"Loading model '{model_name}' on {device}...")
-model = SentenceTransformer(model_name, device=device)
+# Fallback embedding model; at startup the active row in embedding_models wins,
+# since stored vectors must come from the same model as query vectors
+model_name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# torch and the SentenceTransformer are loaded in the background after startup;
+# encoding runs in embedding_pool's worker processes, which share its weights
+model = None
+device = None
+embedding_pool = None
 
 # Supabase setup
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 
+from model_manager import ModelManager, ModelUnavailableError
+from response_cache import ResponseCache, response_cache_from_env
+from worker_leases import WorkerLeases, WORKER_MODE, WORKER_ID, POLL_INTERVAL_SECONDS
+from backfill import BackfillPipeline, TRIAGE_OK, TRIAGE_FAILED, TRIAGE_UNAVAILABLE
+from ingest import IngestJob, analysis_row
+from reembed import ReembedJob, active_embedding_model
+import metrics
+import tracing
+import profiling
+from patch_validation import PatchValidator, confine_path, strip_code_fences
+from planned_codegen import PlannedGeneration, CODEGEN_MODE
+from pr_description import describe_pr
+from admission import AdmissionController, AdmissionRejected, ADMISSION_ENABLED
+from embedding_pool import EmbeddingPool
+from transport import ReadCache, http_client, close_http_client, supabase_options
+
 # Global clients
 supabase: AsyncClient = None
 main_loop = None
-llm_service = None
+worker_leases: WorkerLeases = None
+backfill_pipeline: BackfillPipeline = None
+ingest_jobs: dict[str, IngestJob] = {}
+INGEST_JOB_TTL_SECONDS = 3600 # Finished jobs stay queryable at /ingest/{job_id} this long
+# Fire-and-forget tasks; the event loop only keeps weak references to them
+background_jobs: set[asyncio.Task] = set()
+reembed_job: ReembedJob = None
+reembed_task: asyncio.Task = None
+# Comment ids inserted by /ingest; realtime INSERT events for them are ignored (id -> expiry)
+ingest_owned_ids: dict[str, float] = {}
+INGEST_OWNERSHIP_SECONDS = 600
+# Missed comments are analyzed by the backfill; set to also queue agent tasks for them
+BACKFILL_TRIGGER_AGENT = os.getenv("BACKFILL_TRIGGER_AGENT", "false").lower() == "true"
+# Actionable comments on a monitored post are grouped by embedding similarity into one
+# agent task, released when the window closes or the group reaches the size cap
+AGENT_COALESCE_WINDOW_SECONDS = int(os.getenv("AGENT_COALESCE_WINDOW_SECONDS", "120"))
+AGENT_COALESCE_MAX_COMMENTS = int(os.getenv("AGENT_COALESCE_MAX_COMMENTS", "10"))
+AGENT_COALESCE_SIMILARITY = float(os.getenv("AGENT_COALESCE_SIMILARITY", "0.6"))
+AGENT_COALESCE_SWEEP_SECONDS = float(os.getenv("AGENT_COALESCE_SWEEP_SECONDS", "10"))
+
+# Created in lifespan, not at import: embedding pool workers are spawned and
+# re-import this module as __mp_main__ when the server runs as `python main.py`.
+# Owns the single Llama instance; all generations borrow it through run_llm()
+model_manager: ModelManager = None
+# Responses for deterministic/low-temperature (or opted-in) calls
+response_cache: ResponseCache = None
+# Fails LLM endpoint requests fast with 429 when they would miss their latency SLO
+admission_controller = AdmissionController()
+# Hot reads (comment -> post, monitored posts, task results) shared across a burst
+read_cache = ReadCache()
+# Comments are never edited by the backend, so their rows can be cached longer
+COMMENT_CACHE_TTL_SECONDS = float(os.getenv("COMMENT_CACHE_TTL_SECONDS", "300"))
+
+# --- Model Loading State ---
+# Models load in the background so the server is live immediately after a restart.
+# States: pending -> loading -> warming -> ready | failed | missing
+MODEL_RETRY_AFTER_SECONDS = int(os.getenv("MODEL_RETRY_AFTER_SECONDS", "15"))
+model_status = {
+    name: {"state": "pending", "error": None, "load_seconds": None}
+    for name in ("embedding", "llm")
+}
+model_loaded_events: dict[str, asyncio.Event] = {}
+
+def load_sentence_transformer(name: str):
+    """Import torch and load a SentenceTransformer on the best available device."""
+    global device
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Loading model '{name}' on {device}...")
+    return SentenceTransformer(name, device=device)
+
+def load_embedding_model():
+    """Load the active embedding model and start its warmed-up worker pool."""
+    global model, embedding_pool
+    loaded = load_sentence_transformer(model_name)
+    model_status["embedding"]["state"] = "warming"
+    pool = EmbeddingPool(loaded)
+    pool.start()
+    model, embedding_pool = loaded, pool
+
+async def resolve_embedding_model():
+    """Serve with whichever model produced the stored vectors."""
+    global model_name
+    try:
+        active = await active_embedding_model(supabase)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read embedding_models, using {model_name}: {e}")
+        return
+    if active and active["model_id"] != model_name:
+        logger.info(f"🧭 Stored embeddings are from {active['model_id']}; using it instead of {model_name}.")
+        model_name = active["model_id"]
+
+def load_llm_service():
+    """Load the best .gguf from models/ and run a warmup inference."""
+    # This will automatically find the best .gguf in models/ dir
+    loaded = model_manager.load()
+    if loaded:
+        main_loop.call_soon_threadsafe(admission_controller.resize, model_manager.slot_count)
+    return loaded
+
+async def load_models_in_background():
+    """Load and warm up each model off the event loop, recording per-model state."""
+    loaders = [
+        ("embedding", load_embedding_model),
+        ("llm", load_llm_service),
+    ]
+    for name, loader in loaders:
+        status = model_status[name]
+        status["state"] = "loading"
+        start = time.perf_counter()
+        try:
+            loaded = await main_loop.run_in_executor(None, loader)
+            status["state"] = "missing" if loaded is False else "ready"
+            logger.info(f"✅ Model '{name}' is {status['state']}.")
+        except Exception as e:
+            status["state"] = "failed"
+            status["error"] = str(e)
+            logger.error(f"❌ Failed to load model '{name}': {e}")
+        finally:
+            status["load_seconds"] = round(time.perf_counter() - start, 2)
+            model_loaded_events[name].set()
+
+async def run_llm(method: str, *args):
+    """Run an LLMService method in the executor as a tracked in-flight generation."""
+    submitted = time.perf_counter()
+    def call():
+        with tracing.span(f"llm.{method}", executor_wait_ms=round((time.perf_counter() - submitted) * 1000, 1)):
+            with model_manager.session() as service:
+                return getattr(service, method)(*args)
+    try:
+        return await main_loop.run_in_executor(None, tracing.run_in_context(call))
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def run_llm_cached(method: str, params: dict, *args, opt_in: bool = False):
+    """run_llm() behind the response cache. Returns (result, (hit, age_seconds)).
+
+    `params` are the prompt inputs and sampling params that identify the call;
+    only successful results are stored so failed attempts are still retried.
+    """
+    if not response_cache.accepts(params.get("temperature"), opt_in):
+        return await run_llm(method, *args), (False, None)
+    key = response_cache.make_key(model_manager.model_file, method, params)
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached[0], (True, round(cached[1], 3))
+    result = await run_llm(method, *args)
+    if result is not None and not (isinstance(result, str) and result.startswith("Error:")):
+        response_cache.put(key, result)
+    return result, (False, None)
+
+def admission(request_class: str):
+    """Endpoint dependency: admit the request (or 429 with Retry-After) and time it."""
+    async def dependency(request: Request, x_caller_id: str = Header(default="")):
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        caller = x_caller_id or (request.client.host if request.client else "unknown")
+        try:
+            ticket = admission_controller.admit(request_class, caller)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            admission_controller.release(ticket, succeeded)
+    return Depends(dependency)
+
+def is_model_ready(name: str) -> bool:
+    return model_status[name]["state"] == "ready"
 
-from llm_service import LLMService
+def require_model(name: str):
+    """Fail fast with 503 (and Retry-After while loading) if a model isn't ready."""
+    state = model_status[name]["state"]
+    if state == "ready":
+        return
+    if state in ("pending", "loading", "warming"):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model '{name}' is {state}.",
+            headers={"Retry-After": str(MODEL_RETRY_AFTER_SECONDS)}
+        )
+    raise HTTPException(status_code=503, detail=f"Model '{name}' is unavailable ({state}).")
+
+async def wait_for_model(name: str) -> bool:
+    """Block until a model finishes loading (used by background work, not requests)."""
+    event = model_loaded_events.get(name)
+    if event:
+        await event.wait()
+    return is_model_ready(name)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global supabase, main_loop, llm_service
+    global supabase, main_loop, worker_leases, backfill_pipeline, model_manager, response_cache
     main_loop = asyncio.get_event_loop()
+    model_manager = ModelManager(os.path.join("models"), on_warming=lambda: model_status["llm"].update(state="warming"))
+    response_cache = response_cache_from_env()
     
     logger.info("🔗 Initializing Supabase AsyncClient...")
     from supabase._async.client import AsyncClient as SupabaseAsyncClient
-    supabase = SupabaseAsyncClient(supabase_url, supabase_key)
+    supabase = metrics.InstrumentedSupabase(SupabaseAsyncClient(supabase_url, supabase_key, options=supabase_options()))
+    worker_leases = WorkerLeases(supabase)
+    if WORKER_MODE == "sharded":
+        try:
+            # The queue is shared by every backend, so it is never switched as a side effect of startup
+            if not await worker_leases.comment_queue_enabled():
+                logger.error("❌ The comment job queue is off, so new comments reach sharded workers only through the backfill. "
+                             "Enable it with POST /admin/workers/comment_queue once every backend runs sharded.")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read the comment job queue setting: {e}")
+    backfill_pipeline = BackfillPipeline(
+        supabase, embed_texts_async, triage_comment, sharded=(WORKER_MODE == "sharded"),
+        embedding_model=lambda: model_name, triage_ready=llm_ready
+    )
+    await resolve_embedding_model()
     
-    logger.info("🧠 Initializing Local LLM Service...")
-    # This will automatically find the best .gguf in models/ dir
-    model_path = os.path.join("models")
-    llm_service = LLMService(model_path)
+    logger.info("🧠 Loading embedding model and Local LLM in the background...")
+    for name in model_status:
+        model_loaded_events[name] = asyncio.Event()
+    loader_task = asyncio.create_task(load_models_in_background())
     
     stop_event = asyncio.Event()
     listener_task = asyncio.create_task(run_realtime_listener(stop_event))
+    background_tasks = [
+        asyncio.create_task(backfill_pipeline.run_scheduled(stop_event, lambda: wait_for_model("embedding"))),
+        asyncio.create_task(run_agent_task_releaser(stop_event)),
+        asyncio.create_task(run_embedding_model_watcher(stop_event))
+    ]
+    if WORKER_MODE == "sharded":
+        logger.info(f"🧩 Sharded worker mode enabled (worker id: {WORKER_ID}).")
+        background_tasks += [
+            asyncio.create_task(run_lease_worker(stop_event)),
+            asyncio.create_task(run_lease_heartbeat(stop_event)),
+        ]
     yield
     logger.info("🛑 Shutting down Realtime Worker...")
     stop_event.set()
+    loader_task.cancel()
+    if reembed_task:
+        reembed_task.cancel()
     await listener_task
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if embedding_pool:
+        embedding_pool.close()
+    await close_http_client()
+    response_cache.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -99,50 +321,118 @@ class EmbeddingRequest(BaseModel):
 
 class EmbeddingResponse(BaseModel):
     embedding: list[float]
+    model_id: str
+
+async def embed_texts_async(texts: list[str]) -> list[list[float]]:
+    return await embedding_pool.embed(texts)
 
-def generate_embedding_internal(text: str) -> list[float]:
-    return model.encode(text).tolist()
+async def embed_text_async(text: str) -> list[float]:
+    return (await embedding_pool.embed([text]))[0]
 
 @app.post("/embed", response_model=EmbeddingResponse)
 async def get_embedding(request: EmbeddingRequest):
+    require_model("embedding")
     try:
-        embedding = generate_embedding_internal(request.text)
-        return EmbeddingResponse(embedding=embedding)
+        embedding = await embed_text_async(request.text)
+        return EmbeddingResponse(embedding=embedding, model_id=model_name)
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/health")
 async def health_check():
-    llm_status = "active" if llm_service and llm_service.llm else "inactive (model missing)"
-    return {"status": "healthy", "model": model_name, "device": device, "llm": llm_status}
+    llm_status = "active" if model_manager.is_loaded() else model_status["llm"]["state"]
+    return {
+        "status": "healthy", "model": model_name, "device": device, "llm": llm_status,
+        "models": model_status, "llm_manager": model_manager.status(),
+        "response_cache": response_cache.stats(),
+        "admission": admission_controller.status(),
+        "embedding_pool": embedding_pool.status() if embedding_pool else None,
+        "read_cache": read_cache.status(),
+        "worker": {"mode": WORKER_MODE, "id": WORKER_ID}
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of the hot-path histograms and counters."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: the process is up and the event loop is responsive."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: every model has finished loading and warming up."""
+    ready = all(is_model_ready(name) for name in model_status)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "models": model_status}
+    )
+
+class ReinitializeRequest(BaseModel):
+    model_file: str = "" # Optional .gguf file name inside models/ (e.g. another quantization)
+
+@app.get("/models")
+async def list_models():
+    """List the GGUF files available for /reinitialize."""
+    return {"active": model_manager.model_file, "available": model_manager.available_models()}
 
 @app.post("/reinitialize")
-async def reinitialize_llm():
-    """Force reload the LLM service."""
-    global llm_service
+async def reinitialize_llm(req: ReinitializeRequest | None = None):
+    """Hot-swap the LLM: drain in-flight generations, release, reload, warm up, flip."""
+    if model_status["llm"]["state"] in ("pending", "loading", "warming"):
+        # The initial background load is still running
+        require_model("llm")
+    model_file = req.model_file if req else ""
+    try:
+        model_manager.resolve_model_path(model_file)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        logger.info("♻️ Re-initializing LLM Service...")
-        model_path = os.path.join("models")
-        new_service = LLMService(model_path)
-        if new_service.llm:
-            llm_service = new_service
-            return {"success": True, "message": "LLM Service re-initialized successfully."}
+        logger.info(f"♻️ Re-initializing LLM Service ({model_file or 'auto-select'})...")
+        swapped = await main_loop.run_in_executor(None, model_manager.swap, model_file)
+        # The swap passed through "warming"; settle on whatever is loaded now (possibly the restored model)
+        if model_manager.is_loaded():
+            model_status["llm"].update(state="ready", error=None)
+            admission_controller.resize(model_manager.slot_count)
+        if swapped:
+            return {
+                "success": True,
+                "message": "LLM Service re-initialized successfully.",
+                "model_file": model_manager.model_file,
+                "swap_seconds": model_manager.last_swap_seconds
+            }
         else:
-            return {"success": False, "message": "LLM Service failed to load model during re-initialization."}
+            if not model_manager.is_loaded():
+                model_status["llm"].update(state="failed", error="Re-initialization failed.")
+            return {
+                "success": False,
+                "message": "LLM Service failed to load model during re-initialization.",
+                "model_file": model_manager.model_file
+            }
     except Exception as e:
         logger.error(f"❌ Re-initialization failed: {e}")
+        if model_manager.is_loaded():
+            model_status["llm"].update(state="ready")
+        else:
+            model_status["llm"].update(state="failed", error=str(e))
         return {"success": False, "message": str(e)}
 
-@app.post("/analyze_comment/{comment_id}")
+@app.post("/analyze_comment/{comment_id}", dependencies=[admission("analyze")])
+@tracing.traced("analyze_comment")
 async def analyze_comment_endpoint(comment_id: str):
     """Manually trigger analysis for a specific comment."""
+    tracing.annotate(comment_id=comment_id)
+    require_model("embedding")
+    require_model("llm")
     try:
-        res = await supabase.table("comments").select("content").eq("id", comment_id).single().execute()
-        if not res.data:
+        comment = await get_comment(comment_id)
+        if not comment:
             raise HTTPException(status_code=404, detail="Comment not found.")
         
-        content = res.data["content"]
+        content = comment["content"]
         logger.info(f"🧪 Manually analyzing comment {comment_id}...")
         
         # We reuse the existing logic but wrap it for the endpoint
@@ -152,50 +442,119 @@ async def analyze_comment_endpoint(comment_id: str):
         logger.error(f"❌ Manual analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate_report")
-async def generate_report(req: CommentRequest):
-    if not llm_service or not llm_service.llm:
-        raise HTTPException(status_code=503, detail="LLM not loaded")
+# Above this many comments, "auto" reports switch to map-reduce
+REPORT_SINGLE_SHOT_LIMIT = int(os.getenv("REPORT_SINGLE_SHOT_LIMIT", "50"))
+
+@app.post("/generate_report", dependencies=[admission("report")])
+async def generate_report(req: ReportRequest):
+    require_model("llm")
         
     try:
         if not req.comment_ids:
             return {"report": "No comments provided."}
             
         response = await supabase.table("comments")\
-            .select("content")\
+            .select("content, feedback_analysis(category)")\
             .in_("id", req.comment_ids)\
             .execute()
-        comments = [r['content'] for r in response.data]
+        rows = response.data
         
-        if not comments:
+        if not rows:
             return {"report": "No comments found for the given IDs."}
-            
-        report = await main_loop.run_in_executor(None, llm_service.generate_report, comments)
-        return {"report": report}
+        
+        stats = None
+        if req.post_id:
+            agg = await fetch_post_aggregate(req.post_id)
+            stats = summarize_post_aggregate(agg) if agg else None
+        
+        mode = req.mode
+        if mode == "auto":
+            mode = "hierarchical" if len(rows) > REPORT_SINGLE_SHOT_LIMIT else "single"
+        
+        if mode == "hierarchical":
+            comments = []
+            for r in rows:
+                analysis = r.get("feedback_analysis") or []
+                if isinstance(analysis, dict):
+                    analysis = [analysis]
+                category = analysis[0].get("category") if analysis else None
+                comments.append({"content": r["content"], "category": category})
+            report = await run_llm("generate_report_hierarchical", comments, stats)
+        else:
+            report = await run_llm("generate_report", [r["content"] for r in rows], stats)
+        return {"report": report, "mode": mode, "comment_count": len(rows)}
+    except HTTPException:
+        raise
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
 
+async def fetch_post_aggregate(post_id: str) -> dict | None:
+    """Single keyed read of the incrementally maintained per-post aggregates."""
+    res = await supabase.table("post_feedback_aggregates").select("*").eq("post_id", post_id).execute()
+    return res.data[0] if res.data else None
+
+def summarize_post_aggregate(agg: dict) -> dict:
+    """Compact stats derived from an aggregate row (used by the endpoint and reports)."""
+    count = agg.get("comment_count", 0)
+    keywords = sorted((agg.get("keyword_counts") or {}).items(), key=lambda kv: kv[1], reverse=True)
+    return {
+        "comment_count": count,
+        "average_sentiment": round(agg.get("sentiment_sum", 0) / count, 3) if count else 0,
+        "sentiment_histogram": agg.get("sentiment_histogram") or {},
+        "category_counts": agg.get("category_counts") or {},
+        "top_keywords": dict(keywords[:10]),
+    }
+
+@app.get("/posts/{post_id}/aggregates")
+async def get_post_aggregates(post_id: str):
+    """Per-post sentiment histogram, category/keyword counts and top comments."""
+    try:
+        agg = await fetch_post_aggregate(post_id)
+        if not agg:
+            raise HTTPException(status_code=404, detail="No analyzed feedback for this post.")
+        return {**agg, **summarize_post_aggregate(agg)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/top_comment")
 async def get_top_comment(req: CommentRequest):
-    # Simple logic: Find comment with highest sentiment magnitude (furthest from 0) 
-    # or just return the one with 'bug' category if valuable.
-    # Ideally, we used the LLM to rank them, but for speed, let's use the stored analysis.
+    # Rank by the stored analysis priority. With a post_id this is one keyed read of the
+    # precomputed top-K; otherwise the database sorts and returns a single row.
     try:
+        if req.post_id:
+            agg = await fetch_post_aggregate(req.post_id)
+            top_comments = agg.get("top_comments") if agg else None
+            if not top_comments:
+                return {"top_comment": None}
+            top = top_comments[0]
+            return {
+                "top_comment": {
+                    "id": top['comment_id'],
+                    "content": top.get('content', ""),
+                    "score": top.get('sentiment_score', 0),
+                    "category": top.get('category'),
+                    "priority": top.get('priority_score', 0),
+                    "summary": top.get('actionable_summary', "")
+                }
+            }
+
         if not req.comment_ids:
              return {"top_comment": None}
              
         response = await supabase.table("feedback_analysis")\
             .select("comment_id, sentiment_score, category, priority_score, actionable_summary, comments(content)")\
             .in_("comment_id", req.comment_ids)\
+            .order("priority_score", desc=True)\
+            .limit(1)\
             .execute()
             
         data = response.data
         if not data:
             return {"top_comment": None}
             
-        # Rank by priority_score descending
-        sorted_comments = sorted(data, key=lambda x: x.get('priority_score', 0), reverse=True)
-        top = sorted_comments[0]
+        top = data[0]
         
         return {
             "top_comment": {
@@ -210,20 +569,312 @@ async def get_top_comment(req: CommentRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/backfill")
+async def backfill_status():
+    """Status of the catch-up backfill for missed comments."""
+    return backfill_pipeline.status()
+
+@app.post("/backfill")
+async def trigger_backfill():
+    """Start (or resume) a backfill pass now, in the background."""
+    require_model("embedding")
+    if backfill_pipeline.running:
+        return {"success": False, "message": "A backfill pass is already running."}
+    run_in_background(backfill_pipeline.run_pass())
+    return {"success": True, "message": "Backfill pass started."}
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+    return task
+
+class IngestRequest(BaseModel):
+    post_id: str
+    user_id: str
+    comments: list[str]
+    wait: bool = False # Block until the pipeline finishes instead of returning a job id
+
+async def analyze_for_ingest(comment_id: str, content: str) -> dict | None:
+    if not await wait_for_model("llm") or not model_manager.is_loaded():
+        return None
+    return await analyze_with_retries(comment_id, content)
+
+async def claim_ingested_ids(comment_ids: list[str]) -> list[str]:
+    """In sharded mode, take the leases for freshly inserted comments (peers may win some)."""
+    claimed = await worker_leases.claim_comments_by_ids(comment_ids)
+    return [c["comment_id"] for c in claimed]
+
+async def run_ingest_job(job: IngestJob):
+    await job.run()
+    if WORKER_MODE == "sharded" and job.persisted_ids:
+        # Release the leases so lease workers don't re-analyze these comments
+        await worker_leases.complete_comments(job.persisted_ids)
+
+@app.post("/ingest")
+async def ingest_comments(req: IngestRequest):
+    """Bulk insert comments and push them through embed → dedup → analyze → persist."""
+    require_model("embedding")
+    job = IngestJob(
+        supabase, req.post_id, req.user_id, req.comments,
+        embed_batch=embed_texts_async,
+        embedding_model=lambda: model_name,
+        analyze=analyze_for_ingest,
+        claim_ids=claim_ingested_ids if WORKER_MODE == "sharded" else None,
+        on_analyzed=trigger_agent_if_actionable
+    )
+    now = time.time()
+    for expired in [cid for cid, expiry in ingest_owned_ids.items() if expiry < now]:
+        del ingest_owned_ids[expired]
+    for cid in job.comment_ids:
+        ingest_owned_ids[cid] = now + INGEST_OWNERSHIP_SECONDS
+    for finished in [jid for jid, j in ingest_jobs.items() if j.finished_at and j.finished_at < now - INGEST_JOB_TTL_SECONDS]:
+        del ingest_jobs[finished]
+    ingest_jobs[job.id] = job
+    logger.info(f"📥 Ingest job {job.id}: {len(job.contents)} comments for post {req.post_id}")
+
+    if req.wait:
+        await run_ingest_job(job)
+    else:
+        # The comments are stored before answering, so a later failure can't lose them
+        try:
+            await job.insert()
+        except Exception as e:
+            job.status, job.error, job.finished_at = "failed", str(e), time.time()
+            logger.error(f"❌ Ingest job {job.id} could not insert comments: {e}")
+            raise HTTPException(status_code=500, detail=f"Could not insert comments: {e}")
+        run_in_background(run_ingest_job(job))
+    return {**job.summary(), "comment_ids": job.comment_ids}
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    """Progress and per-stage throughput of an ingest job."""
+    job = ingest_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingest job not found.")
+    return job.summary()
+
 @app.get("/logs")
-async def get_logs():
-    """Returns the last 100 lines of the backend log file."""
+async def get_logs(lines: int = 100):
+    """Returns the last `lines` lines of the backend log file."""
     try:
-        if not os.path.exists("backend.log"):
+        if not os.path.exists(log_pipeline.LOG_FILE):
             return {"logs": "Log file not found."}
         
-        with open("backend.log", "r", encoding='utf-8') as f:
-            lines = f.readlines()
-            # Return last 100 lines
-            return {"logs": "".join(lines[-100:])}
+        # Reverse-seek tail, off the event loop
+        tail = await main_loop.run_in_executor(None, log_pipeline.tail_lines, log_pipeline.LOG_FILE, max(1, min(lines, 5000)))
+        return {"logs": tail}
     except Exception as e:
         return {"logs": f"Error reading logs: {str(e)}"}
 
+LOG_STREAM_KEEPALIVE_SECONDS = 15
+
+@app.get("/logs/stream")
+async def stream_logs(request: Request, task_id: str = "", comment_id: str = "", trace_id: str = ""):
+    """Server-sent events of new log lines, optionally only those mentioning a task/comment/trace id."""
+    wanted = [v for v in (task_id, comment_id) if v]
+
+    def matches(line: str, line_trace_id: str | None) -> bool:
+        if trace_id and line_trace_id == trace_id:
+            return True
+        if not wanted and not trace_id:
+            return True
+        return any(v in line for v in wanted)
+
+    async def events():
+        q = log_pipeline.broadcaster.subscribe()
+        try:
+            while not await request.is_disconnected():
+                try:
+                    line, line_trace_id = await asyncio.wait_for(q.get(), timeout=LOG_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if matches(line, line_trace_id):
+                    # SSE data lines can't contain newlines (tracebacks do)
+                    yield "".join(f"data: {part}\n" for part in line.split("\n")) + "\n"
+        finally:
+            log_pipeline.broadcaster.unsubscribe(q)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# --- Admin: On-demand Profiling ---
+# Disabled unless ADMIN_TOKEN is set; callers send it as X-Admin-Token.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: str = Header(default="")):
+    import secrets
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled (set ADMIN_TOKEN).")
+    if not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(seconds: float = 10, interval_ms: float = 5, include_idle: bool = False):
+    """Sample every thread for `seconds` and return collapsed stacks (flamegraph.pl / speedscope input)."""
+    try:
+        profiler = await profiling.profile_for(seconds, interval_ms, include_idle)
+    except profiling.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"🔬 Profiled {profiler.sample_count} samples over {min(seconds, profiling.PROFILE_MAX_SECONDS)}s")
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
+    )
+
+@app.get("/admin/tasks", dependencies=[Depends(require_admin)])
+async def admin_tasks(stack_limit: int = 8):
+    """Snapshot of every asyncio task: coroutine, state and where it is suspended."""
+    return profiling.task_snapshot(asyncio.get_running_loop(), stack_limit)
+
+@app.get("/admin/executor", dependencies=[Depends(require_admin)])
+async def admin_executor():
+    """Default executor occupancy: busy/idle workers, what busy ones run, queued work."""
+    return {
+        **profiling.executor_snapshot(asyncio.get_running_loop()),
+        "llm_in_flight": model_manager.status()["in_flight"],
+        "realtime_queue_depth": metrics.REALTIME_QUEUE_DEPTH.value(),
+    }
+
+# --- Admin: Worker Mode ---
+
+class CommentQueueRequest(BaseModel):
+    enabled: bool
+
+@app.get("/admin/workers/comment_queue", dependencies=[Depends(require_admin)])
+async def admin_comment_queue():
+    """Whether new comments are queued into comment_jobs for sharded workers."""
+    return {"enabled": await worker_leases.comment_queue_enabled(), "worker_mode": WORKER_MODE}
+
+@app.post("/admin/workers/comment_queue", dependencies=[Depends(require_admin)])
+async def admin_set_comment_queue(req: CommentQueueRequest):
+    """Switch the shared comment queue on (all backends sharded) or off (single mode), clearing stale jobs."""
+    await worker_leases.set_comment_queue(req.enabled)
+    logger.info(f"🧩 Comment job queue {'enabled' if req.enabled else 'disabled'}.")
+    return {"enabled": req.enabled}
+
+# --- Admin: Embedding Model Upgrades ---
+
+EMBEDDING_MODEL_POLL_SECONDS = float(os.getenv("EMBEDDING_MODEL_POLL_SECONDS", "30"))
+
+async def switch_embedding_model(target, target_name: str):
+    """Serve live embeddings with an already loaded model, draining the old pool."""
+    global model, model_name, embedding_pool
+    live_pool = EmbeddingPool(target)
+    await main_loop.run_in_executor(None, live_pool.start)
+    previous = embedding_pool
+    model, model_name, embedding_pool = target, target_name, live_pool
+    await previous.aclose()
+    logger.info(f"🔀 Now embedding with {model_name}.")
+
+async def run_embedding_model_watcher(stop_event: asyncio.Event):
+    """Follow a model switch made by another node.
+
+    Once a re-embed activates, comment_embeddings rejects vectors tagged with any
+    other model (20240224_embedding_activation.sql), so nodes still on the old
+    model load the active one; comments whose writes were rejected meanwhile are
+    picked up by the backfill.
+    """
+    if not await wait_for_model("embedding"):
+        return
+    while not stop_event.is_set():
+        try:
+            active = await active_embedding_model(supabase)
+            # A node running the re-embed switches itself in promote()
+            if active and active["model_id"] != model_name and not (reembed_task and not reembed_task.done()):
+                logger.info(f"🧭 Embedding model switched to {active['model_id']} elsewhere; loading it...")
+                target = await main_loop.run_in_executor(None, load_sentence_transformer, active["model_id"])
+                await switch_embedding_model(target, active["model_id"])
+        except Exception as e:
+            logger.error(f"❌ Embedding model check failed: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=EMBEDDING_MODEL_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+class ReembedRequest(BaseModel):
+    model_id: str # SentenceTransformer name, e.g. "BAAI/bge-small-en-v1.5"
+
+@app.get("/admin/embeddings", dependencies=[Depends(require_admin)])
+async def admin_embeddings():
+    """Model this node embeds with, the active model in the database and any re-embed job."""
+    return {
+        "serving": model_name,
+        "active": await active_embedding_model(supabase),
+        "reembed": reembed_job.status() if reembed_job else None,
+    }
+
+@app.post("/admin/embeddings/reembed", dependencies=[Depends(require_admin)])
+async def admin_reembed(req: ReembedRequest):
+    """Load a new embedding model and re-embed all comments into it in the background."""
+    global reembed_job, reembed_task
+    require_model("embedding")
+    if reembed_task and not reembed_task.done():
+        raise HTTPException(status_code=409, detail=f"A re-embed to {reembed_job.model_id} is already running.")
+    if req.model_id == model_name:
+        raise HTTPException(status_code=400, detail=f"{req.model_id} is already the serving model.")
+
+    target = await main_loop.run_in_executor(None, load_sentence_transformer, req.model_id)
+    # The re-embed is rate limited, so a single worker leaves the cores to live traffic
+    target_pool = EmbeddingPool(target, workers=1, kind="reembed")
+    await main_loop.run_in_executor(None, target_pool.start)
+
+    async def promote():
+        # This node already holds the new model, so live traffic moves with the switch
+        await switch_embedding_model(target, req.model_id)
+        target_pool.close()
+
+    async def run_job():
+        try:
+            return await reembed_job.run()
+        finally:
+            if reembed_job.state != "activated":
+                target_pool.close()
+
+    reembed_job = ReembedJob(
+        supabase, req.model_id, target.get_sentence_embedding_dimension(),
+        embed_batch=target_pool.embed,
+        busy=lambda: metrics.REALTIME_QUEUE_DEPTH.value() > 0,
+        on_activated=promote
+    )
+    reembed_task = asyncio.create_task(run_job())
+    logger.info(f"🧬 Re-embedding comments with {req.model_id} ({reembed_job.dimensions} dims)...")
+    return reembed_job.status()
+
+# --- Admin: Vector Store Evaluation ---
+
+class VectorStoreEvalRequest(BaseModel):
+    limit: int = 100000 # Stored embeddings to load
+    quantization: str = "binary" # "binary" or "int8"
+    k: int = 10
+    queries: int = 200
+    candidates: int = 0 # 0 = k × VECTOR_STORE_OVERSAMPLE
+
+@app.post("/admin/vector_store/evaluate", dependencies=[Depends(require_admin)])
+async def admin_vector_store_evaluate(req: VectorStoreEvalRequest):
+    """Load stored comment embeddings into a VectorStore and report its recall and memory."""
+    import numpy as np
+    from vector_store import VectorStore
+    if req.quantization not in ("binary", "int8"):
+        raise HTTPException(status_code=400, detail="quantization must be 'binary' or 'int8'.")
+
+    store, cursor = None, None
+    while not store or store.count < req.limit:
+        query = supabase.table("comment_embeddings").select("comment_id, embedding").order("comment_id").limit(min(1000, req.limit))
+        if cursor:
+            query = query.gt("comment_id", cursor)
+        rows = (await query.execute()).data or []
+        if not rows:
+            break
+        # PostgREST returns pgvector columns as "[0.1,...]" strings
+        vectors = np.array([json.loads(r["embedding"]) if isinstance(r["embedding"], str) else r["embedding"] for r in rows], dtype=np.float32)
+        store = store or VectorStore(vectors.shape[1], quantization=req.quantization)
+        await main_loop.run_in_executor(None, store.add, [r["comment_id"] for r in rows], vectors)
+        cursor = rows[-1]["comment_id"]
+    if not store:
+        raise HTTPException(status_code=404, detail="No stored embeddings to evaluate.")
+    return await main_loop.run_in_executor(None, lambda: store.evaluate(req.queries, req.k, req.candidates or None))
+
 # --- Local Code Generation ---
 
 def handle_remove_readonly(func, path, exc):
@@ -244,53 +895,66 @@ async def add_task_log(task_id: str, message: str, status: str = "processing", s
         return
     
     try:
-        # Get current logs
-        res = await supabase.table("agent_tasks").select("logs").eq("id", task_id).single().execute()
-        current_logs = res.data.get("logs", []) if res.data else []
-        
-        # Add new log
         new_log = {
             "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
             "message": message,
             "status": status
         }
-        updated_logs = current_logs + [new_log]
+        trace_id = tracing.current_trace_id()
+        if trace_id:
+            new_log["trace_id"] = trace_id # Matches the spans exported for this run
         
-        # Update record
-        update_data = {
-            "logs": updated_logs,
-            "last_heartbeat": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        }
-        if status:
-            update_data["status"] = status
-        if step:
-            update_data["current_step"] = step
-            
-        await supabase.table("agent_tasks").update(update_data).eq("id", task_id).execute()
+        # Appended in SQL: one round trip, and entries the Next.js agent writes meanwhile survive
+        await supabase.rpc("append_agent_task_log", {
+            "p_task_id": task_id,
+            "p_entry": new_log,
+            "p_status": status or None,
+            "p_step": step
+        }).execute()
         logger.info(f"📝 Task {task_id}: {message}")
     except Exception as e:
         logger.error(f"⚠️ Failed to update task log for {task_id}: {e}")
 
-@app.post("/generate")
+@contextmanager
+def codegen_step(step: str):
+    """Time one /generate step as a span and in the step histogram."""
+    with tracing.span(f"codegen.{step}"), metrics.CODEGEN_STEP_SECONDS.time(step=step):
+        yield
+
+@app.post("/generate", dependencies=[admission("codegen")])
+@tracing.traced("generate")
 async def generate_code(req: GenerateRequest):
     """Clone a repo, use Local LLM to plan and generate code patches."""
-    if not llm_service or not llm_service.llm:
-         raise HTTPException(status_code=503, detail="Local LLM not loaded.")
+    tracing.annotate(task_id=req.task_id, repo_url=req.repo_url)
+    require_model("llm")
+    
+    # In sharded mode only one worker may run a given task
+    leased = WORKER_MODE == "sharded" and bool(req.task_id)
+    if leased:
+        if not await worker_leases.claim_task(req.task_id):
+            raise HTTPException(status_code=409, detail=f"Task {req.task_id} is leased by another worker.")
     
     tmp_dir = None
+    lease_status = None # Written to the task when the lease is released
     try:
         # 1. Update status
         await add_task_log(req.task_id, "Cloning repository...", step="Cloning Repo")
 
         # 1.5 Handle missing analysis if this task was triggered by a comment
         try:
-            task_res = await supabase.table("agent_tasks").select("result").eq("id", req.task_id).single().execute()
-            if task_res.data and "result" in task_res.data:
-                comment_id = task_res.data["result"].get("comment_id")
+            task = await read_cache.get(
+                ("agent_tasks.result", req.task_id),
+                lambda: fetch_data(supabase.table("agent_tasks").select("result").eq("id", req.task_id).single())
+            )
+            if task and task.get("result"):
+                comment_id = task["result"].get("comment_id")
                 if comment_id:
                     # Check if analysis exists
-                    analysis_res = await supabase.table("feedback_analysis").select("id").eq("comment_id", comment_id).execute()
-                    if not analysis_res.data:
+                    analyzed = await read_cache.get(
+                        ("feedback_analysis", comment_id),
+                        lambda: fetch_data(supabase.table("feedback_analysis").select("id").eq("comment_id", comment_id))
+                    )
+                    if not analyzed:
                         await add_task_log(req.task_id, f"Analysis missing for comment {comment_id}. Attempting on-demand analysis...", step="Analyzing Feedback")
                         logger.info(f"🧪 On-demand analysis for comment {comment_id}...")
                         await analyze_comment_endpoint(comment_id)
@@ -306,13 +970,14 @@ async def generate_code(req: GenerateRequest):
             # Inject token for private repo access
             clone_url = clone_url.replace("https://", f"https://x-access-token:{req.github_token}@")
         
-        clone_result = await main_loop.run_in_executor(
-            None,
-            lambda: subprocess.run(
-                ["git", "clone", "--depth", "1", clone_url, tmp_dir],
-                capture_output=True, text=True, timeout=120
+        with codegen_step("clone"):
+            clone_result = await main_loop.run_in_executor(
+                None,
+                lambda: subprocess.run(
+                    ["git", "clone", "--depth", "1", clone_url, tmp_dir],
+                    capture_output=True, text=True, timeout=120
+                )
             )
-        )
         
         if clone_result.returncode != 0:
             msg = f"Git clone failed: {clone_result.stderr[:300]}"
@@ -338,31 +1003,95 @@ async def generate_code(req: GenerateRequest):
         await add_task_log(req.task_id, f"Planning technical solution for: {req.task[:50]}...", step="Synthesizing Solution")
         logger.info(f"🧠 Generating feature for task: {req.task[:80]}...")
         
-        # Run in thread pool to avoid blocking asyncio loop
-        feature_data = await main_loop.run_in_executor(
-            None,
-            llm_service.generate_code,
-            req.task,
-            file_tree
-        )
-        
         patches = []
-        if feature_data and "files" in feature_data:
-            for file_entry in feature_data["files"]:
-                patches.append({
-                    "path": file_entry.get("path"),
-                    "new_code": file_entry.get("content"),
-                    "explanation": f"Generated by Local Qwen2.5 for task: {req.task[:30]}...",
-                    "confidence": 0.9
-                })
-                logger.info(f"✅ Generated content for {file_entry.get('path')}")
-        else:
-            logger.warning("⚠️ No files returned from local generation.")
+        streamed = {} # path -> generated_code row id, for files published as they finished
+        if (req.mode or CODEGEN_MODE) == "plan":
+            # Plan the files first, then write each in its own call; finished files are published right away
+            with codegen_step("plan"):
+                plan = await run_llm("plan_code", req.task, file_tree)
+            plan = [{**entry, "path": path} for entry in plan or [] if (path := confine_path(tmp_dir, entry["path"]))]
+            if plan:
+                await add_task_log(req.task_id, f"Planned {len(plan)} files: {', '.join(e['path'] for e in plan)}", step="Synthesizing Solution")
+                existing = {}
+                for entry in plan:
+                    abs_path = os.path.join(tmp_dir, entry["path"])
+                    if os.path.isfile(abs_path):
+                        with open(abs_path, encoding="utf-8", errors="replace") as f:
+                            existing[entry["path"]] = f.read()
+
+                async def generate_file(path, purpose, dependencies):
+                    with codegen_step("generate_file"):
+                        content = await run_llm("generate_file", req.task, path, purpose, plan, existing.get(path), dependencies)
+                    return strip_code_fences(content) if content else None
+
+                async def publish(patch, done, total):
+                    await add_task_log(req.task_id, f"Generated {patch['path']} ({done}/{total})", step="Synthesizing Solution")
+                    logger.info(f"✅ Generated content for {patch['path']} ({done}/{total})")
+                    if req.task_id:
+                        row = await supabase.table("generated_code").insert({
+                            "task_id": req.task_id,
+                            "file_path": patch["path"],
+                            "old_code": existing.get(patch["path"]),
+                            "new_code": patch["new_code"],
+                            "explanation": patch["explanation"],
+                            "status": "generated"
+                        }).execute()
+                        streamed[patch["path"]] = row.data[0]["id"]
+
+                generation = PlannedGeneration(plan, generate_file, on_file=publish)
+                patches = [{**patch, "confidence": 0.9} for patch in await generation.run()]
+                if generation.failed:
+                    await add_task_log(req.task_id, f"Could not generate: {', '.join(generation.failed)}", step="Synthesizing Solution")
+            if not patches:
+                logger.warning("⚠️ Planned generation produced no files; falling back to a single generation call.")
+
+        if not patches:
+            # One call for every file; also the fallback when planning fails
+            with codegen_step("generate"):
+                feature_data = await run_llm("generate_code", req.task, file_tree)
+            if feature_data and "files" in feature_data:
+                for file_entry in feature_data["files"]:
+                    patches.append({
+                        "path": file_entry.get("path"),
+                        "new_code": file_entry.get("content"),
+                        "explanation": f"Generated by Local Qwen2.5 for task: {req.task[:30]}...",
+                        "confidence": 0.9
+                    })
+                    logger.info(f"✅ Generated content for {file_entry.get('path')}")
+            else:
+                logger.warning("⚠️ No files returned from local generation.")
         
         if not patches:
             await add_task_log(req.task_id, "Local LLM could not generate a solution.", status="failed", step="Generation Failed")
             return {"success": False, "message": "Local LLM could not generate any patches.", "patches": []}
         
+        # 4.5 Validate before any git work; only failing files are repaired or dropped
+        await add_task_log(req.task_id, f"Validating {len(patches)} generated files...", step="Validating Patches")
+        validator = PatchValidator(
+            tmp_dir,
+            repair=lambda path, content, error: run_llm("repair_file", req.task, path, content, error),
+            log=lambda message: add_task_log(req.task_id, message, step="Validating Patches")
+        )
+        with codegen_step("validate"):
+            patches, rejected = await validator.validate(patches)
+        if streamed:
+            # Streamed rows become ready (with any repairs) or failed
+            await asyncio.gather(*(
+                [fetch_data(supabase.table("generated_code").update({"new_code": p["new_code"], "status": "ready"}).eq("id", streamed[p["path"]]))
+                 for p in patches if p["path"] in streamed] +
+                [fetch_data(supabase.table("generated_code").update({"status": "failed"}).eq("id", streamed[r["path"]]))
+                 for r in rejected if r["path"] in streamed]
+            ))
+        stats = validator.stats
+        await add_task_log(
+            req.task_id,
+            f"Validation: {stats['passed']} passed, {stats['repaired']} repaired, {stats['rejected']} rejected.",
+            step="Validating Patches"
+        )
+        if not patches:
+            await add_task_log(req.task_id, "No generated file passed validation.", status="failed", step="Validation Failed")
+            return {"success": False, "message": "No generated file passed validation.", "patches": [], "rejected": rejected}
+        
         await add_task_log(req.task_id, f"Successfully synthesized patches for {len(patches)} files.", step="Patches Ready")
 
         # 5. Optional: Create PR using GH CLI
@@ -382,32 +1111,50 @@ async def generate_code(req: GenerateRequest):
                 branch_name = f"echo-agent-{uuid.uuid4().hex[:8]}"
                 repo_name = req.repo_url.split("/")[-1].replace(".git", "")
                 
-                # Configure git user for this temp repo
-                subprocess.run(["git", "config", "user.email", "agent@echo-v2.local"], cwd=tmp_dir)
-                subprocess.run(["git", "config", "user.name", "Echo Agent"], cwd=tmp_dir)
-                
-                cmds = [
-                    ["git", "checkout", "-b", branch_name],
-                    ["git", "add", "."],
-                    ["git", "commit", "-m", f"Agent: {req.task[:50]}"],
-                    ["git", "push", "-u", "origin", branch_name]
-                ]
+                # Inject GH_TOKEN/GITHUB_TOKEN for git if provided
+                git_env = {**os.environ}
+                if req.github_token:
+                    git_env["GH_TOKEN"] = req.github_token
+                    git_env["GITHUB_TOKEN"] = req.github_token
                 
-                for cmd in cmds:
+                async def git(*args, step: str = None):
+                    cmd = ["git", *args]
                     logger.info(f"Running git command: {' '.join(cmd)}")
-                    # Inject GH_TOKEN/GITHUB_TOKEN for git if provided
-                    git_env = {**os.environ}
-                    if req.github_token:
-                        git_env["GH_TOKEN"] = req.github_token
-                        git_env["GITHUB_TOKEN"] = req.github_token
-                        
-                    res = subprocess.run(cmd, cwd=tmp_dir, capture_output=True, text=True, env=git_env)
+                    with codegen_step(step) if step else nullcontext():
+                        res = await main_loop.run_in_executor(
+                            None, lambda: subprocess.run(cmd, cwd=tmp_dir, capture_output=True, text=True, env=git_env)
+                        )
                     if res.returncode != 0:
                         logger.warning(f"⚠️ Git command failed: {' '.join(cmd)} | Error: {res.stderr}")
                     else:
                         logger.info(f"✅ Git command success: {' '.join(cmd)} | Out: {res.stdout[:200]} | Err: {res.stderr[:200]}")
+                    return res
+                
+                # Configure git user for this temp repo
+                await git("config", "user.email", "agent@echo-v2.local")
+                await git("config", "user.name", "Echo Agent")
+                await git("checkout", "-b", branch_name)
+                await git("add", ".")
+                diff_stat = (await git("diff", "--cached", "--stat")).stdout
+                diff = (await git("diff", "--cached")).stdout
+                await git("commit", "-m", f"Agent: {req.task[:50]}", step="commit")
+                
+                # 5.3 Describe the change with the local model while the branch is pushed
+                await add_task_log(req.task_id, "Pushing branch and writing PR description...", step="Creating PR")
+                fallback_title = f"Agent: {req.task[:50]}"
+                
+                async def describe():
+                    with codegen_step("describe"):
+                        return await describe_pr(
+                            lambda messages, temperature, max_tokens: run_llm("chat_completion", messages, temperature, max_tokens),
+                            req.task, diff_stat, diff, fallback_title
+                        )
+                
+                _, description = await asyncio.gather(git("push", "-u", "origin", branch_name, step="push"), describe())
+                pr_title, pr_body = description or (fallback_title, "")
+                pr_body = f"{pr_body}\n\n---\nAutomated PR from Echo Agent for task: {req.task}".strip()
 
-                # 5.3 Create PR using GH CLI with injected token
+                # 5.4 Create PR using GH CLI with injected token
                 await add_task_log(req.task_id, f"Opening Pull Request for {repo_name}...", step="Creating PR")
                 logger.info(f"🆕 Creating PR via GitHub CLI for {repo_name}...")
                 
@@ -415,42 +1162,16 @@ async def generate_code(req: GenerateRequest):
                 gh_env = {**os.environ, "GH_TOKEN": req.github_token, "GITHUB_TOKEN": req.github_token}
                 
                 # We try to detect the default branch or just use 'main' as a safe bet for modern repos
-                pr_create_res = subprocess.run(
-                    ["gh", "pr", "create", "--head", branch_name, "--title", f"Agent: {req.task[:50]}", "--body", f"Automated PR from Echo Agent for task: {req.task}"],
-                    cwd=tmp_dir, capture_output=True, text=True, env=gh_env
-                )
+                with codegen_step("pr_create"):
+                    pr_create_res = await main_loop.run_in_executor(None, lambda: subprocess.run(
+                        ["gh", "pr", "create", "--head", branch_name, "--title", pr_title, "--body", pr_body],
+                        cwd=tmp_dir, capture_output=True, text=True, env=gh_env
+                    ))
                 
                 if pr_create_res.returncode == 0:
                     pr_url = pr_create_res.stdout.strip()
                     logger.info(f"✅ PR Created: {pr_url}")
                     await add_task_log(req.task_id, f"PR successully created: {pr_url}", status="completed", step=f"PR Link: {pr_url}")
-                    
-                    # 5.4 Run PR Agent Enhance
-                    logger.info("🧠 Running PR Agent /describe...")
-                    # Note: We use the local OpenAI endpoint we just added
-                    # Add GH_TOKEN to PR Agent env as well
-                    env = {
-                        **os.environ, 
-                        **gh_env,
-                        "OPENAI_BASE_URL": "http://localhost:8000/v1",
-                        "OPENAI_API_KEY": "dummy-key", # Required by lib but unused by local Qwen
-                        "CONFIG.MODEL": "qwen2.5-coder-7b",
-                        "GITHUB.USER_TOKEN": req.github_token # Explicitly set for PR Agent
-                    }
-                    
-                    # Use sys.executable to ensure we use the same venv
-                    # pr-agent CLI expects: python -m pr_agent.cli --pr_url <url> <command>
-                    pr_agent_cmd = [sys.executable, "-m", "pr_agent.cli", "--pr_url", pr_url, "describe"]
-                    logger.info(f"Running PR Agent command: {' '.join(pr_agent_cmd)}")
-                    
-                    try:
-                        res = subprocess.run(pr_agent_cmd, cwd=tmp_dir, env=env, capture_output=True, text=True)
-                        if res.returncode == 0:
-                            logger.info(f"✅ PR Agent successful: {res.stdout[:200]}")
-                        else:
-                            logger.warning(f"⚠️ PR Agent failed: {res.stderr}")
-                    except Exception as e:
-                        logger.error(f"❌ Failed to run PR Agent: {e}")
                 else:
                     logger.error(f"❌ GH CLI PR Create Failed: {pr_create_res.stderr}")
                     await add_task_log(req.task_id, f"GitHub CLI failed: {pr_create_res.stderr}", status="failed", step="PR Failed")
@@ -465,12 +1186,16 @@ async def generate_code(req: GenerateRequest):
             "patches": patches, 
             "files_analyzed": len(file_tree), 
             "files_modified": len(patches),
+            "rejected": rejected,
+            "streamed": bool(streamed), # generated_code rows were already written
             "pr_url": pr_url
         }
     
     except HTTPException:
+        lease_status = "failed"
         raise
     except Exception as e:
+        lease_status = "failed"
         logger.error(f"❌ Generate error: {str(e)}")
         logger.error(traceback.format_exc())
         await add_task_log(req.task_id, f"Error: {str(e)}", status="failed")
@@ -483,132 +1208,280 @@ async def generate_code(req: GenerateRequest):
                 logger.info(f"🧹 Cleaned up temp dir: {tmp_dir}")
             except Exception as e:
                 logger.warning(f"⚠️ Could not clean up {tmp_dir}: {e}")
+        if leased:
+            # Otherwise the heartbeat keeps this node's claim on the task alive forever
+            try:
+                await worker_leases.release_task(req.task_id, lease_status)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not release lease on task {req.task_id}: {e}")
 
 
 # --- Realtime Worker Logic ---
 
-async def process_comment_async(payload):
-    """Asynchronous processing of a new comment."""
-    try:
-        data = None
+def extract_comment(payload) -> tuple[str | None, str | None]:
+    """Pull (comment_id, content) out of a realtime payload or a plain {"new": {...}} dict."""
+    data = None
+    
+    # Try dictionary access
+    if isinstance(payload, dict):
+        data = payload.get("new") or payload.get("record")
+    else:
+        # Try as object with attributes (PostgresChangesPayload)
+        if hasattr(payload, "new"):
+            data = payload.new
+        elif hasattr(payload, "record"):
+            data = payload.record
         
-        # Try dictionary access
-        if isinstance(payload, dict):
-            data = payload.get("new") or payload.get("record")
-        else:
-            # Try as object with attributes (PostgresChangesPayload)
-            if hasattr(payload, "new"):
-                data = payload.new
-            elif hasattr(payload, "record"):
-                data = payload.record
-            
-        # Fallback for nested 'data' key
-        if not data and isinstance(payload, dict) and "data" in payload:
-            data = payload["data"].get("new") or payload["data"].get("record")
-            
-        if not data:
-            return
-            
-        # Extract ID and Content
-        comment_id = None
-        content = None
+    # Fallback for nested 'data' key
+    if not data and isinstance(payload, dict) and "data" in payload:
+        data = payload["data"].get("new") or payload["data"].get("record")
         
-        if isinstance(data, dict):
-            comment_id = data.get("id")
-            content = data.get("content")
-        else:
-            comment_id = getattr(data, "id", None)
-            content = getattr(data, "content", None)
-            
+    if not data:
+        return None, None
+        
+    if isinstance(data, dict):
+        return data.get("id"), data.get("content")
+    return getattr(data, "id", None), getattr(data, "content", None)
+
+async def analyze_with_retries(comment_id: str, content: str) -> dict | None:
+    """Run LLM triage with exponential backoff; returns the analysis dict or None."""
+    analysis = None
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            with tracing.span("analyze.attempt", attempt=attempt + 1) as attempt_span:
+                analysis, (cache_hit, _) = await run_llm_cached(
+                    "analyze_comment", {"content": content, "temperature": 0.1}, content
+                )
+                attempt_span.attributes.update(cache_hit=cache_hit, success=bool(analysis))
+            if analysis:
+                break
+            logger.warning(f"⚠️ LLM analysis attempt {attempt+1} returned no data for {comment_id}")
+        except Exception as analysis_err:
+            logger.error(f"❌ LLM analysis attempt {attempt+1} failed: {analysis_err}")
+        
+        if attempt < max_retries - 1:
+            metrics.ANALYSIS_RETRIES.inc()
+            with tracing.span("analyze.backoff", seconds=2 ** attempt):
+                await asyncio.sleep(2 ** attempt) # Exponential backoff
+    return analysis
+
+async def fetch_data(query):
+    return (await query.execute()).data
+
+async def get_comment(comment_id: str) -> dict | None:
+    """A comment's content and post_id, shared by the analysis and agent-trigger paths."""
+    return await read_cache.get(
+        ("comments", comment_id),
+        lambda: fetch_data(supabase.table("comments").select("content, post_id").eq("id", comment_id).single()),
+        ttl=COMMENT_CACHE_TTL_SECONDS
+    )
+
+async def save_analysis(comment_id: str, analysis: dict):
+    # One analysis per comment; a re-analysis replaces it and the aggregate trigger folds the difference
+    await supabase.table("feedback_analysis").upsert(analysis_row(comment_id, analysis), on_conflict="comment_id").execute()
+    read_cache.invalidate(("feedback_analysis", comment_id))
+    logger.info(f"✅ Saved analysis for {comment_id}")
+
+@tracing.traced("trigger_agent")
+async def trigger_agent_if_actionable(comment_id: str, analysis: dict, embedding: list[float] | None = None):
+    """Queue an agent task when high-priority feedback lands on a monitored post."""
+    priority = analysis.get("priority_score", 0)
+    category = analysis.get("category", "general")
+    
+    if priority >= 0.7 or category in ["bug", "feature_request"]:
+        logger.info(f"🤖 High priority feedback detected (Priority: {priority}, Cat: {category}). Checking for active monitors...")
+        
+        # Fetch post_id for this comment to check if it's monitored
+        comment = await get_comment(comment_id)
+        post_id = comment.get("post_id") if comment else None
+        
+        if post_id:
+            # A burst of comments on one post shares this lookup
+            monitors = await read_cache.get(
+                ("monitored_posts", post_id),
+                lambda: fetch_data(supabase.table("monitored_posts").select("id").eq("post_id", post_id).eq("is_active", True))
+            )
+            if monitors:
+                monitored_post_id = monitors[0]['id']
+                # Related comments on the post share one task instead of one codegen run each
+                try:
+                    res = await supabase.rpc("coalesce_agent_feedback", {
+                        "p_monitored_post_id": monitored_post_id,
+                        "p_comment_id": comment_id,
+                        "p_priority": priority,
+                        "p_window_seconds": AGENT_COALESCE_WINDOW_SECONDS,
+                        "p_max_comments": AGENT_COALESCE_MAX_COMMENTS,
+                        "p_similarity": AGENT_COALESCE_SIMILARITY,
+                        "p_embedding": embedding
+                    }).execute()
+                except Exception as e:
+                    logger.error(f"❌ Could not queue agent feedback for {comment_id}: {e}")
+                    return
+                if not res.data:
+                    logger.warning(f"⚠️ coalesce_agent_feedback returned no task for {comment_id}")
+                    return
+                group = res.data[0]
+                read_cache.invalidate(("agent_tasks.result", group["task_id"]))
+                logger.info(f"🧺 Comment {comment_id} added to agent task {group['task_id']} ({group['comment_count']} comments)")
+                if group["released"]:
+                    await trigger_agent_run()
+
+async def trigger_agent_run():
+    """Ping the Next.js Agent Route so its queue processor picks up pending tasks now."""
+    try:
+        # Determine base URL (default to localhost:3000 if not set)
+        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
+        logger.info(f"📡 Triggering Agent Run at {frontend_url}/api/agent/run ...")
+        
+        await http_client().post(f"{frontend_url}/api/agent/run")
+        logger.info("✅ Agent Run triggered successfully.")
+    except Exception as trigger_err:
+        logger.warning(f"⚠️ Could not trigger Agent Run API: {trigger_err}")
+
+async def run_agent_task_releaser(stop_event: asyncio.Event):
+    """Queue coalesced agent tasks whose window has closed."""
+    while not stop_event.is_set():
+        try:
+            res = await supabase.rpc("release_coalesced_agent_tasks", {}).execute()
+            if res.data:
+                for task in res.data:
+                    logger.info(f"🚀 Releasing agent task {task['task_id']} with {task['comment_count']} coalesced comments")
+                await trigger_agent_run()
+        except Exception as e:
+            logger.error(f"❌ Agent task release error: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=AGENT_COALESCE_SWEEP_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+def llm_ready() -> bool:
+    return is_model_ready("llm") and model_manager.is_loaded()
+
+async def triage_comment(comment_id: str, content: str) -> str:
+    """Analyze and store one comment that already has an embedding (used by the backfill)."""
+    if not llm_ready():
+        return TRIAGE_UNAVAILABLE
+    analysis = await analyze_with_retries(comment_id, content)
+    if not analysis:
+        # A swap or unload mid-call is not the comment's fault
+        return TRIAGE_FAILED if llm_ready() else TRIAGE_UNAVAILABLE
+    await save_analysis(comment_id, analysis)
+    if BACKFILL_TRIGGER_AGENT:
+        await trigger_agent_if_actionable(comment_id, analysis)
+    return TRIAGE_OK
+
+async def process_comment_async(payload) -> bool:
+    """Asynchronous processing of a new comment. Returns True if it was fully processed."""
+    try:
+        comment_id, content = extract_comment(payload)
         if not comment_id or not content:
-            return
+            return False
 
         logger.info(f"🔄 Processing new comment {comment_id}...")
         
+        # Comments arriving during startup wait for the background model load
+        if not await wait_for_model("embedding"):
+            logger.warning(f"⚠️ Embedding model unavailable, skipping {comment_id}.")
+            return False
+        
         # 1. Generate Embedding
-        embedding = await main_loop.run_in_executor(None, generate_embedding_internal, content)
+        with tracing.span("embed"):
+            embedding = await embed_text_async(content)
         
         await supabase.table("comment_embeddings").upsert({
             "comment_id": comment_id,
-            "embedding": embedding
+            "embedding": embedding,
+            "model_id": model_name
         }).execute()
         logger.info(f"✅ Saved embedding for {comment_id}")
         
         # 2. Analyze Sentiment/Classify (if LLM is available)
-        if llm_service and llm_service.llm:
-            analysis = None
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    analysis = await main_loop.run_in_executor(None, llm_service.analyze_comment, content)
-                    if analysis:
-                        break
-                    logger.warning(f"⚠️ LLM analysis attempt {attempt+1} returned no data for {comment_id}")
-                except Exception as analysis_err:
-                    logger.error(f"❌ LLM analysis attempt {attempt+1} failed: {analysis_err}")
-                
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2 ** attempt) # Exponential backoff
-            
+        if await wait_for_model("llm") and model_manager.is_loaded():
+            analysis = await analyze_with_retries(comment_id, content)
             if analysis:
                 logger.info(f"🧠 Analysis: {analysis}")
-                await supabase.table("feedback_analysis").insert({
-                    "comment_id": comment_id,
-                    "sentiment_score": analysis.get("sentiment_score", 0),
-                    "category": analysis.get("category", "general"),
-                    "priority_score": analysis.get("priority_score", 0),
-                    "actionable_summary": analysis.get("actionable_summary", ""),
-                    "keywords": analysis.get("keywords", [])
-                }).execute()
-                logger.info(f"✅ Saved analysis for {comment_id}")
+                await save_analysis(comment_id, analysis)
 
                 # 3. Trigger Echo Agent if priority is high
-                priority = analysis.get("priority_score", 0)
-                category = analysis.get("category", "general")
-                
-                if priority >= 0.7 or category in ["bug", "feature_request"]:
-                    logger.info(f"🤖 High priority feedback detected (Priority: {priority}, Cat: {category}). Checking for active monitors...")
-                    
-                    # Fetch post_id for this comment to check if it's monitored
-                    comment_res = await supabase.table("comments").select("post_id").eq("id", comment_id).single().execute()
-                    post_id = comment_res.data.get("post_id") if comment_res.data else None
-                    
-                    if post_id:
-                        monitored_res = await supabase.table("monitored_posts").select("id").eq("post_id", post_id).eq("is_active", True).execute()
-                        if monitored_res.data:
-                            monitored_post_id = monitored_res.data[0]['id']
-                            logger.info(f"🚀 Triggering Echo Agent task for monitored post {monitored_post_id}")
-                            
-                            await supabase.table("agent_tasks").insert({
-                                "monitored_post_id": monitored_post_id,
-                                "task_type": "generate_code",
-                                "status": "pending",
-                                "current_step": "High-priority feedback detected. Queued for local code generation.",
-                                "result": {"comment_id": comment_id, "priority": priority}
-                            }).execute()
-                            logger.info(f"✅ Created agent task for {monitored_post_id}")
-                            
-                            # 4. Trigger Next.js Agent Route to process the task immediately
-                            try:
-                                # We try to reach the frontend API to trigger the queue processor
-                                # Determine base URL (default to localhost:3000 if not set)
-                                frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-                                logger.info(f"📡 Triggering Agent Run at {frontend_url}/api/agent/run ...")
-                                
-                                import httpx
-                                async with httpx.AsyncClient() as client:
-                                    await client.post(f"{frontend_url}/api/agent/run")
-                                logger.info("✅ Agent Run triggered successfully.")
-                            except Exception as trigger_err:
-                                logger.warning(f"⚠️ Could not trigger Agent Run API: {trigger_err}")
+                await trigger_agent_if_actionable(comment_id, analysis)
+                return True
             else:
                 logger.warning(f"⚠️ LLM analysis returned no data for {comment_id}")
         else:
             logger.warning("⚠️ LLM Service not active, skipping analysis.")
+        return False
     except Exception as e:
         logger.error(f"❌ Error in process_comment_async: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
+        return False
+
+# --- Sharded Workers ---
+
+@tracing.traced("leased_comment")
+async def process_leased_comment(comment_id: str, content: str):
+    """Process a comment this worker holds the lease for, then release the lease."""
+    tracing.annotate(comment_id=comment_id)
+    success = await process_comment_async({"new": {"id": comment_id, "content": content}})
+    try:
+        await worker_leases.complete_comment(comment_id, success)
+    except Exception as e:
+        logger.error(f"⚠️ Failed to complete lease for {comment_id}: {e}")
+
+async def handle_realtime_comment(payload):
+    """Every worker sees every INSERT; in sharded mode only the one that wins the claim processes it."""
+    comment_id, _ = extract_comment(payload)
+    if comment_id in ingest_owned_ids:
+        # Already flowing through an /ingest pipeline on this worker
+        return
+    if WORKER_MODE != "sharded":
+        await process_comment_async(payload)
+        return
+    if not comment_id:
+        return
+    claimed = await worker_leases.claim_comments(limit=1, comment_id=comment_id)
+    for job in claimed:
+        await process_leased_comment(job["comment_id"], job["content"])
+
+async def run_realtime_event(payload, received_at: float):
+    try:
+        comment_id, _ = extract_comment(payload)
+        with tracing.span("realtime_comment", comment_id=comment_id,
+                          queue_wait_ms=round((time.perf_counter() - received_at) * 1000, 1)):
+            await handle_realtime_comment(payload)
+    finally:
+        metrics.REALTIME_QUEUE_DEPTH.dec()
+
+async def run_lease_worker(stop_event: asyncio.Event):
+    """Poll for pending or lease-expired comments (missed events, crashed workers)."""
+    logger.info(f"🧩 Sharded worker {WORKER_ID} polling for comment leases...")
+    while not stop_event.is_set():
+        try:
+            if await wait_for_model("embedding"):
+                claimed = await worker_leases.claim_comments()
+                if claimed:
+                    logger.info(f"🧩 Claimed {len(claimed)} comment(s).")
+                    await asyncio.gather(*(process_leased_comment(j["comment_id"], j["content"]) for j in claimed))
+                    continue
+        except Exception as e:
+            logger.error(f"❌ Lease worker error: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_lease_heartbeat(stop_event: asyncio.Event):
+    """Renew this worker's comment leases and agent task heartbeats."""
+    while not stop_event.is_set():
+        try:
+            await worker_leases.heartbeat()
+        except Exception as e:
+            logger.error(f"💓 Lease heartbeat error: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=worker_leases.lease_seconds / 3)
+        except asyncio.TimeoutError:
+            pass
 
 # --- Supabase Initialization ---
 async def run_realtime_listener(stop_event: asyncio.Event):
@@ -620,7 +1493,8 @@ async def run_realtime_listener(stop_event: asyncio.Event):
         def sync_on_insert(payload):
             logger.info(f"🔔 EVENT RECEIVED: {payload}")
             if main_loop:
-                asyncio.run_coroutine_threadsafe(process_comment_async(payload), main_loop)
+                metrics.REALTIME_QUEUE_DEPTH.inc()
+                asyncio.run_coroutine_threadsafe(run_realtime_event(payload, time.perf_counter()), main_loop)
             else:
                 logger.error("❌ main_loop not initialized, cannot process comment.")
 
@@ -652,20 +1526,23 @@ async def run_realtime_listener(stop_event: asyncio.Event):
             await asyncio.sleep(10)
             asyncio.create_task(run_realtime_listener(stop_event))
 
-@app.post("/v1/chat/completions")
-async def openai_completions(req: dict):
-    """OpenAI-compatible chat completions for local LLM (used by PR-Agent)."""
+@app.post("/v1/chat/completions", dependencies=[admission("chat")])
+async def openai_completions(req: dict, response: Response):
+    """OpenAI-compatible chat completions for local LLM."""
     messages = req.get("messages", [])
     temp = req.get("temperature", 0.7)
     max_tokens = req.get("max_tokens", 1024)
     
-    if not llm_service:
-        raise HTTPException(status_code=503, detail="LLM service not initialized")
+    require_model("llm")
 
-    content = await main_loop.run_in_executor(
-        None,
-        lambda: llm_service.chat_completion(messages, temp, max_tokens)
+    # Byte-identical deterministic prompts (describe steps, retries) are served from cache
+    content, (cache_hit, cache_age) = await run_llm_cached(
+        "chat_completion",
+        {"messages": messages, "temperature": temp, "max_tokens": max_tokens},
+        messages, temp, max_tokens,
+        opt_in=bool(req.get("cache", False))
     )
+    response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
     
     return {
         "id": f"chatcmpl-{uuid.uuid4().hex}",
@@ -686,7 +1563,8 @@ async def openai_completions(req: dict):
             "prompt_tokens": 0,
             "completion_tokens": 0,
             "total_tokens": 0
-        }
+        },
+        "cache": {"hit": cache_hit, "age_seconds": cache_age}
     }
 
 if __name__ == "__main__":
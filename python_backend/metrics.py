@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+
+# Minimal Prometheus text-format metrics. Each observation is a dict lookup plus a
+# bisect under a per-metric lock, cheap enough to leave on in production, and the
+# LLM threads can observe without touching the event loop.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200, 500)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines += self._render_value(key, value)
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def totals(self) -> dict[tuple, tuple[int, float]]:
+        """(count, sum) per label set, for callers that diff before/after a run."""
+        with self._lock:
+            return {key: (state[2], state[1]) for key, state in self._values.items()}
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            le = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labelnames: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def gauge(name: str, help: str, labelnames: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+# --- Hot-path metrics ---
+
+EMBEDDING_SECONDS = histogram("echo_embedding_seconds", "Embedding model latency per call.", ("kind",))
+EMBEDDING_BATCH_SIZE = histogram("echo_embedding_batch_size", "Texts per embedding call.", buckets=SIZE_BUCKETS)
+EMBEDDING_QUEUED_TEXTS = gauge("echo_embedding_queued_texts", "Texts waiting for an embedding pool bucket.", ("kind",))
+
+LLM_REQUEST_SECONDS = histogram("echo_llm_request_seconds", "Wall time of one LLM completion, including slot wait.", ("method",))
+LLM_PROMPT_EVAL_SECONDS = histogram("echo_llm_prompt_eval_seconds", "Prompt evaluation (prefill) time.", ("method",))
+LLM_GENERATION_SECONDS = histogram("echo_llm_generation_seconds", "Token generation (decode) time.", ("method",))
+LLM_TOKENS_PER_SECOND = histogram("echo_llm_tokens_per_second", "Generated tokens per second of decode time.", ("method",), RATE_BUCKETS)
+LLM_TOKENS = counter("echo_llm_tokens_total", "Tokens processed by the LLM.", ("method", "kind"))
+LLM_JSON_PARSE_FAILURES = counter("echo_llm_json_parse_failures_total", "LLM outputs with no parseable JSON.", ("method",))
+
+SUPABASE_SECONDS = histogram("echo_supabase_request_seconds", "Supabase request latency.", ("table", "op"))
+READ_CACHE_REQUESTS = counter("echo_read_cache_requests_total", "Cached Supabase reads by outcome.", ("result",))
+SUPABASE_ERRORS = counter("echo_supabase_errors_total", "Supabase requests that raised.", ("table", "op"))
+
+CODEGEN_STEP_SECONDS = histogram("echo_codegen_step_seconds", "Duration of /generate steps.", ("step",))
+
+REALTIME_QUEUE_DEPTH = gauge("echo_realtime_queue_depth", "Realtime comment events scheduled but not finished.")
+REALTIME_QUEUE_DEPTH.set(0)
+ANALYSIS_RETRIES = counter("echo_analysis_retries_total", "Comment analysis attempts after the first.")
+
+ADMISSION_IN_FLIGHT = gauge("echo_admission_in_flight", "Admitted LLM endpoint requests not yet finished.", ("request_class",))
+ADMISSION_REJECTIONS = counter("echo_admission_rejections_total", "LLM endpoint requests rejected with 429.", ("request_class", "reason"))
+ADMISSION_ESTIMATED_WAIT_SECONDS = histogram("echo_admission_estimated_wait_seconds", "Estimated queue wait at admission time.", ("request_class",))
+
+# --- Supabase instrumentation ---
+
+class _TimedQuery:
+    """Proxies a postgrest request builder and times its execute()."""
+
+    def __init__(self, builder, table: str, op: str | None = None):
+        self._builder = builder
+        self._table = table
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == "execute":
+            async def execute(*args, **kwargs):
+                op = self._op or "select"
+                start = time.perf_counter()
+                try:
+                    with tracing.span(f"supabase.{op}", table=self._table):
+                        return await attr(*args, **kwargs)
+                except Exception:
+                    SUPABASE_ERRORS.inc(table=self._table, op=op)
+                    raise
+                finally:
+                    SUPABASE_SECONDS.observe(time.perf_counter() - start, table=self._table, op=op)
+            return execute
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                # The first verb (select/insert/upsert/update/delete) names the operation
+                op = self._op or (name if name in ("select", "insert", "upsert", "update", "delete") else None)
+                return _TimedQuery(result, self._table, op)
+            return result
+        return call
+
+class InstrumentedSupabase:
+    """Wraps the Supabase client so every table/rpc request lands in SUPABASE_SECONDS."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name: str):
+        return _TimedQuery(self._client.table(name), name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: dict | None = None, *args, **kwargs):
+        return _TimedQuery(self._client.rpc(fn, params or {}, *args, **kwargs), f"rpc:{fn}", "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
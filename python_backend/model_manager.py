@@ -0,0 +1,159 @@
+import gc
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+from llm_service import LLMService
+
+logger = logging.getLogger(__name__)
+
+class ModelUnavailableError(Exception):
+    """Raised when a generation is requested but no LLM is loaded."""
+
+class ModelManager:
+    """Owns the single LLMService and swaps it without double memory residency.
+
+    Every generation runs inside `session()`, which counts it as in-flight.
+    A swap blocks new sessions, drains the in-flight ones, releases the old
+    model, memory-maps and warms up the new GGUF, then flips the reference.
+    """
+
+    def __init__(self, models_dir: str, on_warming=None):
+        self.models_dir = models_dir
+        self.on_warming = on_warming # optional () called before a mapped model's warmup inference
+        self.service: LLMService | None = None
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._swapping = False
+        self._swap_lock = threading.Lock()
+        self.last_swap_seconds = None
+
+    @property
+    def model_file(self) -> str | None:
+        if self.service and self.service.llm:
+            return os.path.basename(self.service.model_path)
+        return None
+
+    @property
+    def slot_count(self) -> int | None:
+        """Decoding slots of the loaded service (forced to one when offloading to a GPU)."""
+        if self.service and self.service.llm:
+            return self.service.slot_count
+        return None
+
+    def is_loaded(self) -> bool:
+        return bool(self.service and self.service.llm)
+
+    def available_models(self) -> list[str]:
+        """List the .gguf files in models/ (first parts only for split files)."""
+        if not os.path.isdir(self.models_dir):
+            return []
+        return sorted(
+            f for f in os.listdir(self.models_dir)
+            if f.endswith(".gguf") and ("-of-" not in f or "-00001-of-" in f)
+        )
+
+    def resolve_model_path(self, model_file: str | None) -> str:
+        """Map a bare file name to a path inside models/, rejecting anything else."""
+        if not model_file:
+            return self.models_dir
+        if os.path.basename(model_file) != model_file or not model_file.endswith(".gguf"):
+            raise ValueError(f"Invalid model file name: {model_file}")
+        path = os.path.join(self.models_dir, model_file)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model file not found in {self.models_dir}: {model_file}")
+        return path
+
+    def _warm_up(self, service: LLMService):
+        if self.on_warming:
+            self.on_warming()
+        service.warmup()
+
+    def load(self, model_file: str | None = None) -> bool:
+        """Initial load (no drain needed). Returns True if the model is ready."""
+        service = LLMService(self.resolve_model_path(model_file))
+        if not service.llm:
+            return False
+        self._warm_up(service)
+        with self._cond:
+            self.service = service
+        return True
+
+    @contextmanager
+    def session(self):
+        """Borrow the current LLMService for one generation."""
+        with self._cond:
+            while self._swapping:
+                self._cond.wait()
+            if not self.is_loaded():
+                raise ModelUnavailableError("Local LLM not loaded.")
+            service = self.service
+            self._in_flight += 1
+        try:
+            yield service
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def swap(self, model_file: str | None = None, drain_timeout: float = 600.0) -> bool:
+        """Drain, release, load, warm up, flip. Returns True if the new model is live.
+
+        If the new model fails to load, the previous file is reloaded so the
+        node is never left without a model.
+        """
+        new_path = self.resolve_model_path(model_file)
+        with self._swap_lock:
+            start = time.perf_counter()
+            with self._cond:
+                self._swapping = True
+                logger.info(f"♻️ Swap requested. Draining {self._in_flight} in-flight generation(s)...")
+                drained = self._cond.wait_for(lambda: self._in_flight == 0, timeout=drain_timeout)
+                if not drained:
+                    self._swapping = False
+                    self._cond.notify_all()
+                    raise TimeoutError(f"In-flight generations did not finish within {drain_timeout}s.")
+                old_service = self.service
+                self.service = None
+
+            old_path = old_service.model_path if old_service else None
+            try:
+                # 1. Release the old model before mapping the new one
+                if old_service:
+                    old_service.close()
+                    del old_service
+                    gc.collect()
+                    logger.info("🧹 Released previous LLM.")
+
+                # 2. Map and warm up the new model
+                new_service = LLMService(new_path)
+                restored = False
+                if not new_service.llm and old_path:
+                    logger.error(f"❌ Swap to {new_path} failed. Restoring {old_path}...")
+                    new_service = LLMService(old_path)
+                    restored = True
+                if new_service.llm:
+                    self._warm_up(new_service)
+
+                # 3. Flip the reference
+                with self._cond:
+                    self.service = new_service if new_service.llm else None
+                self.last_swap_seconds = round(time.perf_counter() - start, 2)
+                logger.info(f"✅ Swap finished in {self.last_swap_seconds}s. Active model: {self.model_file}")
+                return bool(new_service.llm) and not restored
+            finally:
+                with self._cond:
+                    self._swapping = False
+                    self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "model_file": self.model_file,
+                "in_flight": self._in_flight,
+                "swapping": self._swapping,
+                "last_swap_seconds": self.last_swap_seconds,
+                "decoding": self.service.stats() if self.is_loaded() else None,
+            }
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+import shlex
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Generated files are checked before any git work, so output that can't be merged
+# never pays for a commit, push, PR and PR description.
+PATCH_VALIDATION_CONCURRENCY = int(os.getenv("PATCH_VALIDATION_CONCURRENCY", str(os.cpu_count() or 4)))
+PATCH_LINT_TIMEOUT_SECONDS = float(os.getenv("PATCH_LINT_TIMEOUT_SECONDS", "20"))
+PATCH_REPAIR_ATTEMPTS = int(os.getenv("PATCH_REPAIR_ATTEMPTS", "1"))
+# Extension -> command run from the checkout, {path} is the repo-relative file
+# e.g. {".js": "node --check {path}", ".sh": "bash -n {path}"}
+PATCH_LINTERS: dict[str, str] = json.loads(os.getenv("PATCH_LINTERS", "{}"))
+PROTECTED_DIRS = {".git"}
+MAX_ERROR_CHARS = 1000
+
+def confine_path(repo_dir: str, path) -> str | None:
+    """Repo-relative POSIX path for a generated file, or None if it would land outside the checkout."""
+    if not isinstance(path, str) or not path.strip() or "\0" in path:
+        return None
+    # Models often write repo-relative paths with a leading slash
+    normalized = os.path.normpath(path.strip().replace("\\", "/").lstrip("/"))
+    parts = normalized.split(os.sep)
+    if normalized == "." or parts[0] == ".." or os.path.isabs(normalized) or parts[0] in PROTECTED_DIRS:
+        return None
+    root = os.path.realpath(repo_dir)
+    # realpath also catches symlinks in the checkout that point elsewhere
+    if os.path.commonpath([root, os.path.realpath(os.path.join(root, normalized))]) != root:
+        return None
+    return "/".join(parts)
+
+def strip_code_fences(content: str) -> str:
+    """Drop a markdown ``` fence wrapped around a whole file."""
+    lines = content.strip().split("\n")
+    if len(lines) >= 2 and lines[0].startswith("```") and lines[-1].strip() == "```":
+        return "\n".join(lines[1:-1]) + "\n"
+    return content
+
+def _check_python(path: str, content: str):
+    try:
+        compile(content, path, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+
+def _check_json(path: str, content: str):
+    try:
+        json.loads(content)
+    except json.JSONDecodeError as e:
+        return f"line {e.lineno}: {e.msg}"
+
+def _check_yaml(path: str, content: str):
+    try:
+        import yaml
+    except ImportError:
+        return None
+    try:
+        list(yaml.safe_load_all(content))
+    except yaml.YAMLError as e:
+        return str(e).replace("\n", " ")
+
+def _check_toml(path: str, content: str):
+    try:
+        import tomllib
+    except ImportError: # Python < 3.11
+        return None
+    try:
+        tomllib.loads(content)
+    except tomllib.TOMLDecodeError as e:
+        return str(e)
+
+SYNTAX_CHECKS = {
+    ".py": _check_python,
+    ".json": _check_json,
+    ".yaml": _check_yaml,
+    ".yml": _check_yaml,
+    ".toml": _check_toml,
+}
+
+class PatchValidator:
+    """Checks generated files in a checkout and repairs the ones that fail.
+
+    Each file is confined to the repo, syntax-checked in-process by extension
+    and, if a linter is configured for it, linted from the checkout with a
+    timeout. Files run concurrently. A failing file is first retried without a
+    markdown fence, then handed to `repair` with the error; only files that
+    still fail are rejected, and their original contents are restored.
+    """
+
+    def __init__(self, repo_dir: str, repair=None, log=None):
+        self.repo_dir = repo_dir
+        self.repair = repair # optional async (path, content, error) -> str | None
+        self.log = log # optional async (message) for task logs
+        self._originals: dict[str, bytes | None] = {}
+        self.stats = {"passed": 0, "repaired": 0, "rejected": 0}
+
+    def _write(self, path: str, content: str):
+        abs_path = os.path.join(self.repo_dir, path)
+        if path not in self._originals:
+            if os.path.isfile(abs_path):
+                with open(abs_path, "rb") as f:
+                    self._originals[path] = f.read()
+            else:
+                self._originals[path] = None
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def _restore(self, path: str):
+        if path not in self._originals:
+            return
+        abs_path = os.path.join(self.repo_dir, path)
+        original = self._originals.pop(path)
+        if original is None:
+            os.remove(abs_path)
+        else:
+            with open(abs_path, "wb") as f:
+                f.write(original)
+
+    def _lint(self, path: str, command: str) -> str | None:
+        args = [arg.replace("{path}", path) for arg in shlex.split(command)]
+        try:
+            res = subprocess.run(args, cwd=self.repo_dir, capture_output=True, text=True, timeout=PATCH_LINT_TIMEOUT_SECONDS)
+        except FileNotFoundError:
+            logger.warning(f"⚠️ Linter not found, skipping: {args[0]}")
+            return None
+        except subprocess.TimeoutExpired:
+            return f"{args[0]} timed out after {PATCH_LINT_TIMEOUT_SECONDS}s"
+        if res.returncode == 0:
+            return None
+        return (res.stdout + res.stderr).strip()[-MAX_ERROR_CHARS:] or f"{args[0]} exited with {res.returncode}"
+
+    def check_file(self, path: str, content: str) -> str | None:
+        """First error for one file, or None if it passes. Blocking; run in an executor."""
+        ext = os.path.splitext(path)[1].lower()
+        check = SYNTAX_CHECKS.get(ext)
+        error = check(path, content) if check else None
+        if error or ext not in PATCH_LINTERS:
+            return error
+        # Linters read the file from the checkout
+        self._write(path, content)
+        return self._lint(path, PATCH_LINTERS[ext])
+
+    async def _check(self, path: str, content: str) -> str | None:
+        return await asyncio.get_running_loop().run_in_executor(None, self.check_file, path, content)
+
+    async def _log(self, message: str):
+        if self.log:
+            await self.log(message)
+
+    async def _validate_one(self, patch: dict, semaphore: asyncio.Semaphore) -> tuple[dict, str | None]:
+        path = confine_path(self.repo_dir, patch.get("path"))
+        if path is None:
+            return patch, "path is outside the repository"
+        content = patch.get("new_code")
+        if not isinstance(content, str):
+            return {**patch, "path": path}, "no file content"
+
+        async with semaphore:
+            error = await self._check(path, content)
+            if error and strip_code_fences(content) != content:
+                content = strip_code_fences(content)
+                error = await self._check(path, content)
+
+        attempts = 0
+        while error and self.repair and attempts < PATCH_REPAIR_ATTEMPTS:
+            attempts += 1
+            await self._log(f"Repairing {path} ({error[:200]})...")
+            repaired = await self.repair(path, content, error)
+            if not repaired:
+                break
+            content = strip_code_fences(repaired)
+            async with semaphore:
+                error = await self._check(path, content)
+        if not error and attempts:
+            self.stats["repaired"] += 1
+        return {**patch, "path": path, "new_code": content}, error
+
+    async def validate(self, patches: list[dict]) -> tuple[list[dict], list[dict]]:
+        """Returns (valid patches, rejected [{"path", "error"}])."""
+        # If a path is generated twice the last version wins
+        unique = {}
+        for patch in patches:
+            unique[confine_path(self.repo_dir, patch.get("path")) or patch.get("path")] = patch
+        semaphore = asyncio.Semaphore(max(1, PATCH_VALIDATION_CONCURRENCY))
+        results = await asyncio.gather(*(self._validate_one(p, semaphore) for p in unique.values()))
+
+        valid, rejected = [], []
+        for patch, error in results:
+            if error:
+                rejected.append({"path": patch.get("path"), "error": error})
+                self._restore(patch.get("path"))
+                await self._log(f"Rejected {patch.get('path')}: {error[:300]}")
+            else:
+                valid.append(patch)
+        self.stats["rejected"] = len(rejected)
+        self.stats["passed"] = len(valid) - self.stats["repaired"]
+        return valid, rejected
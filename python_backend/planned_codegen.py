@@ -0,0 +1,87 @@
+import asyncio
+import os
+import logging
+
+from admission import LLM_SLOTS
+
+logger = logging.getLogger(__name__)
+
+# Phase two of plan-then-per-file code generation. Each planned file is its own
+# LLM call, so a truncated or failed file costs one retry instead of the whole
+# change, and finished files can be shown while the rest are still decoding.
+CODEGEN_MODE = os.getenv("CODEGEN_MODE", "plan") # "plan" or "single" (one JSON call for every file)
+CODEGEN_FILE_CONCURRENCY = int(os.getenv("CODEGEN_FILE_CONCURRENCY", str(LLM_SLOTS)))
+CODEGEN_FILE_ATTEMPTS = int(os.getenv("CODEGEN_FILE_ATTEMPTS", "2"))
+
+class PlannedGeneration:
+    """Generates the files of a plan, each as soon as its dependencies are done.
+
+    A file waits only for the earlier planned files it depends_on and gets
+    their generated content as context; dependencies on unknown or later files
+    are ignored, which also rules out cycles. Independent files run concurrently
+    up to `concurrency` calls, so a multi-slot backend decodes them side by side.
+    `generate` is an async (path, purpose, dependencies) -> str | None, retried
+    up to `attempts` times; `on_file` is awaited with (patch, done, total) as
+    each file finishes.
+    """
+
+    def __init__(self, plan: list[dict], generate, on_file=None,
+                 concurrency: int = CODEGEN_FILE_CONCURRENCY, attempts: int = CODEGEN_FILE_ATTEMPTS):
+        self.plan = []
+        for entry in plan:
+            if all(entry["path"] != planned["path"] for planned in self.plan): # First entry for a path wins
+                self.plan.append(entry)
+        self.generate = generate
+        self.on_file = on_file
+        self.concurrency = max(1, concurrency)
+        self.attempts = max(1, attempts)
+        self.failed: list[str] = []
+        self.finished: list[dict] = []
+        self.stats = {"generated": 0, "failed": 0, "retries": 0}
+
+    def _dependencies(self, index: int) -> list[str]:
+        earlier = {entry["path"] for entry in self.plan[:index]}
+        return [d for d in self.plan[index]["depends_on"] if d in earlier]
+
+    async def _generate_one(self, index: int, results: dict[str, asyncio.Future], semaphore: asyncio.Semaphore):
+        entry = self.plan[index]
+        dependencies = {}
+        for path in self._dependencies(index):
+            content = await results[path]
+            if content is not None: # A failed dependency just isn't shown
+                dependencies[path] = content
+
+        content = None
+        for attempt in range(self.attempts):
+            if attempt:
+                self.stats["retries"] += 1
+                logger.info(f"🔁 Retrying {entry['path']} ({attempt + 1}/{self.attempts})...")
+            async with semaphore:
+                try:
+                    content = await self.generate(entry["path"], entry["purpose"], dependencies)
+                except Exception as e:
+                    logger.error(f"❌ Generating {entry['path']} failed: {e}")
+            if content:
+                break
+        results[entry["path"]].set_result(content or None)
+        if not content:
+            self.failed.append(entry["path"])
+            self.stats["failed"] += 1
+            return
+
+        self.stats["generated"] += 1
+        patch = {"path": entry["path"], "new_code": content, "explanation": entry["purpose"]}
+        self.finished.append(patch)
+        if self.on_file:
+            try:
+                await self.on_file(patch, len(self.finished), len(self.plan))
+            except Exception as e:
+                logger.warning(f"⚠️ Could not publish {entry['path']}: {e}")
+
+    async def run(self) -> list[dict]:
+        """Generated patches in completion order; paths that failed every attempt are in `failed`."""
+        loop = asyncio.get_running_loop()
+        results = {entry["path"]: loop.create_future() for entry in self.plan}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._generate_one(i, results, semaphore) for i in range(len(self.plan))))
+        return self.finished
@@ -0,0 +1,58 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# PR titles and descriptions are written by the local model from the diff the
+# codegen pipeline already has, while the branch is being pushed.
+PR_DESCRIBE_MAX_DIFF_CHARS = int(os.getenv("PR_DESCRIBE_MAX_DIFF_CHARS", "24000"))
+PR_DESCRIBE_MAX_TOKENS = int(os.getenv("PR_DESCRIBE_MAX_TOKENS", "768"))
+MAX_TITLE_CHARS = 100
+
+SYSTEM_PROMPT = """You are a senior engineer writing the pull request description for a change made by an automated coding agent.
+Answer in Markdown with exactly this layout:
+
+Title: <one line, imperative mood, at most 72 characters>
+
+## Type
+<one of: Bug fix, Enhancement, Documentation, Tests, Refactor>
+
+## Description
+<2-4 sentences on what changes and why>
+
+## Changes walkthrough
+- `<path>`: <what changed in this file>
+
+Describe only what the diff shows."""
+
+def build_messages(task: str, diff_stat: str, diff: str) -> list[dict]:
+    if len(diff) > PR_DESCRIBE_MAX_DIFF_CHARS:
+        diff = diff[:PR_DESCRIBE_MAX_DIFF_CHARS] + "\n...[diff truncated]..."
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Task: {task}\n\nFiles changed:\n{diff_stat}\n\nDiff:\n{diff}"},
+    ]
+
+def parse_description(text: str, fallback_title: str) -> tuple[str, str] | None:
+    """(title, body) from the model's answer, or None if there is nothing usable."""
+    text = (text or "").strip()
+    if not text or text.startswith("Error:"): # chat_completion reports failures in-band
+        return None
+    lines = text.split("\n")
+    title = fallback_title
+    if lines[0].lower().lstrip("#* ").startswith("title:"):
+        title = lines[0].split(":", 1)[1].strip().strip("`*\"' ") or fallback_title
+        lines = lines[1:]
+    body = "\n".join(lines).strip()
+    return (title[:MAX_TITLE_CHARS], body) if body else None
+
+async def describe_pr(chat, task: str, diff_stat: str, diff: str, fallback_title: str) -> tuple[str, str] | None:
+    """Title and Markdown body for a PR. `chat` is an async (messages, temperature, max_tokens) -> str."""
+    if not diff.strip():
+        return None
+    try:
+        answer = await chat(build_messages(task, diff_stat, diff), 0.2, PR_DESCRIBE_MAX_TOKENS)
+    except Exception as e:
+        logger.warning(f"⚠️ PR description failed: {e}")
+        return None
+    return parse_description(answer, fallback_title)
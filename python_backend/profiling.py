@@ -0,0 +1,133 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# On-demand profiling of the running process. The sampler is a daemon thread that
+# reads every thread's stack with sys._current_frames() at a fixed interval, so the
+# cost is bounded by the sampling rate rather than by how busy the node is, and
+# nothing needs to be restarted under a profiler.
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_MIN_INTERVAL_MS = 1.0
+STACK_DEPTH_LIMIT = 128
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _stack(frame) -> list[str]:
+    """Outermost-first labels for a frame's stack."""
+    labels = []
+    while frame is not None and len(labels) < STACK_DEPTH_LIMIT:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+def _is_idle_executor_worker(frame) -> bool:
+    # Idle ThreadPoolExecutor workers sit in _worker() blocked on the (C) queue get
+    return frame is not None and frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith(os.path.join("futures", "thread.py"))
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+class SamplingProfiler:
+    """Collects collapsed stacks (Brendan Gregg's flamegraph input format) for all threads."""
+
+    _active = threading.Lock()
+
+    def __init__(self, interval_ms: float = 5.0, include_idle: bool = False):
+        self.interval = max(PROFILE_MIN_INTERVAL_MS, interval_ms) / 1000
+        self.include_idle = include_idle
+        self.samples: Counter[str] = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not SamplingProfiler._active.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running.")
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        SamplingProfiler._active.release()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if not self.include_idle and _is_idle_executor_worker(frame):
+                    continue
+                stack = [names.get(thread_id, str(thread_id))] + _stack(frame)
+                self.samples[";".join(label.replace(";", ":") for label in stack)] += 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+async def profile_for(seconds: float, interval_ms: float = 5.0, include_idle: bool = False) -> SamplingProfiler:
+    """Sample all threads for `seconds` without blocking the event loop or the executor."""
+    profiler = SamplingProfiler(interval_ms, include_idle)
+    profiler.start()
+    try:
+        await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+    finally:
+        profiler.stop()
+    return profiler
+
+def task_snapshot(loop: asyncio.AbstractEventLoop, stack_limit: int = 8) -> dict:
+    """State of every asyncio task on the loop, grouped by coroutine."""
+    tasks = []
+    by_coroutine: Counter[str] = Counter()
+    for task in asyncio.all_tasks(loop):
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", repr(coro))
+        by_coroutine[name] += 1
+        tasks.append({
+            "name": task.get_name(),
+            "coroutine": name,
+            "done": task.done(),
+            "cancelled": task.cancelled(),
+            # Where the task is suspended, innermost last
+            "stack": [_frame_label(f) for f in task.get_stack(limit=stack_limit)],
+        })
+    return {
+        "total": len(tasks),
+        "by_coroutine": dict(by_coroutine.most_common()),
+        "tasks": sorted(tasks, key=lambda t: t["coroutine"]),
+    }
+
+def executor_snapshot(loop: asyncio.AbstractEventLoop) -> dict:
+    """Occupancy of the loop's default ThreadPoolExecutor (used by run_in_executor(None, ...))."""
+    executor = getattr(loop, "_default_executor", None)
+    if executor is None:
+        return {"created": False}
+    frames = sys._current_frames()
+    threads = []
+    for thread in list(getattr(executor, "_threads", ())):
+        frame = frames.get(thread.ident)
+        busy = not _is_idle_executor_worker(frame)
+        threads.append({
+            "name": thread.name,
+            "busy": busy,
+            "running": _stack(frame)[-3:] if busy and frame is not None else [],
+        })
+    work_queue = getattr(executor, "_work_queue", None)
+    return {
+        "created": True,
+        "max_workers": getattr(executor, "_max_workers", None),
+        "threads": len(threads),
+        "busy": sum(t["busy"] for t in threads),
+        "queued": work_queue.qsize() if work_queue is not None else None,
+        "workers": threads,
+        "sampled_at": time.time(),
+    }
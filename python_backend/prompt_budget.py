@@ -0,0 +1,96 @@
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# Tokens kept free between the prompt, max_tokens and n_ctx (BOS, stop tokens, rounding)
+SAFETY_MARGIN_TOKENS = 16
+
+@dataclass
+class PromptSection:
+    """A variable part of a prompt that may be trimmed to fit the context window.
+
+    Lower `priority` values are packed first. `trim` controls what survives
+    when the section doesn't fit: "lines" keeps whole leading lines, "head"
+    keeps the beginning, "middle" keeps the beginning and the end.
+    """
+    name: str
+    text: str
+    priority: int = 0
+    trim: str = "head"
+
+def count_tokens(llm, text: str) -> int:
+    if not text:
+        return 0
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+def truncate_tokens(llm, text: str, max_tokens: int, trim: str = "head") -> str:
+    """Cut `text` to at most `max_tokens` tokens using the model's own tokenizer."""
+    if max_tokens <= 0:
+        return ""
+    if trim == "lines":
+        kept, used = [], 0
+        for line in text.split("\n"):
+            cost = count_tokens(llm, line + "\n")
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(kept)
+
+    tokens = llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+    if len(tokens) <= max_tokens:
+        return text
+    if trim == "middle":
+        marker = "\n...[truncated]...\n"
+        keep = max_tokens - count_tokens(llm, marker)
+        if keep <= 0:
+            # No room for any content, so a bare marker would only overrun the budget
+            return ""
+        head_count, tail_count = keep - keep // 2, keep // 2
+        head = tokens[:head_count]
+        tail = tokens[len(tokens) - tail_count:] if tail_count else []
+        return (
+            llm.detokenize(head).decode("utf-8", errors="ignore")
+            + marker
+            + llm.detokenize(tail).decode("utf-8", errors="ignore")
+        )
+    return llm.detokenize(tokens[:max_tokens]).decode("utf-8", errors="ignore")
+
+def pack_sections(llm, sections: list[PromptSection], budget: int) -> tuple[dict[str, str], bool]:
+    """Fit sections into `budget` tokens in priority order.
+
+    Returns the (possibly trimmed) text per section name and whether anything
+    was trimmed.
+    """
+    packed = {}
+    trimmed = False
+    remaining = budget
+    for section in sorted(sections, key=lambda s: s.priority):
+        cost = count_tokens(llm, section.text)
+        if cost <= remaining:
+            packed[section.name] = section.text
+            remaining -= cost
+            continue
+        text = truncate_tokens(llm, section.text, remaining, section.trim)
+        cost = count_tokens(llm, text)
+        if cost > remaining:
+            # Re-tokenizing a cut can come out longer; drop the section rather than overrun
+            text, cost = "", 0
+        packed[section.name] = text
+        remaining -= cost
+        trimmed = True
+    return packed, trimmed
+
+def fit_prompt(llm, n_ctx: int, render, sections: list[PromptSection], max_tokens: int):
+    """Render a prompt whose variable sections are packed to leave room for `max_tokens`.
+
+    `render` takes a dict of section texts and returns the prompt string; the
+    fixed template cost is measured by rendering with every section empty.
+    Returns (prompt, prompt_tokens, trimmed).
+    """
+    overhead = count_tokens(llm, render({s.name: "" for s in sections}))
+    budget = n_ctx - max_tokens - overhead - SAFETY_MARGIN_TOKENS
+    packed, trimmed = pack_sections(llm, sections, max(budget, 0))
+    prompt = render(packed)
+    return prompt, count_tokens(llm, prompt), trimmed
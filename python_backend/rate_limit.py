@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+class AsyncRateLimiter:
+    """Token bucket for background jobs so they don't starve live traffic."""
+
+    def __init__(self, rate_per_second: float, burst: float | None = None):
+        self.rate = rate_per_second
+        self.capacity = burst if burst is not None else max(rate_per_second, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available. A rate <= 0 disables limiting."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                self._refill()
+                # Requests larger than the bucket are let through once it is full
+                if self._tokens >= min(tokens, self.capacity):
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((min(tokens, self.capacity) - self._tokens) / self.rate)
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take `tokens` without waiting. Returns 0 on success, else seconds until they'd be available."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self._tokens >= min(tokens, self.capacity):
+            self._tokens -= tokens
+            return 0.0
+        return (min(tokens, self.capacity) - self._tokens) / self.rate
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+import logging
+
+from rate_limit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "64"))
+REEMBED_RATE_PER_SECOND = float(os.getenv("REEMBED_RATE_PER_SECOND", "20")) # Comments per second
+REEMBED_BUSY_BACKOFF_SECONDS = float(os.getenv("REEMBED_BUSY_BACKOFF_SECONDS", "1"))
+REEMBED_MAX_CATCHUP_PASSES = int(os.getenv("REEMBED_MAX_CATCHUP_PASSES", "5"))
+REEMBED_INDEX_POLL_SECONDS = float(os.getenv("REEMBED_INDEX_POLL_SECONDS", "30"))
+
+# Run outside a transaction (psql or the SQL editor) before the switch; a CREATE
+# INDEX inside activate_embedding_model would hit the statement timeout
+NEXT_INDEX_SQL = (
+    "CREATE INDEX CONCURRENTLY comment_embeddings_embedding_next_idx "
+    "ON public.comment_embeddings USING ivfflat (embedding_next vector_cosine_ops) WITH (lists = 100);"
+)
+
+async def active_embedding_model(supabase) -> dict | None:
+    """The embedding_models row the comment_embeddings.embedding column currently holds."""
+    res = await supabase.table("embedding_models").select("*").eq("state", "active").execute()
+    return res.data[0] if res.data else None
+
+class ReembedJob:
+    """Re-embed every stored comment with a new model, then switch reads over.
+
+    Vectors are written to a shadow column (see 20240219_embedding_versions.sql)
+    while the live column keeps serving searches. The table is walked in
+    comment_id keyset pages with batched inference under a rate limit, pausing
+    while live comments are queued, and the cursor is checkpointed after every
+    page so a restart resumes. When a pass comes up empty the job waits for the
+    shadow column's index (NEXT_INDEX_SQL, built by an operator) and then
+    activate_embedding_model swaps the columns in one transaction; if live
+    writes slipped in since the pass started, another pass picks them up first.
+    """
+
+    def __init__(self, supabase, model_id: str, dimensions: int, embed_batch, busy=None, on_activated=None):
+        self.supabase = supabase
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.embed_batch = embed_batch # async (texts) -> list[list[float]] with the target model
+        self.busy = busy # optional () -> bool; the job yields while it is true
+        self.on_activated = on_activated # optional async () called after the switch
+        self.name = f"reembed:{model_id}"
+        self.limiter = AsyncRateLimiter(REEMBED_RATE_PER_SECOND, burst=REEMBED_BATCH_SIZE)
+        self.state = "pending"
+        self.error = None
+        self.stats = {"reembedded": 0, "passes": 0, "seconds": 0.0}
+
+    async def _load_checkpoint(self) -> dict:
+        res = await self.supabase.table("pipeline_checkpoints").select("*").eq("name", self.name).execute()
+        return res.data[0] if res.data else {"name": self.name, "cursor_id": None, "passes_completed": 0}
+
+    async def _save_checkpoint(self, checkpoint: dict):
+        checkpoint["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        await self.supabase.table("pipeline_checkpoints").upsert(checkpoint).execute()
+
+    async def _wait_for_capacity(self, rows: int):
+        while self.busy and self.busy():
+            await asyncio.sleep(REEMBED_BUSY_BACKOFF_SECONDS)
+        await self.limiter.acquire(rows)
+
+    async def _reembed_page(self, rows: list[dict]):
+        await self._wait_for_capacity(len(rows))
+        embeddings = await self.embed_batch([r["content"] or "" for r in rows])
+        await self.supabase.rpc("write_reembedded_comments", {
+            "p_model_id": self.model_id,
+            "p_rows": [{"comment_id": r["comment_id"], "embedding": e} for r, e in zip(rows, embeddings)]
+        }).execute()
+        self.stats["reembedded"] += len(rows)
+
+    async def _index_ready(self) -> bool:
+        res = await self.supabase.rpc("embedding_next_index_ready", {}).execute()
+        return res.data is True
+
+    async def _wait_for_index(self, stop_event: asyncio.Event | None):
+        if self.state != "awaiting_index":
+            self.state = "awaiting_index"
+            logger.info(f"⏳ Re-embed to {self.model_id} is waiting for its index. Run: {NEXT_INDEX_SQL}")
+        if stop_event:
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=REEMBED_INDEX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(REEMBED_INDEX_POLL_SECONDS)
+
+    async def run(self, stop_event: asyncio.Event | None = None) -> dict:
+        """Run (or resume) the migration until the switch succeeds."""
+        start = time.perf_counter()
+        self.state = "running"
+        try:
+            await self.supabase.rpc("begin_embedding_migration", {
+                "p_model_id": self.model_id, "p_dimensions": self.dimensions
+            }).execute()
+            checkpoint = await self._load_checkpoint()
+            attempts = 0
+            if checkpoint.get("cursor_id"):
+                logger.info(f"⏪ Resuming re-embed to {self.model_id} from {checkpoint['cursor_id']}")
+
+            while not (stop_event and stop_event.is_set()):
+                res = await self.supabase.rpc("find_comments_to_reembed", {
+                    "p_model_id": self.model_id,
+                    "p_after_id": checkpoint.get("cursor_id"),
+                    "p_limit": REEMBED_BATCH_SIZE
+                }).execute()
+                rows = res.data or []
+                if rows:
+                    await self._reembed_page(rows)
+                    checkpoint["cursor_id"] = rows[-1]["comment_id"]
+                    await self._save_checkpoint(checkpoint)
+                    continue
+
+                # End of a pass: switch over, or go round again for rows written meanwhile
+                self.stats["passes"] += 1
+                checkpoint.update(cursor_id=None, passes_completed=(checkpoint.get("passes_completed") or 0) + 1)
+                await self._save_checkpoint(checkpoint)
+                # Live writes keep arriving while the index builds, so each poll is also a catch-up pass
+                if not await self._index_ready():
+                    await self._wait_for_index(stop_event)
+                    continue
+                self.state = "running"
+                attempts += 1
+                activated = await self.supabase.rpc("activate_embedding_model", {"p_model_id": self.model_id}).execute()
+                if activated.data is True:
+                    self.state = "activated"
+                    logger.info(f"✅ Embeddings switched to {self.model_id}: {self.stats}")
+                    if self.on_activated:
+                        await self.on_activated()
+                    break
+                if attempts >= REEMBED_MAX_CATCHUP_PASSES:
+                    raise RuntimeError(f"Live writes kept outpacing the re-embed after {attempts} activation attempts.")
+                logger.info(f"🔁 Re-embed to {self.model_id} found late writes, starting catch-up pass.")
+            else:
+                self.state = "stopped"
+        except asyncio.CancelledError:
+            self.state = "stopped"
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"❌ Re-embed to {self.model_id} failed: {e}")
+        finally:
+            self.stats["seconds"] = round(time.perf_counter() - start, 2)
+        return self.status()
+
+    def status(self) -> dict:
+        status = {"model_id": self.model_id, "state": self.state, "error": self.error, **self.stats}
+        if self.state == "awaiting_index":
+            status["index_sql"] = NEXT_INDEX_SQL
+        return status
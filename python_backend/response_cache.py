@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """TTL + LRU cache for LLM responses with an optional SQLite tier.
+
+    Only deterministic or low-temperature calls are cached unless the caller
+    opts in. Keys cover the model file, the prompt inputs and the sampling
+    params, so a model swap never serves another model's output. The LRU is
+    read on the event loop; the SQLite tier lives on its own thread, so reads
+    that miss memory await it and writes are queued to it without waiting.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600, db_path: str | None = None, max_temperature: float = 0.2):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._db = None
+        self._disk = None
+        self._puts_since_prune = 0
+        if db_path:
+            # The connection is only ever used from this one thread
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache-db")
+            self._disk.submit(self._open_db, db_path).result()
+            logger.info(f"💾 LLM response cache persisted to {db_path}")
+
+    def _open_db(self, db_path: str):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._db.commit()
+
+    def accepts(self, temperature: float | None, opt_in: bool = False) -> bool:
+        return opt_in or (temperature or 0) <= self.max_temperature
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> tuple[object, float] | None:
+        """Return (value, age_seconds) or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1], now - entry[0]
+            if entry:
+                del self._entries[key]
+
+        if self._disk:
+            row = await asyncio.get_running_loop().run_in_executor(self._disk, self._db_get, key)
+            if row and now - row[1] <= self.ttl_seconds:
+                value = json.loads(row[0])
+                with self._lock:
+                    self._remember(key, row[1], value)
+                    self._hits += 1
+                return value, now - row[1]
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+        if self._disk:
+            # Fire and forget: the write (and its fsync) happens on the cache thread
+            self._disk.submit(self._db_put, key, json.dumps(value), now)
+
+    def _db_get(self, key: str):
+        return self._db.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+
+    def _db_put(self, key: str, value: str, now: float):
+        try:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)", (key, value, now))
+            self._puts_since_prune += 1
+            if self._puts_since_prune >= 100:
+                self._prune_db(now)
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Could not persist LLM cache entry: {e}")
+
+    def _remember(self, key: str, created_at: float, value):
+        self._entries[key] = (created_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_db(self, now: float):
+        """Drop expired rows and cap the table at 10x the in-memory size."""
+        self._puts_since_prune = 0
+        self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM llm_cache WHERE key NOT IN (SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries * 10,)
+        )
+
+    def close(self):
+        """Flush queued writes and close the SQLite tier."""
+        if self._disk:
+            self._disk.submit(self._db.close)
+            self._disk.shutdown(wait=True)
+            self._disk = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 3) if total else 0,
+                "persistent": self._db is not None,
+            }
+
+def response_cache_from_env() -> ResponseCache:
+    return ResponseCache(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512")),
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600")),
+        db_path=os.getenv("LLM_CACHE_DB") or None,
+        max_temperature=float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.2")),
+    )
@@ -0,0 +1,166 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Lightweight tracing: every realtime event, /analyze_comment and /generate call gets a
+# trace id, and each stage inside it records a span. Spans are handed to a background
+# thread and exported as JSONL (default) or OTLP/HTTP JSON to a collector.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl") # jsonl, otlp or none
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "3"))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "echo-backend")
+EXPORT_BATCH_SIZE = 256
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start", "end", "status", "_wall_start")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self._wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def as_dict(self) -> dict:
+        duration = (self.end or time.perf_counter()) - self.start
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self._wall_start,
+            "duration_ms": round(duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class _Exporter:
+    """Drains finished spans on a daemon thread so the hot path only enqueues."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+
+    def submit(self, span: dict):
+        if self.kind == "none":
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put(span)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.kind == "otlp":
+                    self._export_otlp(batch)
+                else:
+                    self._export_jsonl(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to export {len(batch)} spans: {e}")
+
+    def _export_jsonl(self, batch: list[dict]):
+        if self._file is None:
+            # Same size/time rotation as the backend log (imported here: log_pipeline imports us)
+            from log_pipeline import SizeAndTimeRotatingFileHandler, LOG_ROTATE_HOURS
+            self._file = SizeAndTimeRotatingFileHandler(TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT, LOG_ROTATE_HOURS * 3600)
+        for span in batch:
+            self._file.handle(logging.makeLogRecord({"msg": json.dumps(span, default=str)}))
+
+    def _export_otlp(self, batch: list[dict]):
+        import requests
+        spans = []
+        for span in batch:
+            start_ns = int(span["start"] * 1e9)
+            spans.append({
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "parentSpanId": span["parent_id"] or "",
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(span["duration_ms"] * 1e6)),
+                "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in span["attributes"].items()],
+                "status": {"code": 2 if span["status"] == "error" else 1},
+            })
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "echo"}, "spans": spans}],
+        }]}
+        requests.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+
+_exporter = _Exporter(TRACE_EXPORTER)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a span; starts a new trace when there is no active one.
+
+    Works in sync and async code. Executor threads only see the active span if
+    they run inside a copied context (see run_in_context).
+    """
+    parent = _current_span.get()
+    current = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.attributes["error"] = repr(e)[:200]
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+        _exporter.submit(current.as_dict())
+
+def traced(name: str):
+    """Decorator form of span() for coroutines (keeps the signature for FastAPI)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(**attributes):
+    """Attach attributes to the active span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def current_trace_id() -> str | None:
+    current = _current_span.get()
+    return current.trace_id if current else None
+
+def run_in_context(fn, *args):
+    """Bind fn to the caller's context, for loop.run_in_executor()."""
+    context = contextvars.copy_context()
+    return lambda: context.run(fn, *args)
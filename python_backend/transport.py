@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import importlib.util
+import inspect
+import os
+import time
+import logging
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Outbound HTTP shares keep-alive pools instead of opening a client per call, and
+# hot Supabase reads go through a short-TTL cache where identical concurrent
+# reads share one request (singleflight). Our own writes invalidate their keys.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+READ_CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL_SECONDS", "5")) # 0 = singleflight only
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", "10000"))
+
+def http2_available() -> bool:
+    # Probed without importing it; httpx imports h2 itself when http2=True
+    return importlib.util.find_spec("h2") is not None # pip install "httpx[http2]"
+
+def pooled_client(**kwargs):
+    """An httpx.AsyncClient with the tuned connection pool, on HTTP/2 when h2 is installed."""
+    import httpx
+    return httpx.AsyncClient(
+        http2=http2_available(),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+        timeout=HTTP_TIMEOUT_SECONDS,
+        **kwargs,
+    )
+
+_http_client = None
+
+def http_client():
+    """Process-wide client for outbound calls (frontend pings, webhooks)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = pooled_client()
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def supabase_options():
+    """Async client options giving PostgREST its own tuned pool.
+
+    PostgREST rebinds the client's base_url, so it gets a dedicated one rather
+    than the shared http_client(). supabase-py releases without the
+    `httpx_client` option keep their default pool.
+    """
+    from supabase.lib.client_options import AsyncClientOptions
+    if "httpx_client" in inspect.signature(AsyncClientOptions).parameters:
+        return AsyncClientOptions(httpx_client=pooled_client())
+    logger.info("ℹ️ supabase-py does not accept an httpx client; using its default connection pool.")
+    return AsyncClientOptions()
+
+class ReadCache:
+    """Singleflight plus short-TTL cache for reads, keyed by caller-chosen tuples.
+
+    Concurrent `get`s for a key share one fetch task (a caller being cancelled
+    doesn't cancel it for the others). Successful results are kept for `ttl`
+    seconds, LRU-bounded. `invalidate` drops a key, including a fetch still in
+    flight, whose result is then returned to its waiters but not cached.
+    Cached values are shared: treat them as read-only.
+    """
+
+    def __init__(self, ttl: float = READ_CACHE_TTL_SECONDS, max_entries: int = READ_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+
+    def _count(self, result: str):
+        self.stats[result] += 1
+        metrics.READ_CACHE_REQUESTS.inc(result=result)
+
+    async def get(self, key: tuple, fetch, ttl: float | None = None):
+        """Cached value for `key`, else the result of `await fetch()`."""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self._count("hits")
+            return entry[1]
+        task = self._inflight.get(key)
+        if task:
+            self._count("coalesced")
+        else:
+            self._count("misses")
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._settle, key, self.ttl if ttl is None else ttl))
+        return await asyncio.shield(task)
+
+    def _settle(self, key: tuple, ttl: float, task: asyncio.Task):
+        if self._inflight.get(key) is not task:
+            return # Invalidated while in flight
+        del self._inflight[key]
+        if task.cancelled() or task.exception() is not None or ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: tuple):
+        for key in keys:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+            self.stats["invalidations"] += 1
+
+    def status(self) -> dict:
+        return {"entries": len(self._entries), "in_flight": len(self._inflight), **self.stats}
@@ -0,0 +1,271 @@
+import json
+import os
+import time
+import uuid
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Comment vectors kept in-process as one contiguous float16 matrix (optionally a
+# memmap, so only rows being rescored are paged in) plus a quantized copy that
+# stays resident for candidate generation. Ids are 16-byte UUID keys in arrays;
+# a sorted copy with its row numbers maps id -> row without a dict.
+VECTOR_STORE_QUANTIZATION = os.getenv("VECTOR_STORE_QUANTIZATION", "binary") # "binary" or "int8"
+VECTOR_STORE_OVERSAMPLE = int(os.getenv("VECTOR_STORE_OVERSAMPLE", "10")) # Candidates rescored per result
+VECTOR_STORE_MIN_CANDIDATES = 32
+SCAN_CHUNK_ROWS = 65536
+INITIAL_CAPACITY = 1024
+
+# Set bits per byte value, for Hamming distance over packed sign bits
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _key(id) -> bytes:
+    return uuid.UUID(str(id)).bytes
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+class VectorStore:
+    """Cosine-similarity search over a compact, append-mostly set of vectors.
+
+    Each vector is stored normalized as float16 and quantized to either packed
+    sign bits (`binary`, dims/8 bytes) or int8 with a per-row scale (`int8`,
+    dims + 4 bytes). A search scores every row on the quantized copy, keeps
+    the best `k × VECTOR_STORE_OVERSAMPLE` candidates and rescores those
+    exactly from the float16 rows. `evaluate()` measures the recall this
+    costs against brute force. Not thread-safe; writers must be serialized.
+    """
+
+    def __init__(self, dims: int, path: str | None = None, quantization: str = VECTOR_STORE_QUANTIZATION):
+        if quantization not in ("binary", "int8"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.dims = dims
+        self.path = path # float16 rows are memory-mapped from here when set
+        self.quantization = quantization
+        self.count = 0
+        self._capacity = 0
+        self.vectors = None
+        self.ids = np.empty(0, dtype="S16")
+        self.codes = None
+        self.scales = np.empty(0, dtype=np.float32) # int8 only
+        self._sorted_keys = np.empty(0, dtype="S16")
+        self._sorted_rows = np.empty(0, dtype=np.int32)
+        self._grow(INITIAL_CAPACITY)
+
+    # --- Storage ---
+
+    def _code_width(self) -> int:
+        return (self.dims + 7) // 8 if self.quantization == "binary" else self.dims
+
+    def _grow(self, needed: int):
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity * 2, INITIAL_CAPACITY)
+        if self.path:
+            if self.vectors is not None:
+                self.vectors.flush()
+            with open(self.path, "ab") as f:
+                # Only ever extend: an existing file holds the rows being loaded
+                if f.seek(0, os.SEEK_END) < capacity * self.dims * 2:
+                    f.truncate(capacity * self.dims * 2)
+            self.vectors = np.memmap(self.path, dtype=np.float16, mode="r+", shape=(capacity, self.dims))
+        else:
+            vectors = np.empty((capacity, self.dims), dtype=np.float16)
+            if self.vectors is not None:
+                vectors[:self.count] = self.vectors[:self.count]
+            self.vectors = vectors
+        code_dtype = np.uint8 if self.quantization == "binary" else np.int8
+        codes = np.empty((capacity, self._code_width()), dtype=code_dtype)
+        ids = np.empty(capacity, dtype="S16")
+        scales = np.empty(capacity if self.quantization == "int8" else 0, dtype=np.float32)
+        if self.codes is not None:
+            codes[:self.count] = self.codes[:self.count]
+            ids[:self.count] = self.ids[:self.count]
+            if self.quantization == "int8":
+                scales[:self.count] = self.scales[:self.count]
+        self.codes, self.ids, self.scales = codes, ids, scales
+        self._capacity = capacity
+
+    def _quantize(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        if self.quantization == "binary":
+            return np.packbits(vectors > 0, axis=-1), None
+        scales = 127.0 / np.maximum(np.abs(vectors).max(axis=-1), 1e-12)
+        return np.round(vectors * scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _rows_of_keys(self, keys: np.ndarray) -> np.ndarray:
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if not len(self._sorted_keys):
+            return rows
+        positions = np.searchsorted(self._sorted_keys, keys)
+        hit = positions < len(self._sorted_keys)
+        hit[hit] = self._sorted_keys[positions[hit]] == keys[hit]
+        rows[hit] = self._sorted_rows[positions[hit]]
+        return rows
+
+    def rows_of(self, ids) -> np.ndarray:
+        """Row of each id, -1 where absent."""
+        return self._rows_of_keys(np.array([_key(i) for i in ids], dtype="S16"))
+
+    def add(self, ids: list, vectors) -> None:
+        """Insert or overwrite vectors by id."""
+        if not len(ids):
+            return
+        keys = np.array([_key(i) for i in ids], dtype="S16")
+        vectors = _normalize(vectors).reshape(len(keys), self.dims)
+        # An id repeated within the batch is written once, last value wins
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last)
+        keys, vectors = keys[keep], vectors[keep]
+
+        rows = self._rows_of_keys(keys)
+        new = rows < 0
+        added = int(new.sum())
+        self._grow(self.count + added)
+        rows[new] = np.arange(self.count, self.count + added)
+
+        codes, scales = self._quantize(vectors)
+        self.vectors[rows] = vectors.astype(np.float16)
+        self.codes[rows] = codes
+        if scales is not None:
+            self.scales[rows] = scales
+        self.ids[rows] = keys
+        self.count += added
+        if added:
+            merged_keys = np.concatenate([self._sorted_keys, keys[new]])
+            order = np.argsort(merged_keys, kind="stable")
+            self._sorted_keys = merged_keys[order]
+            self._sorted_rows = np.concatenate([self._sorted_rows, rows[new].astype(np.int32)])[order]
+
+    def get(self, id) -> np.ndarray | None:
+        row = int(self.rows_of([id])[0])
+        return None if row < 0 else self.vectors[row].astype(np.float32)
+
+    def id_at(self, row: int) -> str:
+        # numpy drops trailing NUL bytes from "S" values
+        return str(uuid.UUID(bytes=bytes(self.ids[row]).ljust(16, b"\0")))
+
+    # --- Search ---
+
+    def _approximate_scores(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        """Higher is more similar; comparable within one query only."""
+        if self.quantization == "binary":
+            bits = np.packbits(query > 0)
+            return -POPCOUNT[np.bitwise_xor(self.codes[start:end], bits)].sum(axis=1, dtype=np.int32)
+        return (self.codes[start:end].astype(np.float32) @ query) / self.scales[start:end]
+
+    def _candidates(self, query: np.ndarray, n: int) -> np.ndarray:
+        if n >= self.count:
+            return np.arange(self.count)
+        best_rows, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        for start in range(0, self.count, SCAN_CHUNK_ROWS):
+            end = min(start + SCAN_CHUNK_ROWS, self.count)
+            scores = np.concatenate([best_scores, self._approximate_scores(query, start, end).astype(np.float32)])
+            rows = np.concatenate([best_rows, np.arange(start, end)])
+            top = np.argpartition(-scores, n - 1)[:n] if len(scores) > n else np.arange(len(scores))
+            best_rows, best_scores = rows[top], scores[top]
+        return best_rows
+
+    def _search_rows(self, query, k: int, candidates: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        if not self.count or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = _normalize(query).reshape(self.dims)
+        candidates = candidates or max(k * VECTOR_STORE_OVERSAMPLE, VECTOR_STORE_MIN_CANDIDATES)
+        # Sorted rows keep the memmap reads sequential
+        rows = np.sort(self._candidates(query, candidates))
+        exact = self.vectors[rows].astype(np.float32) @ query
+        top = np.argsort(-exact)[:k]
+        return rows[top], exact[top]
+
+    def search(self, query, k: int = 10, candidates: int | None = None) -> list[tuple[str, float]]:
+        """Top-k (id, cosine similarity), best first."""
+        rows, scores = self._search_rows(query, k, candidates)
+        return [(self.id_at(int(r)), float(s)) for r, s in zip(rows, scores)]
+
+    def _exact_rows(self, query: np.ndarray, k: int) -> np.ndarray:
+        """Brute-force top-k rows, best first."""
+        scores = np.concatenate([
+            self.vectors[start:min(start + SCAN_CHUNK_ROWS, self.count)].astype(np.float32) @ query
+            for start in range(0, self.count, SCAN_CHUNK_ROWS)
+        ])
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        return top[np.argsort(-scores[top])]
+
+    def evaluate(self, queries: int = 200, k: int = 10, candidates: int | None = None, seed: int = 0) -> dict:
+        """Recall@k of search() against brute force, using stored vectors as queries.
+
+        Each query's own row is excluded from both result lists.
+        """
+        if self.count <= k:
+            return {"vectors": self.count, "error": f"Need more than {k} vectors."}
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(self.count, size=min(queries, self.count), replace=False)
+        recalls, approx_seconds, exact_seconds = [], 0.0, 0.0
+        for row in sample:
+            query = self.vectors[row].astype(np.float32)
+            start = time.perf_counter()
+            found, _ = self._search_rows(query, k + 1, candidates)
+            approx_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            truth = self._exact_rows(query, k + 1)
+            exact_seconds += time.perf_counter() - start
+            found = [r for r in found.tolist() if r != row][:k]
+            truth = [r for r in truth.tolist() if r != row][:k]
+            recalls.append(len(set(found) & set(truth)) / len(truth))
+        return {
+            "vectors": self.count,
+            "queries": len(sample),
+            "k": k,
+            "quantization": self.quantization,
+            "candidates": candidates or max((k + 1) * VECTOR_STORE_OVERSAMPLE, VECTOR_STORE_MIN_CANDIDATES),
+            "recall_at_k": round(float(np.mean(recalls)), 4),
+            "min_recall": round(float(np.min(recalls)), 4),
+            "search_ms": round(approx_seconds / len(sample) * 1000, 3),
+            "brute_force_ms": round(exact_seconds / len(sample) * 1000, 3),
+            **self.memory(),
+        }
+
+    def memory(self) -> dict:
+        """Bytes held for the live rows; memory-mapped float16 rows are not resident."""
+        n = self.count
+        resident = n * (self._code_width() + 16 + 16 + 4) + self.scales[:n].nbytes
+        float16 = n * self.dims * 2
+        return {
+            "resident_bytes": resident + (0 if self.path else float16),
+            "float16_bytes": float16,
+            "float32_list_bytes_estimate": n * (self.dims * 32 + 56), # Python float objects + list slots
+        }
+
+    # --- Persistence ---
+
+    def save(self):
+        """Write ids and metadata next to the memmap; codes are rebuilt on load."""
+        if not self.path:
+            raise ValueError("VectorStore.save() needs a path.")
+        self.vectors.flush()
+        np.save(f"{self.path}.ids.npy", self.ids[:self.count])
+        with open(f"{self.path}.json", "w", encoding="utf-8") as f:
+            json.dump({"dims": self.dims, "count": self.count, "quantization": self.quantization}, f)
+
+    @classmethod
+    def load(cls, path: str, quantization: str | None = None) -> "VectorStore":
+        with open(f"{path}.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls(meta["dims"], path, quantization or meta["quantization"])
+        ids = np.load(f"{path}.ids.npy")
+        store._grow(meta["count"])
+        for start in range(0, meta["count"], SCAN_CHUNK_ROWS):
+            end = min(start + SCAN_CHUNK_ROWS, meta["count"])
+            codes, scales = store._quantize(store.vectors[start:end].astype(np.float32))
+            store.codes[start:end] = codes
+            if scales is not None:
+                store.scales[start:end] = scales
+        store.ids[:meta["count"]] = ids
+        store.count = meta["count"]
+        order = np.argsort(ids, kind="stable")
+        store._sorted_keys = ids[order]
+        store._sorted_rows = order.astype(np.int32)
+        return store
@@ -0,0 +1,84 @@
+import os
+import socket
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# "single": this process handles every realtime event (default, no coordination).
+# "sharded": several workers claim comments and agent tasks through leases.
+WORKER_MODE = os.getenv("WORKER_MODE", "single")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+LEASE_SECONDS = int(os.getenv("WORKER_LEASE_SECONDS", "300"))
+CLAIM_BATCH_SIZE = int(os.getenv("WORKER_CLAIM_BATCH_SIZE", "4"))
+POLL_INTERVAL_SECONDS = float(os.getenv("WORKER_POLL_INTERVAL_SECONDS", "15"))
+
+class WorkerLeases:
+    """Thin wrapper over the lease RPCs in 20240216_worker_leases.sql."""
+
+    def __init__(self, supabase, worker_id: str = WORKER_ID, lease_seconds: int = LEASE_SECONDS):
+        self.supabase = supabase
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+
+    async def claim_comments(self, limit: int = CLAIM_BATCH_SIZE, comment_id: str | None = None) -> list[dict]:
+        """Claim pending or lease-expired comments. Returns [{"comment_id", "content"}]."""
+        params = {"p_worker_id": self.worker_id, "p_limit": limit, "p_lease_seconds": self.lease_seconds}
+        if comment_id:
+            params["p_comment_id"] = comment_id
+        res = await self.supabase.rpc("claim_comment_jobs", params).execute()
+        return res.data or []
+
+    async def claim_comments_by_ids(self, comment_ids: list[str]) -> list[dict]:
+        """Claim specific comments (e.g. ones this worker just bulk-inserted)."""
+        res = await self.supabase.rpc("claim_comment_jobs_by_ids", {
+            "p_worker_id": self.worker_id,
+            "p_comment_ids": comment_ids,
+            "p_lease_seconds": self.lease_seconds
+        }).execute()
+        return res.data or []
+
+    async def complete_comment(self, comment_id: str, success: bool):
+        await self.supabase.rpc("complete_comment_job", {
+            "p_comment_id": comment_id,
+            "p_worker_id": self.worker_id,
+            "p_status": "done" if success else "failed"
+        }).execute()
+
+    async def complete_comments(self, comment_ids: list[str]):
+        await self.supabase.rpc("complete_comment_jobs", {
+            "p_comment_ids": comment_ids,
+            "p_worker_id": self.worker_id
+        }).execute()
+
+    async def claim_task(self, task_id: str) -> bool:
+        res = await self.supabase.rpc("claim_agent_task", {
+            "p_task_id": task_id,
+            "p_worker_id": self.worker_id,
+            "p_lease_seconds": self.lease_seconds
+        }).execute()
+        return bool(res.data)
+
+    async def release_task(self, task_id: str, status: str | None = None):
+        """Drop the lease so the heartbeat stops renewing it; `status` (e.g. "failed") is written too."""
+        await self.supabase.rpc("release_agent_task", {
+            "p_task_id": task_id,
+            "p_worker_id": self.worker_id,
+            "p_status": status
+        }).execute()
+
+    async def comment_queue_enabled(self) -> bool:
+        res = await self.supabase.table("worker_settings").select("comment_queue_enabled").execute()
+        return bool(res.data and res.data[0]["comment_queue_enabled"])
+
+    async def set_comment_queue(self, enabled: bool):
+        """Comments are only enqueued into comment_jobs while this is on. Shared by every
+        backend, so it is switched by an operator (POST /admin/workers/comment_queue), not at startup."""
+        await self.supabase.rpc("set_comment_job_queue", {"p_enabled": enabled}).execute()
+
+    async def heartbeat(self):
+        """Extend every comment lease and agent task this worker holds."""
+        await self.supabase.rpc("renew_worker_leases", {
+            "p_worker_id": self.worker_id,
+            "p_lease_seconds": self.lease_seconds
+        }).execute()
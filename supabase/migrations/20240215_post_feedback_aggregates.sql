@@ -0,0 +1,150 @@
+-- Per-post feedback aggregates, maintained incrementally as analyses are inserted.
+-- Dashboards, /top_comment and reports read one row per post instead of scanning feedback_analysis.
+
+CREATE TABLE IF NOT EXISTS public.post_feedback_aggregates (
+  post_id uuid PRIMARY KEY REFERENCES public.posts(id) ON DELETE CASCADE,
+  comment_count integer NOT NULL DEFAULT 0,
+  sentiment_sum double precision NOT NULL DEFAULT 0,
+  -- Buckets over [-1, 1]: very_negative, negative, neutral, positive, very_positive
+  sentiment_histogram jsonb NOT NULL DEFAULT '{"very_negative": 0, "negative": 0, "neutral": 0, "positive": 0, "very_positive": 0}'::jsonb,
+  category_counts jsonb NOT NULL DEFAULT '{}'::jsonb,
+  keyword_counts jsonb NOT NULL DEFAULT '{}'::jsonb,
+  -- Bounded top-K by priority_score: [{comment_id, content, priority_score, sentiment_score, category, actionable_summary}]
+  top_comments jsonb NOT NULL DEFAULT '[]'::jsonb,
+  updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- 1. Fold one analysis into its post's aggregate row
+CREATE OR REPLACE FUNCTION public.apply_feedback_to_post_aggregate(
+  p_comment_id uuid,
+  p_sentiment double precision,
+  p_category text,
+  p_priority double precision,
+  p_summary text,
+  p_keywords text[]
+)
+RETURNS void AS $$
+DECLARE
+  top_k CONSTANT int := 10;
+  max_keywords CONSTANT int := 200;
+  v_post_id uuid;
+  v_content text;
+  v_bucket text;
+  v_keyword text;
+  agg public.post_feedback_aggregates%ROWTYPE;
+BEGIN
+  SELECT post_id, content INTO v_post_id, v_content FROM public.comments WHERE id = p_comment_id;
+  IF v_post_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  -- Row lock serializes concurrent updates for the same post
+  INSERT INTO public.post_feedback_aggregates (post_id) VALUES (v_post_id) ON CONFLICT (post_id) DO NOTHING;
+  SELECT * INTO agg FROM public.post_feedback_aggregates WHERE post_id = v_post_id FOR UPDATE;
+
+  p_sentiment := coalesce(p_sentiment, 0);
+  v_bucket := CASE
+    WHEN p_sentiment <= -0.6 THEN 'very_negative'
+    WHEN p_sentiment <= -0.2 THEN 'negative'
+    WHEN p_sentiment < 0.2 THEN 'neutral'
+    WHEN p_sentiment < 0.6 THEN 'positive'
+    ELSE 'very_positive'
+  END;
+
+  agg.comment_count := agg.comment_count + 1;
+  agg.sentiment_sum := agg.sentiment_sum + p_sentiment;
+  agg.sentiment_histogram := jsonb_set(
+    agg.sentiment_histogram, ARRAY[v_bucket],
+    to_jsonb(coalesce((agg.sentiment_histogram->>v_bucket)::int, 0) + 1)
+  );
+  agg.category_counts := jsonb_set(
+    agg.category_counts, ARRAY[coalesce(p_category, 'general')],
+    to_jsonb(coalesce((agg.category_counts->>coalesce(p_category, 'general'))::int, 0) + 1)
+  );
+
+  FOREACH v_keyword IN ARRAY coalesce(p_keywords, ARRAY[]::text[]) LOOP
+    v_keyword := lower(trim(v_keyword));
+    CONTINUE WHEN v_keyword = '';
+    agg.keyword_counts := jsonb_set(
+      agg.keyword_counts, ARRAY[v_keyword],
+      to_jsonb(coalesce((agg.keyword_counts->>v_keyword)::int, 0) + 1)
+    );
+  END LOOP;
+
+  -- Keep keyword map bounded (prune in bulk to amortize the cost)
+  IF (SELECT count(*) FROM jsonb_object_keys(agg.keyword_counts)) > 2 * max_keywords THEN
+    SELECT coalesce(jsonb_object_agg(key, value), '{}'::jsonb) INTO agg.keyword_counts
+    FROM (
+      SELECT key, value FROM jsonb_each(agg.keyword_counts)
+      ORDER BY (value)::int DESC LIMIT max_keywords
+    ) kept;
+  END IF;
+
+  SELECT coalesce(jsonb_agg(entry ORDER BY (entry->>'priority_score')::float DESC), '[]'::jsonb) INTO agg.top_comments
+  FROM (
+    SELECT entry FROM (
+      SELECT e AS entry FROM jsonb_array_elements(agg.top_comments) e
+      WHERE e->>'comment_id' <> p_comment_id::text
+      UNION ALL
+      SELECT jsonb_build_object(
+        'comment_id', p_comment_id,
+        'content', v_content,
+        'priority_score', coalesce(p_priority, 0),
+        'sentiment_score', p_sentiment,
+        'category', coalesce(p_category, 'general'),
+        'actionable_summary', coalesce(p_summary, '')
+      )
+    ) candidates
+    ORDER BY (entry->>'priority_score')::float DESC
+    LIMIT top_k
+  ) top;
+
+  UPDATE public.post_feedback_aggregates SET
+    comment_count = agg.comment_count,
+    sentiment_sum = agg.sentiment_sum,
+    sentiment_histogram = agg.sentiment_histogram,
+    category_counts = agg.category_counts,
+    keyword_counts = agg.keyword_counts,
+    top_comments = agg.top_comments,
+    updated_at = timezone('utc'::text, now())
+  WHERE post_id = v_post_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- 2. Maintain aggregates at ingest time
+CREATE OR REPLACE FUNCTION public.trigger_post_aggregate_on_analysis()
+RETURNS trigger AS $$
+BEGIN
+  PERFORM public.apply_feedback_to_post_aggregate(
+    NEW.comment_id, NEW.sentiment_score, NEW.category,
+    NEW.priority_score, NEW.actionable_summary, NEW.keywords
+  );
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS post_aggregate_on_analysis ON public.feedback_analysis;
+CREATE TRIGGER post_aggregate_on_analysis
+AFTER INSERT ON public.feedback_analysis
+FOR EACH ROW
+EXECUTE FUNCTION public.trigger_post_aggregate_on_analysis();
+
+-- 3. One-time backfill from existing analyses
+DO $$
+DECLARE
+  fa record;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM public.post_feedback_aggregates) THEN
+    FOR fa IN SELECT * FROM public.feedback_analysis ORDER BY analyzed_at LOOP
+      PERFORM public.apply_feedback_to_post_aggregate(
+        fa.comment_id, fa.sentiment_score, fa.category,
+        fa.priority_score, fa.actionable_summary, fa.keywords
+      );
+    END LOOP;
+  END IF;
+END $$;
+
+-- RLS
+ALTER TABLE public.post_feedback_aggregates ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Post feedback aggregates are viewable by everyone." ON public.post_feedback_aggregates
+  FOR SELECT USING (true);
@@ -0,0 +1,137 @@
+-- Work leases so several backend workers can share the realtime pipeline and agent tasks
+-- without duplicate LLM work. Claims use FOR UPDATE SKIP LOCKED; leases expire if a
+-- worker stops heartbeating, and the work becomes claimable again.
+
+-- 1. Comment analysis queue (one row per comment)
+CREATE TABLE IF NOT EXISTS public.comment_jobs (
+  comment_id uuid PRIMARY KEY REFERENCES public.comments(id) ON DELETE CASCADE,
+  status text NOT NULL DEFAULT 'pending', -- pending, leased, done, failed
+  worker_id text,
+  attempts integer NOT NULL DEFAULT 0,
+  lease_expires_at timestamp with time zone,
+  updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS comment_jobs_claimable_idx ON public.comment_jobs (status, lease_expires_at, updated_at);
+
+CREATE OR REPLACE FUNCTION public.enqueue_comment_job()
+RETURNS trigger AS $$
+BEGIN
+  INSERT INTO public.comment_jobs (comment_id) VALUES (NEW.id) ON CONFLICT (comment_id) DO NOTHING;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS enqueue_comment_job_on_insert ON public.comments;
+CREATE TRIGGER enqueue_comment_job_on_insert
+AFTER INSERT ON public.comments
+FOR EACH ROW
+EXECUTE FUNCTION public.enqueue_comment_job();
+
+-- 2. Claim up to p_limit pending (or lease-expired) comments; pass p_comment_id to claim one
+CREATE OR REPLACE FUNCTION public.claim_comment_jobs(
+  p_worker_id text,
+  p_limit int DEFAULT 10,
+  p_lease_seconds int DEFAULT 300,
+  p_comment_id uuid DEFAULT NULL,
+  p_max_attempts int DEFAULT 5
+)
+RETURNS TABLE (comment_id uuid, content text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH claimable AS (
+    SELECT j.comment_id
+    FROM public.comment_jobs j
+    WHERE (p_comment_id IS NULL OR j.comment_id = p_comment_id)
+      AND j.attempts < p_max_attempts
+      AND (j.status = 'pending' OR (j.status = 'leased' AND j.lease_expires_at < now()))
+    ORDER BY j.updated_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ), claimed AS (
+    UPDATE public.comment_jobs j SET
+      status = 'leased',
+      worker_id = p_worker_id,
+      attempts = j.attempts + 1,
+      lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+      updated_at = now()
+    FROM claimable
+    WHERE j.comment_id = claimable.comment_id
+    RETURNING j.comment_id
+  )
+  SELECT c.id, c.content FROM claimed JOIN public.comments c ON c.id = claimed.comment_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.complete_comment_job(p_comment_id uuid, p_worker_id text, p_status text DEFAULT 'done')
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  UPDATE public.comment_jobs SET
+    -- Failed attempts go back to pending until attempts reach the claim limit
+    status = CASE WHEN p_status = 'failed' THEN 'pending' ELSE p_status END,
+    lease_expires_at = NULL,
+    updated_at = now()
+  WHERE comment_id = p_comment_id AND worker_id = p_worker_id;
+$$;
+
+-- 3. Agent task leases, built on last_heartbeat
+ALTER TABLE public.agent_tasks
+ADD COLUMN IF NOT EXISTS claimed_by text;
+
+COMMENT ON COLUMN public.agent_tasks.claimed_by IS 'Worker id holding the lease; the lease is live while last_heartbeat is recent.';
+
+CREATE OR REPLACE FUNCTION public.claim_agent_task(p_task_id uuid, p_worker_id text, p_lease_seconds int DEFAULT 300)
+RETURNS boolean
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_id uuid;
+BEGIN
+  SELECT id INTO v_id
+  FROM public.agent_tasks
+  WHERE id = p_task_id
+    AND NOT (
+      status = 'processing'
+      AND claimed_by IS NOT NULL
+      AND claimed_by <> p_worker_id
+      AND last_heartbeat >= now() - make_interval(secs => p_lease_seconds)
+    )
+  FOR UPDATE SKIP LOCKED;
+
+  IF v_id IS NULL THEN
+    RETURN false;
+  END IF;
+
+  UPDATE public.agent_tasks SET
+    claimed_by = p_worker_id,
+    status = 'processing',
+    last_heartbeat = now()
+  WHERE id = v_id;
+  RETURN true;
+END;
+$$;
+
+-- 4. Heartbeat: extend every lease a worker holds
+CREATE OR REPLACE FUNCTION public.renew_worker_leases(p_worker_id text, p_lease_seconds int DEFAULT 300)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  UPDATE public.comment_jobs SET lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+  WHERE worker_id = p_worker_id AND status = 'leased';
+
+  UPDATE public.agent_tasks SET last_heartbeat = now()
+  WHERE claimed_by = p_worker_id AND status = 'processing';
+$$;
+
+-- RLS
+ALTER TABLE public.comment_jobs ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Comment jobs are viewable by everyone." ON public.comment_jobs
+  FOR SELECT USING (true);
@@ -0,0 +1,69 @@
+-- Catch-up backfill for comments missed while the realtime listener was down.
+-- The backend scans comments in (created_at, id) keyset order for rows with no
+-- embedding or no analysis, and persists its cursor here so it can resume.
+
+CREATE TABLE IF NOT EXISTS public.pipeline_checkpoints (
+  name text PRIMARY KEY,
+  cursor_created_at timestamp with time zone,
+  cursor_id uuid,
+  passes_completed integer NOT NULL DEFAULT 0,
+  last_pass_completed_at timestamp with time zone,
+  updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS comments_created_at_id_idx ON public.comments (created_at, id);
+CREATE INDEX IF NOT EXISTS feedback_analysis_comment_id_idx ON public.feedback_analysis (comment_id);
+
+-- Next page of comments after the cursor that are missing an embedding or an analysis.
+-- Comments younger than p_min_age_seconds are left to the realtime listener.
+CREATE OR REPLACE FUNCTION public.find_unprocessed_comments(
+  p_after_created_at timestamp with time zone DEFAULT NULL,
+  p_after_id uuid DEFAULT NULL,
+  p_limit int DEFAULT 100,
+  p_min_age_seconds int DEFAULT 120
+)
+RETURNS TABLE (
+  id uuid,
+  content text,
+  created_at timestamp with time zone,
+  has_embedding boolean,
+  has_analysis boolean
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+  SELECT * FROM (
+    SELECT
+      c.id,
+      c.content,
+      c.created_at,
+      EXISTS (SELECT 1 FROM public.comment_embeddings ce WHERE ce.comment_id = c.id AND ce.embedding IS NOT NULL) AS has_embedding,
+      EXISTS (SELECT 1 FROM public.feedback_analysis fa WHERE fa.comment_id = c.id) AS has_analysis
+    FROM public.comments c
+    WHERE (p_after_created_at IS NULL OR (c.created_at, c.id) > (p_after_created_at, coalesce(p_after_id, '00000000-0000-0000-0000-000000000000'::uuid)))
+      AND c.created_at < now() - make_interval(secs => p_min_age_seconds)
+    ORDER BY c.created_at, c.id
+  ) scanned
+  WHERE NOT (scanned.has_embedding AND scanned.has_analysis)
+  LIMIT p_limit;
+$$;
+
+-- In sharded mode the backfill hands missed comments to the lease workers instead
+CREATE OR REPLACE FUNCTION public.enqueue_comment_jobs(p_comment_ids uuid[])
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  INSERT INTO public.comment_jobs (comment_id)
+  SELECT unnest(p_comment_ids)
+  ON CONFLICT (comment_id) DO UPDATE SET
+    status = 'pending',
+    attempts = 0,
+    updated_at = now()
+  WHERE public.comment_jobs.status IN ('done', 'failed');
+$$;
+
+ALTER TABLE public.pipeline_checkpoints ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Pipeline checkpoints are viewable by everyone." ON public.pipeline_checkpoints
+  FOR SELECT USING (true);
@@ -0,0 +1,45 @@
+-- Bulk /ingest claims the comments it just inserted in one round trip, and
+-- releases them once their analyses are written.
+
+CREATE OR REPLACE FUNCTION public.claim_comment_jobs_by_ids(
+  p_worker_id text,
+  p_comment_ids uuid[],
+  p_lease_seconds int DEFAULT 300
+)
+RETURNS TABLE (comment_id uuid)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH claimable AS (
+    SELECT j.comment_id
+    FROM public.comment_jobs j
+    WHERE j.comment_id = ANY(p_comment_ids)
+      AND (j.status = 'pending' OR (j.status = 'leased' AND j.lease_expires_at < now()))
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE public.comment_jobs j SET
+    status = 'leased',
+    worker_id = p_worker_id,
+    attempts = j.attempts + 1,
+    lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+    updated_at = now()
+  FROM claimable
+  WHERE j.comment_id = claimable.comment_id
+  RETURNING j.comment_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.complete_comment_jobs(p_comment_ids uuid[], p_worker_id text)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  UPDATE public.comment_jobs SET
+    status = 'done',
+    lease_expires_at = NULL,
+    updated_at = now()
+  WHERE comment_id = ANY(p_comment_ids) AND worker_id = p_worker_id;
+$$;
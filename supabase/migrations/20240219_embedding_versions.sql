@@ -0,0 +1,154 @@
+-- Versioned embeddings and zero-downtime re-embedding.
+-- Every comment_embeddings row records the model that produced it. Switching
+-- models fills a shadow column (embedding_next / next_model_id) in the
+-- background, then activate_embedding_model() swaps the columns in one
+-- transaction, so readers never see a half-migrated table.
+
+CREATE TABLE IF NOT EXISTS public.embedding_models (
+  model_id text PRIMARY KEY,
+  dimensions integer NOT NULL,
+  state text NOT NULL DEFAULT 'building', -- building, active, retired
+  created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+  activated_at timestamp with time zone
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS embedding_models_single_active_idx ON public.embedding_models ((true)) WHERE state = 'active';
+CREATE UNIQUE INDEX IF NOT EXISTS embedding_models_single_building_idx ON public.embedding_models ((true)) WHERE state = 'building';
+
+-- Existing vectors were all produced by all-MiniLM-L6-v2 (see 20240201_update_vector_dim_384.sql)
+INSERT INTO public.embedding_models (model_id, dimensions, state, activated_at)
+VALUES ('sentence-transformers/all-MiniLM-L6-v2', 384, 'active', now())
+ON CONFLICT (model_id) DO NOTHING;
+
+-- A constant default is stored in the catalog, so this does not rewrite the table;
+-- dropping it afterwards keeps the value for existing rows.
+ALTER TABLE public.comment_embeddings ADD COLUMN IF NOT EXISTS model_id text DEFAULT 'sentence-transformers/all-MiniLM-L6-v2';
+ALTER TABLE public.comment_embeddings ALTER COLUMN model_id DROP DEFAULT;
+
+-- Register the target model and add the shadow columns (metadata-only).
+-- Calling it again for the model already being built resumes that migration.
+CREATE OR REPLACE FUNCTION public.begin_embedding_migration(p_model_id text, p_dimensions integer)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  building text;
+BEGIN
+  IF EXISTS (SELECT 1 FROM public.embedding_models WHERE model_id = p_model_id AND state = 'active') THEN
+    RAISE EXCEPTION 'Embedding model % is already active', p_model_id;
+  END IF;
+  SELECT model_id INTO building FROM public.embedding_models WHERE state = 'building';
+  IF building IS NOT NULL AND building <> p_model_id THEN
+    RAISE EXCEPTION 'A re-embed to % is already in progress', building;
+  END IF;
+
+  INSERT INTO public.embedding_models (model_id, dimensions, state)
+  VALUES (p_model_id, p_dimensions, 'building')
+  ON CONFLICT (model_id) DO UPDATE SET state = 'building', dimensions = EXCLUDED.dimensions;
+
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'comment_embeddings' AND column_name = 'embedding_next'
+  ) THEN
+    EXECUTE format('ALTER TABLE public.comment_embeddings ADD COLUMN embedding_next vector(%s), ADD COLUMN next_model_id text', p_dimensions);
+    NOTIFY pgrst, 'reload schema';
+  END IF;
+END;
+$$;
+
+-- Next keyset page (by comment_id) of rows not yet re-embedded with p_model_id
+CREATE OR REPLACE FUNCTION public.find_comments_to_reembed(
+  p_model_id text,
+  p_after_id uuid DEFAULT NULL,
+  p_limit int DEFAULT 64
+)
+RETURNS TABLE (
+  comment_id uuid,
+  content text
+)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT ce.comment_id, c.content
+  FROM public.comment_embeddings ce
+  JOIN public.comments c ON c.id = ce.comment_id
+  WHERE (p_after_id IS NULL OR ce.comment_id > p_after_id)
+    AND ce.next_model_id IS DISTINCT FROM p_model_id
+  ORDER BY ce.comment_id
+  LIMIT p_limit;
+END;
+$$;
+
+-- p_rows: [{"comment_id": ..., "embedding": [...]}, ...]
+CREATE OR REPLACE FUNCTION public.write_reembedded_comments(p_model_id text, p_rows jsonb)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+  UPDATE public.comment_embeddings ce
+  SET embedding_next = (r.value->>'embedding')::vector,
+      next_model_id = p_model_id
+  FROM jsonb_array_elements(p_rows) r
+  WHERE ce.comment_id = (r.value->>'comment_id')::uuid;
+END;
+$$;
+
+-- Swap the shadow column in. Returns false (without switching) if rows written
+-- since the last pass still lack a p_model_id embedding; the caller re-scans.
+CREATE OR REPLACE FUNCTION public.activate_embedding_model(p_model_id text)
+RETURNS boolean
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM public.embedding_models WHERE model_id = p_model_id AND state = 'building') THEN
+    RAISE EXCEPTION 'Embedding model % is not being built', p_model_id;
+  END IF;
+
+  -- Built on the filled column so the ivfflat lists are trained on real data
+  CREATE INDEX IF NOT EXISTS comment_embeddings_embedding_next_idx
+  ON public.comment_embeddings USING ivfflat (embedding_next vector_cosine_ops)
+  WITH (lists = 100);
+
+  -- Blocks writers (readers keep going) so nothing lands in the old column after the check
+  LOCK TABLE public.comment_embeddings IN SHARE ROW EXCLUSIVE MODE;
+  IF EXISTS (SELECT 1 FROM public.comment_embeddings WHERE next_model_id IS DISTINCT FROM p_model_id) THEN
+    RETURN false;
+  END IF;
+
+  ALTER TABLE public.comment_embeddings DROP COLUMN embedding;
+  ALTER TABLE public.comment_embeddings DROP COLUMN model_id;
+  ALTER TABLE public.comment_embeddings RENAME COLUMN embedding_next TO embedding;
+  ALTER TABLE public.comment_embeddings RENAME COLUMN next_model_id TO model_id;
+  ALTER INDEX public.comment_embeddings_embedding_next_idx RENAME TO comment_embeddings_embedding_idx;
+
+  UPDATE public.embedding_models SET state = 'retired' WHERE state = 'active';
+  UPDATE public.embedding_models SET state = 'active', activated_at = now() WHERE model_id = p_model_id;
+  NOTIFY pgrst, 'reload schema';
+  RETURN true;
+END;
+$$;
+
+-- Abandon an in-progress migration and drop the shadow columns
+CREATE OR REPLACE FUNCTION public.cancel_embedding_migration()
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+  ALTER TABLE public.comment_embeddings DROP COLUMN IF EXISTS embedding_next;
+  ALTER TABLE public.comment_embeddings DROP COLUMN IF EXISTS next_model_id;
+  UPDATE public.embedding_models SET state = 'retired' WHERE state = 'building';
+  DELETE FROM public.pipeline_checkpoints WHERE name LIKE 'reembed:%';
+  NOTIFY pgrst, 'reload schema';
+END;
+$$;
+
+ALTER TABLE public.embedding_models ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Embedding models are viewable by everyone." ON public.embedding_models
+  FOR SELECT USING (true);
@@ -0,0 +1,115 @@
+-- Coalesce bursts of actionable feedback into one agent task per related group.
+-- A high-priority comment joins an open ('coalescing') task on the same monitored
+-- post when it is similar enough to the comments already collected, otherwise it
+-- opens a new one. Tasks become 'pending' (visible to the queue processor) when
+-- their window closes or they reach the size cap.
+
+ALTER TABLE public.agent_tasks
+ADD COLUMN IF NOT EXISTS coalesce_until timestamp with time zone;
+
+COMMENT ON COLUMN public.agent_tasks.coalesce_until IS 'While status is coalescing, when the task is released to the queue.';
+
+CREATE INDEX IF NOT EXISTS agent_tasks_coalescing_idx ON public.agent_tasks (monitored_post_id, coalesce_until)
+WHERE status = 'coalescing';
+
+CREATE OR REPLACE FUNCTION public.coalesce_agent_feedback(
+  p_monitored_post_id uuid,
+  p_comment_id uuid,
+  p_priority float,
+  p_window_seconds int DEFAULT 120,
+  p_max_comments int DEFAULT 10,
+  p_similarity float DEFAULT 0.6,
+  p_embedding vector DEFAULT NULL -- When the comment's embedding isn't stored yet (bulk ingest)
+)
+RETURNS TABLE (
+  task_id uuid,
+  comment_count int,
+  released boolean
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_task uuid;
+  v_count int;
+  v_embedding vector;
+BEGIN
+  -- One coalescer per post at a time, so concurrent workers don't open parallel groups
+  PERFORM pg_advisory_xact_lock(hashtext('coalesce:' || p_monitored_post_id::text));
+
+  -- Already collected (e.g. an analysis retry)
+  SELECT t.id, jsonb_array_length(t.result->'comment_ids') INTO v_task, v_count
+  FROM public.agent_tasks t
+  WHERE t.monitored_post_id = p_monitored_post_id
+    AND t.status = 'coalescing'
+    AND t.result->'comment_ids' ? p_comment_id::text;
+  IF v_task IS NOT NULL THEN
+    RETURN QUERY SELECT v_task, v_count, false;
+    RETURN;
+  END IF;
+
+  -- Open group whose comments are, on average, most similar to this one
+  v_embedding := coalesce(p_embedding, (SELECT ce.embedding FROM public.comment_embeddings ce WHERE ce.comment_id = p_comment_id));
+  IF v_embedding IS NOT NULL THEN
+    SELECT t.id INTO v_task
+    FROM public.agent_tasks t
+    CROSS JOIN LATERAL jsonb_array_elements_text(t.result->'comment_ids') AS member(comment_id)
+    JOIN public.comment_embeddings member_embedding ON member_embedding.comment_id = member.comment_id::uuid
+    WHERE t.monitored_post_id = p_monitored_post_id
+      AND t.status = 'coalescing'
+    GROUP BY t.id
+    HAVING avg(1 - (member_embedding.embedding <=> v_embedding)) >= p_similarity
+    ORDER BY avg(1 - (member_embedding.embedding <=> v_embedding)) DESC
+    LIMIT 1;
+  END IF;
+
+  IF v_task IS NULL THEN
+    INSERT INTO public.agent_tasks (monitored_post_id, task_type, status, current_step, result, coalesce_until)
+    VALUES (
+      p_monitored_post_id, 'generate_code', 'coalescing',
+      'High-priority feedback detected. Collecting related comments before code generation.',
+      jsonb_build_object('comment_id', p_comment_id, 'comment_ids', jsonb_build_array(p_comment_id), 'priority', p_priority),
+      now() + make_interval(secs => p_window_seconds)
+    )
+    RETURNING id INTO v_task;
+    v_count := 1;
+  ELSE
+    -- comment_id stays the highest-priority member, which the agent falls back to
+    UPDATE public.agent_tasks SET result = result || jsonb_build_object(
+      'comment_ids', (result->'comment_ids') || to_jsonb(p_comment_id::text),
+      'comment_id', CASE WHEN p_priority > coalesce((result->>'priority')::float, 0) THEN to_jsonb(p_comment_id::text) ELSE result->'comment_id' END,
+      'priority', greatest(coalesce((result->>'priority')::float, 0), p_priority)
+    )
+    WHERE id = v_task
+    RETURNING jsonb_array_length(result->'comment_ids') INTO v_count;
+  END IF;
+
+  IF v_count >= p_max_comments OR p_window_seconds <= 0 THEN
+    UPDATE public.agent_tasks SET
+      status = 'pending',
+      coalesce_until = NULL,
+      current_step = format('Coalesced %s related comments. Queued for local code generation.', v_count)
+    WHERE id = v_task;
+    RETURN QUERY SELECT v_task, v_count, true;
+  ELSE
+    RETURN QUERY SELECT v_task, v_count, false;
+  END IF;
+END;
+$$;
+
+-- Release every group whose window has closed; each row is returned to exactly one caller
+CREATE OR REPLACE FUNCTION public.release_coalesced_agent_tasks()
+RETURNS TABLE (
+  task_id uuid,
+  comment_count int
+)
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  UPDATE public.agent_tasks SET
+    status = 'pending',
+    coalesce_until = NULL,
+    current_step = format('Coalesced %s related comments. Queued for local code generation.', jsonb_array_length(result->'comment_ids'))
+  WHERE status = 'coalescing' AND coalesce_until <= now()
+  RETURNING id, jsonb_array_length(result->'comment_ids');
+$$;
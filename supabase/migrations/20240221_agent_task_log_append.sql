@@ -0,0 +1,35 @@
+-- Append agent task log entries in one statement. The backend and the Next.js
+-- agent both log to the same task; a read-modify-write of the whole array from
+-- each side loses entries and costs two round trips per line.
+
+-- Early schemas created logs as jsonb[]; later ones as a jsonb array. Settle on jsonb.
+DO $$
+BEGIN
+  IF (
+    SELECT data_type FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'agent_tasks' AND column_name = 'logs'
+  ) = 'ARRAY' THEN
+    ALTER TABLE public.agent_tasks ALTER COLUMN logs DROP DEFAULT;
+    ALTER TABLE public.agent_tasks ALTER COLUMN logs TYPE jsonb USING to_jsonb(logs);
+    ALTER TABLE public.agent_tasks ALTER COLUMN logs SET DEFAULT '[]'::jsonb;
+  END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.append_agent_task_log(
+  p_task_id uuid,
+  p_entry jsonb,
+  p_status text DEFAULT NULL,
+  p_step text DEFAULT NULL
+)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  UPDATE public.agent_tasks SET
+    logs = coalesce(logs, '[]'::jsonb) || jsonb_build_array(p_entry),
+    last_heartbeat = now(),
+    status = coalesce(p_status, status),
+    current_step = coalesce(p_step, current_step)
+  WHERE id = p_task_id;
+$$;
@@ -0,0 +1,98 @@
+-- comment_jobs is only drained in sharded mode. Comments are enqueued only while the
+-- queue is switched on for a sharded deployment, so single-mode deployments don't build
+-- up a backlog that a later switch to sharded would re-analyze. Agent task leases
+-- are released when /generate finishes instead of being renewed forever.
+
+-- 1. Queue switch, set by an operator when the deployment's worker mode changes (see set_comment_job_queue)
+CREATE TABLE IF NOT EXISTS public.worker_settings (
+  id boolean PRIMARY KEY DEFAULT true CHECK (id), -- Single row
+  comment_queue_enabled boolean NOT NULL DEFAULT false,
+  updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+INSERT INTO public.worker_settings (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION public.enqueue_comment_job()
+RETURNS trigger AS $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM public.worker_settings WHERE comment_queue_enabled) THEN
+    INSERT INTO public.comment_jobs (comment_id) VALUES (NEW.id) ON CONFLICT (comment_id) DO NOTHING;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION public.set_comment_job_queue(p_enabled boolean)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+  UPDATE public.worker_settings SET comment_queue_enabled = p_enabled, updated_at = now();
+  IF p_enabled THEN
+    -- Jobs for comments that were analyzed some other way (single mode, backfill) are not work
+    DELETE FROM public.comment_jobs j
+    WHERE j.status = 'pending'
+      AND EXISTS (SELECT 1 FROM public.feedback_analysis fa WHERE fa.comment_id = j.comment_id);
+  ELSE
+    -- The single-mode listener and backfill own every comment now
+    DELETE FROM public.comment_jobs WHERE status <> 'leased';
+  END IF;
+END;
+$$;
+
+-- 2. Never hand out a comment that already has an analysis
+CREATE OR REPLACE FUNCTION public.claim_comment_jobs(
+  p_worker_id text,
+  p_limit int DEFAULT 10,
+  p_lease_seconds int DEFAULT 300,
+  p_comment_id uuid DEFAULT NULL,
+  p_max_attempts int DEFAULT 5
+)
+RETURNS TABLE (comment_id uuid, content text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH claimable AS (
+    SELECT j.comment_id
+    FROM public.comment_jobs j
+    WHERE (p_comment_id IS NULL OR j.comment_id = p_comment_id)
+      AND j.attempts < p_max_attempts
+      AND (j.status = 'pending' OR (j.status = 'leased' AND j.lease_expires_at < now()))
+      AND NOT EXISTS (SELECT 1 FROM public.feedback_analysis fa WHERE fa.comment_id = j.comment_id)
+    ORDER BY j.updated_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ), claimed AS (
+    UPDATE public.comment_jobs j SET
+      status = 'leased',
+      worker_id = p_worker_id,
+      attempts = j.attempts + 1,
+      lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+      updated_at = now()
+    FROM claimable
+    WHERE j.comment_id = claimable.comment_id
+    RETURNING j.comment_id
+  )
+  SELECT c.id, c.content FROM claimed JOIN public.comments c ON c.id = claimed.comment_id;
+END;
+$$;
+
+-- 3. Give up an agent task lease; p_status (e.g. 'failed') overrides the task status
+CREATE OR REPLACE FUNCTION public.release_agent_task(p_task_id uuid, p_worker_id text, p_status text DEFAULT NULL)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  UPDATE public.agent_tasks SET
+    claimed_by = NULL,
+    status = COALESCE(p_status, status)
+  WHERE id = p_task_id AND claimed_by = p_worker_id;
+$$;
+
+ALTER TABLE public.worker_settings ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Worker settings are viewable by everyone." ON public.worker_settings
+  FOR SELECT USING (true);
@@ -0,0 +1,65 @@
+-- Comments whose analysis fails on every backfill attempt are given up on after
+-- p_max_attempts passes instead of being retried forever.
+
+CREATE TABLE IF NOT EXISTS public.backfill_attempts (
+  comment_id uuid PRIMARY KEY REFERENCES public.comments(id) ON DELETE CASCADE,
+  attempts integer NOT NULL DEFAULT 0,
+  last_attempt_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION public.record_backfill_failures(p_comment_ids uuid[])
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  INSERT INTO public.backfill_attempts (comment_id, attempts)
+  SELECT unnest(p_comment_ids), 1
+  ON CONFLICT (comment_id) DO UPDATE SET
+    attempts = public.backfill_attempts.attempts + 1,
+    last_attempt_at = now();
+$$;
+
+-- Same scan as before, skipping comments that already failed p_max_attempts times.
+-- Dropped first: a new argument would otherwise add an ambiguous overload.
+DROP FUNCTION IF EXISTS public.find_unprocessed_comments(timestamp with time zone, uuid, int, int);
+
+CREATE OR REPLACE FUNCTION public.find_unprocessed_comments(
+  p_after_created_at timestamp with time zone DEFAULT NULL,
+  p_after_id uuid DEFAULT NULL,
+  p_limit int DEFAULT 100,
+  p_min_age_seconds int DEFAULT 120,
+  p_max_attempts int DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  content text,
+  created_at timestamp with time zone,
+  has_embedding boolean,
+  has_analysis boolean
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+  SELECT * FROM (
+    SELECT
+      c.id,
+      c.content,
+      c.created_at,
+      EXISTS (SELECT 1 FROM public.comment_embeddings ce WHERE ce.comment_id = c.id AND ce.embedding IS NOT NULL) AS has_embedding,
+      EXISTS (SELECT 1 FROM public.feedback_analysis fa WHERE fa.comment_id = c.id) AS has_analysis
+    FROM public.comments c
+    WHERE (p_after_created_at IS NULL OR (c.created_at, c.id) > (p_after_created_at, coalesce(p_after_id, '00000000-0000-0000-0000-000000000000'::uuid)))
+      AND c.created_at < now() - make_interval(secs => p_min_age_seconds)
+      AND (p_max_attempts IS NULL OR NOT EXISTS (
+        SELECT 1 FROM public.backfill_attempts ba WHERE ba.comment_id = c.id AND ba.attempts >= p_max_attempts
+      ))
+    ORDER BY c.created_at, c.id
+  ) scanned
+  WHERE NOT (scanned.has_embedding AND scanned.has_analysis)
+  LIMIT p_limit;
+$$;
+
+ALTER TABLE public.backfill_attempts ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Backfill attempts are viewable by everyone." ON public.backfill_attempts
+  FOR SELECT USING (true);
@@ -0,0 +1,123 @@
+-- Safer embedding model switches (see 20240219_embedding_versions.sql).
+-- 1. The ivfflat index on the shadow column is no longer built inside
+--    activate_embedding_model, where it ran into the statement timeout and held
+--    the table. Build it beforehand, outside a transaction:
+--      CREATE INDEX CONCURRENTLY comment_embeddings_embedding_next_idx
+--      ON public.comment_embeddings USING ivfflat (embedding_next vector_cosine_ops)
+--      WITH (lists = 100);
+--    Activation refuses to run until that index exists and is valid.
+-- 2. match_comments is recreated for the new dimension in the activating transaction.
+-- 3. Live vectors from any model other than the active one are rejected, so a node
+--    still serving the old model cannot write into the swapped column.
+
+-- True once the shadow column's index has been built (an interrupted CONCURRENTLY build leaves it invalid)
+CREATE OR REPLACE FUNCTION public.embedding_next_index_ready()
+RETURNS boolean
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+  SELECT EXISTS (
+    SELECT 1 FROM pg_index i
+    WHERE i.indexrelid = to_regclass('public.comment_embeddings_embedding_next_idx')
+      AND i.indisvalid
+  );
+$$;
+
+CREATE OR REPLACE FUNCTION public.activate_embedding_model(p_model_id text)
+RETURNS boolean
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  dims integer;
+BEGIN
+  SELECT dimensions INTO dims FROM public.embedding_models WHERE model_id = p_model_id AND state = 'building';
+  IF dims IS NULL THEN
+    RAISE EXCEPTION 'Embedding model % is not being built', p_model_id;
+  END IF;
+  IF NOT public.embedding_next_index_ready() THEN
+    RAISE EXCEPTION 'Build comment_embeddings_embedding_next_idx CONCURRENTLY before activating %', p_model_id;
+  END IF;
+
+  -- Blocks writers (readers keep going) so nothing lands in the old column after the check
+  LOCK TABLE public.comment_embeddings IN SHARE ROW EXCLUSIVE MODE;
+  IF EXISTS (SELECT 1 FROM public.comment_embeddings WHERE next_model_id IS DISTINCT FROM p_model_id) THEN
+    RETURN false;
+  END IF;
+
+  ALTER TABLE public.comment_embeddings DROP COLUMN embedding;
+  ALTER TABLE public.comment_embeddings DROP COLUMN model_id;
+  ALTER TABLE public.comment_embeddings RENAME COLUMN embedding_next TO embedding;
+  ALTER TABLE public.comment_embeddings RENAME COLUMN next_model_id TO model_id;
+  ALTER INDEX public.comment_embeddings_embedding_next_idx RENAME TO comment_embeddings_embedding_idx;
+
+  -- The query vector's type carries the dimension, so the search RPC moves with the column
+  DROP FUNCTION IF EXISTS public.match_comments(vector, double precision, integer);
+  EXECUTE format($fn$
+    CREATE FUNCTION public.match_comments(
+      query_embedding vector(%s),
+      match_threshold FLOAT DEFAULT 0.7,
+      match_count INT DEFAULT 10
+    )
+    RETURNS TABLE (
+      comment_id UUID,
+      content TEXT,
+      similarity FLOAT,
+      repo_link TEXT
+    )
+    LANGUAGE plpgsql
+    AS $body$
+    BEGIN
+      RETURN QUERY
+      SELECT
+        ce.comment_id,
+        c.content,
+        1 - (ce.embedding <=> query_embedding) as similarity,
+        p.repo_link
+      FROM comment_embeddings ce
+      JOIN comments c ON ce.comment_id = c.id
+      JOIN posts p ON c.post_id = p.id
+      WHERE 1 - (ce.embedding <=> query_embedding) > match_threshold
+      ORDER BY ce.embedding <=> query_embedding
+      LIMIT match_count;
+    END;
+    $body$
+  $fn$, dims);
+
+  UPDATE public.embedding_models SET state = 'retired' WHERE state = 'active';
+  UPDATE public.embedding_models SET state = 'active', activated_at = now() WHERE model_id = p_model_id;
+  NOTIFY pgrst, 'reload schema';
+  RETURN true;
+END;
+$$;
+
+-- Reject live embeddings tagged with a model other than the active one
+CREATE OR REPLACE FUNCTION public.check_embedding_model()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  active text;
+BEGIN
+  IF NEW.embedding IS NULL THEN
+    RETURN NEW;
+  END IF;
+  -- Re-embed writes only touch the shadow column
+  IF TG_OP = 'UPDATE' AND NEW.embedding IS NOT DISTINCT FROM OLD.embedding AND NEW.model_id IS NOT DISTINCT FROM OLD.model_id THEN
+    RETURN NEW;
+  END IF;
+  -- A fresh snapshot per statement, so a write that waited on activate_embedding_model sees the new model
+  SELECT model_id INTO active FROM public.embedding_models WHERE state = 'active';
+  IF active IS NOT NULL AND NEW.model_id IS DISTINCT FROM active THEN
+    RAISE EXCEPTION 'Embedding from % rejected: the active embedding model is %', COALESCE(NEW.model_id, 'an unknown model'), active
+      USING ERRCODE = 'check_violation';
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS comment_embeddings_check_model ON public.comment_embeddings;
+CREATE TRIGGER comment_embeddings_check_model
+  BEFORE INSERT OR UPDATE ON public.comment_embeddings
+  FOR EACH ROW EXECUTE FUNCTION public.check_embedding_model();
@@ -0,0 +1,215 @@
+-- Keep post_feedback_aggregates exact (see 20240215_post_feedback_aggregates.sql).
+-- The aggregate was only folded by an AFTER INSERT trigger and feedback_analysis
+-- allowed several rows per comment, so a re-analysis counted a comment twice and
+-- updates or deletes (including comment cascades) were never subtracted.
+-- Now each comment has one analysis (writers upsert on comment_id), and every
+-- insert, update and delete folds the difference into the aggregate.
+
+DROP TRIGGER IF EXISTS post_aggregate_on_analysis ON public.feedback_analysis;
+
+-- 1. One analysis per comment: keep the latest
+DELETE FROM public.feedback_analysis fa
+USING public.feedback_analysis newer
+WHERE newer.comment_id = fa.comment_id
+  AND (newer.analyzed_at, newer.id) > (fa.analyzed_at, fa.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS feedback_analysis_comment_id_idx ON public.feedback_analysis (comment_id);
+
+-- 2. Fold one analysis into (p_sign = 1) or out of (p_sign = -1) its post's aggregate row
+DROP FUNCTION IF EXISTS public.apply_feedback_to_post_aggregate(uuid, double precision, text, double precision, text, text[]);
+
+CREATE OR REPLACE FUNCTION public.apply_feedback_to_post_aggregate(
+  p_comment_id uuid,
+  p_sentiment double precision,
+  p_category text,
+  p_priority double precision,
+  p_summary text,
+  p_keywords text[],
+  p_sign int
+)
+RETURNS void AS $$
+DECLARE
+  top_k CONSTANT int := 10;
+  max_keywords CONSTANT int := 200;
+  v_post_id uuid;
+  v_content text;
+  v_bucket text;
+  v_category text;
+  v_keyword text;
+  agg public.post_feedback_aggregates%ROWTYPE;
+BEGIN
+  SELECT post_id, content INTO v_post_id, v_content FROM public.comments WHERE id = p_comment_id;
+  IF v_post_id IS NULL THEN
+    -- A cascade from a deleted comment: it was subtracted by post_aggregate_on_comment_delete
+    RETURN;
+  END IF;
+
+  -- Row lock serializes concurrent updates for the same post
+  IF p_sign > 0 THEN
+    INSERT INTO public.post_feedback_aggregates (post_id) VALUES (v_post_id) ON CONFLICT (post_id) DO NOTHING;
+  END IF;
+  SELECT * INTO agg FROM public.post_feedback_aggregates WHERE post_id = v_post_id FOR UPDATE;
+  IF NOT FOUND THEN
+    -- Nothing to subtract from (or the post is being deleted)
+    RETURN;
+  END IF;
+
+  p_sentiment := coalesce(p_sentiment, 0);
+  v_category := coalesce(p_category, 'general');
+  v_bucket := CASE
+    WHEN p_sentiment <= -0.6 THEN 'very_negative'
+    WHEN p_sentiment <= -0.2 THEN 'negative'
+    WHEN p_sentiment < 0.2 THEN 'neutral'
+    WHEN p_sentiment < 0.6 THEN 'positive'
+    ELSE 'very_positive'
+  END;
+
+  agg.comment_count := greatest(agg.comment_count + p_sign, 0);
+  agg.sentiment_sum := agg.sentiment_sum + p_sign * p_sentiment;
+  agg.sentiment_histogram := jsonb_set(
+    agg.sentiment_histogram, ARRAY[v_bucket],
+    to_jsonb(greatest(coalesce((agg.sentiment_histogram->>v_bucket)::int, 0) + p_sign, 0))
+  );
+  agg.category_counts := jsonb_set(
+    agg.category_counts, ARRAY[v_category],
+    to_jsonb(coalesce((agg.category_counts->>v_category)::int, 0) + p_sign)
+  );
+  IF (agg.category_counts->>v_category)::int <= 0 THEN
+    agg.category_counts := agg.category_counts - v_category;
+  END IF;
+
+  FOREACH v_keyword IN ARRAY coalesce(p_keywords, ARRAY[]::text[]) LOOP
+    v_keyword := lower(trim(v_keyword));
+    CONTINUE WHEN v_keyword = '';
+    agg.keyword_counts := jsonb_set(
+      agg.keyword_counts, ARRAY[v_keyword],
+      to_jsonb(coalesce((agg.keyword_counts->>v_keyword)::int, 0) + p_sign)
+    );
+    -- Also drops keywords that were pruned while this analysis still counted
+    IF (agg.keyword_counts->>v_keyword)::int <= 0 THEN
+      agg.keyword_counts := agg.keyword_counts - v_keyword;
+    END IF;
+  END LOOP;
+
+  -- Keep keyword map bounded (prune in bulk to amortize the cost)
+  IF (SELECT count(*) FROM jsonb_object_keys(agg.keyword_counts)) > 2 * max_keywords THEN
+    SELECT coalesce(jsonb_object_agg(key, value), '{}'::jsonb) INTO agg.keyword_counts
+    FROM (
+      SELECT key, value FROM jsonb_each(agg.keyword_counts)
+      ORDER BY (value)::int DESC LIMIT max_keywords
+    ) kept;
+  END IF;
+
+  IF p_sign > 0 THEN
+    SELECT coalesce(jsonb_agg(entry ORDER BY (entry->>'priority_score')::float DESC), '[]'::jsonb) INTO agg.top_comments
+    FROM (
+      SELECT entry FROM (
+        SELECT e AS entry FROM jsonb_array_elements(agg.top_comments) e
+        WHERE e->>'comment_id' <> p_comment_id::text
+        UNION ALL
+        SELECT jsonb_build_object(
+          'comment_id', p_comment_id,
+          'content', v_content,
+          'priority_score', coalesce(p_priority, 0),
+          'sentiment_score', p_sentiment,
+          'category', v_category,
+          'actionable_summary', coalesce(p_summary, '')
+        )
+      ) candidates
+      ORDER BY (entry->>'priority_score')::float DESC
+      LIMIT top_k
+    ) top;
+  ELSIF agg.top_comments @> jsonb_build_array(jsonb_build_object('comment_id', p_comment_id)) THEN
+    -- A top comment left: refill the top-K from the post's other analyses
+    SELECT coalesce(jsonb_agg(entry ORDER BY (entry->>'priority_score')::float DESC), '[]'::jsonb) INTO agg.top_comments
+    FROM (
+      SELECT jsonb_build_object(
+        'comment_id', fa.comment_id,
+        'content', c.content,
+        'priority_score', coalesce(fa.priority_score, 0),
+        'sentiment_score', coalesce(fa.sentiment_score, 0),
+        'category', coalesce(fa.category, 'general'),
+        'actionable_summary', coalesce(fa.actionable_summary, '')
+      ) AS entry
+      FROM public.feedback_analysis fa
+      JOIN public.comments c ON c.id = fa.comment_id
+      WHERE c.post_id = v_post_id AND fa.comment_id <> p_comment_id
+      ORDER BY fa.priority_score DESC NULLS LAST
+      LIMIT top_k
+    ) top;
+  END IF;
+
+  UPDATE public.post_feedback_aggregates SET
+    comment_count = agg.comment_count,
+    sentiment_sum = agg.sentiment_sum,
+    sentiment_histogram = agg.sentiment_histogram,
+    category_counts = agg.category_counts,
+    keyword_counts = agg.keyword_counts,
+    top_comments = agg.top_comments,
+    updated_at = timezone('utc'::text, now())
+  WHERE post_id = v_post_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- 3. Fold every change: an update subtracts the old analysis and adds the new one
+CREATE OR REPLACE FUNCTION public.trigger_post_aggregate_on_analysis()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.apply_feedback_to_post_aggregate(
+      OLD.comment_id, OLD.sentiment_score, OLD.category,
+      OLD.priority_score, OLD.actionable_summary, OLD.keywords, -1
+    );
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.apply_feedback_to_post_aggregate(
+      NEW.comment_id, NEW.sentiment_score, NEW.category,
+      NEW.priority_score, NEW.actionable_summary, NEW.keywords, 1
+    );
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE TRIGGER post_aggregate_on_analysis
+AFTER INSERT OR UPDATE OR DELETE ON public.feedback_analysis
+FOR EACH ROW
+EXECUTE FUNCTION public.trigger_post_aggregate_on_analysis();
+
+-- The analysis row is cascade-deleted after its comment, when the comment's post
+-- can no longer be looked up, so subtract it while the comment still exists
+CREATE OR REPLACE FUNCTION public.trigger_post_aggregate_on_comment_delete()
+RETURNS trigger AS $$
+DECLARE
+  fa record;
+BEGIN
+  FOR fa IN SELECT * FROM public.feedback_analysis WHERE comment_id = OLD.id LOOP
+    PERFORM public.apply_feedback_to_post_aggregate(
+      fa.comment_id, fa.sentiment_score, fa.category,
+      fa.priority_score, fa.actionable_summary, fa.keywords, -1
+    );
+  END LOOP;
+  RETURN OLD;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS post_aggregate_on_comment_delete ON public.comments;
+CREATE TRIGGER post_aggregate_on_comment_delete
+BEFORE DELETE ON public.comments
+FOR EACH ROW
+EXECUTE FUNCTION public.trigger_post_aggregate_on_comment_delete();
+
+-- 4. Rebuild from the deduplicated analyses
+DELETE FROM public.post_feedback_aggregates;
+
+DO $$
+DECLARE
+  fa record;
+BEGIN
+  FOR fa IN SELECT * FROM public.feedback_analysis ORDER BY analyzed_at LOOP
+    PERFORM public.apply_feedback_to_post_aggregate(
+      fa.comment_id, fa.sentiment_score, fa.category,
+      fa.priority_score, fa.actionable_summary, fa.keywords, 1
+    );
+  END LOOP;
+END $$;